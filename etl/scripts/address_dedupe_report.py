@@ -0,0 +1,83 @@
+#!/usr/local/bin/python3
+
+import argparse
+import warnings
+
+warnings.filterwarnings("ignore")
+
+import pandas as pd
+
+from etl import logger
+from etl.utils import read_table_from_database
+from etl.geocoding import normalize_address
+from etl.transformer import CONFIG, ADDRESS_CANONICALIZER
+
+
+def dedupe_report(addresses: pd.Series, top: int) -> pd.DataFrame:
+    """
+    Prints the number of distinct addresses, normalized addresses and
+    canonical keys together with the dedupe ratio of the canonicalization
+
+    Args:
+        addresses (pd.Series):
+            Addresses (e.g. the address_info column of the addresses table)
+        top (int):
+            Number of the largest groups of spellings to be printed
+
+    Returns:
+        pd.DataFrame:
+            Dataframe with the address_info, normalized address and key
+    """
+    df = pd.DataFrame({"address_info": addresses.dropna().drop_duplicates()})
+    df["normalized"] = df["address_info"].map(normalize_address)
+    df["key"] = df["address_info"].map(ADDRESS_CANONICALIZER.canonicalize)
+
+    n_addresses = len(df)
+    n_normalized = df["normalized"].nunique()
+    n_keys = df["key"].nunique()
+    ratio = n_addresses / max(1, n_keys)
+    print(f"{'distinct addresses':<24}{n_addresses:>10}")
+    print(f"{'normalized addresses':<24}{n_normalized:>10}")
+    print(f"{'canonical keys':<24}{n_keys:>10}")
+    print(f"{'dedupe ratio':<24}{ratio:>10.3f}")
+    print(f"{'saved geocode calls':<24}{n_addresses - n_keys:>10}")
+    logger.info(
+        f"Address dedupe: {n_addresses} addresses, {n_normalized} normalized, "
+        + f"{n_keys} canonical keys, dedupe ratio {ratio:.3f}"
+    )
+
+    sizes = df["key"].value_counts()
+    for key in sizes[sizes > 1].index[:top]:
+        print(f"\n{key} ({sizes[key]} spellings)")
+        for address in df.loc[df["key"] == key, "address_info"]:
+            print(f"    {address}")
+    return df
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-f",
+        "--file",
+        help="CSV file with the address_info column. Default: the addresses "
+        + "table of the source database",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "-t",
+        "--top",
+        help="Number of the largest groups of spellings to print. Default: 10",
+        default=10,
+        type=int,
+    )
+    args = parser.parse_args()
+
+    if args.file != None:
+        addresses = pd.read_csv(args.file)["address_info"]
+    else:
+        addresses = read_table_from_database(
+            table_name=CONFIG["address_info"]["table_name"], is_source_db=True
+        )["address_info"]
+    dedupe_report(addresses=addresses, top=args.top)
@@ -0,0 +1,147 @@
+#!/usr/local/bin/python3
+
+import os
+import glob
+import time
+import zlib
+import sqlite3
+import argparse
+import resource
+import warnings
+import statistics
+from multiprocessing import get_context
+
+warnings.filterwarnings("ignore")
+
+from etl import logger, CONFIG_PATH, STORAGE_PATH
+from etl.utils import read_yaml
+from etl.extractors import get_extractor
+
+
+def read_pages(pages_dir: str | None, limit: int) -> list[str]:
+    """
+    Reads saved offer pages either from the directory with html files
+    or from the response cache of the parser
+
+    Args:
+        pages_dir (str | None):
+            Directory with html files. If None - cached offer pages are
+            used
+        limit (int):
+            Maximum number of pages to be read
+
+    Returns:
+        list[str]:
+            Html content of the pages
+    """
+    pages = []
+    if pages_dir != None:
+        for path in sorted(glob.glob(os.path.join(pages_dir, "*.html")))[:limit]:
+            with open(path, "r", encoding="utf-8") as f:
+                pages.append(f.read())
+    else:
+        path = STORAGE_PATH / "http_cache"
+        db = sqlite3.connect(path / "index.sqlite")
+        rows = db.execute(
+            "SELECT digest, encoding FROM entries WHERE url_class='offer' LIMIT ?",
+            (limit,),
+        ).fetchall()
+        for digest, encoding in rows:
+            with open(path / "objects" / digest[:2] / digest, "rb") as f:
+                pages.append(zlib.decompress(f.read()).decode(encoding or "utf-8"))
+    return pages
+
+
+def run_backend(name: str, pages: list[str], repeat: int) -> dict:
+    """
+    Parses all pages with the specified backend. Runs in a separate
+    process so that the peak memory of each backend is measured
+    independently
+
+    Args:
+        name (str):
+            Name of the backend (see bs_parser in config)
+        pages (list[str]):
+            Html content of the pages
+        repeat (int):
+            Number of times each page is parsed
+
+    Returns:
+        dict:
+            Parse times per page, peak memory increase and parsed content
+    """
+    fields = read_yaml(path=CONFIG_PATH, verbose=False)["extraction"]
+    extractor = get_extractor(name=name, fields=fields["parsing_fields"]["sub_fields"])
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    times, content = [], []
+    for page in pages:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            output = extractor.parse(html=page)
+        times.append((time.perf_counter() - start) / repeat)
+        content.append(output)
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"times": times, "peak_kb": rss_after - rss_before, "content": content}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-d",
+        "--pages-dir",
+        help="Directory with saved offer pages (*.html). Default: cached offer "
+        + "pages of the parser",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "-b",
+        "--backends",
+        help="Comma separated backends to compare. "
+        + "Default: html.parser,lxml,html5lib,lxml.html,selectolax",
+        default="html.parser,lxml,html5lib,lxml.html,selectolax",
+        type=str,
+    )
+    parser.add_argument(
+        "-n",
+        "--limit",
+        help="Maximum number of pages. Default: 200",
+        default=200,
+        type=int,
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        help="Number of times each page is parsed. Default: 3",
+        default=3,
+        type=int,
+    )
+
+    args = parser.parse_args()
+
+    pages = read_pages(pages_dir=args.pages_dir, limit=args.limit)
+    logger.info(f"Benchmarking html parser backends on {len(pages)} pages")
+
+    reference = None
+    ctx = get_context("spawn")
+    print(f"{'backend':<14}{'mean, ms':>10}{'p95, ms':>10}{'peak, MB':>10}{'same':>8}")
+    for name in args.backends.split(","):
+        try:
+            with ctx.Pool(processes=1) as pool:
+                result = pool.apply(run_backend, (name, pages, args.repeat))
+        except Exception as e:
+            logger.warning(f"Backend '{name}' is skipped. Error: {e}")
+            continue
+        if reference == None:
+            reference = result["content"]
+        n_same = sum(x == y for x, y in zip(result["content"], reference))
+        times = sorted(result["times"])
+        p95 = times[int(0.95 * (len(times) - 1))] if len(times) > 0 else 0.0
+        line = (
+            f"{name:<14}{1000 * statistics.fmean(times or [0.0]):>10.2f}"
+            + f"{1000 * p95:>10.2f}{result['peak_kb'] / 1024:>10.1f}"
+            + f"{n_same:>5}/{len(pages):<3}"
+        )
+        print(line)
+        logger.info(f"Benchmark: {line}")
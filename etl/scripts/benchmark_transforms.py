@@ -0,0 +1,116 @@
+#!/usr/local/bin/python3
+
+import time
+import random
+import argparse
+import warnings
+
+warnings.filterwarnings("ignore")
+
+import pandas as pd
+
+from etl import logger
+from etl import transformer
+
+
+# Variants of the raw records which are sampled into the benchmark data
+FLAT_TYPES = [
+    "1-комнатная квартира",
+    "2-комнатная квартира",
+    "3-комнатная квартира",
+    "квартира-студия",
+    "апартаменты-студия",
+]
+MAIN_INFO = [
+    "45 м²общая",
+    "32,5 м²общая",
+    "3 этаж из 9",
+    "12 этаж из 25",
+    "потолки 2,7 м",
+    "1975 год постройки",
+]
+FEE_INFO = [
+    ["есть", "100 %", "включены", "45 000 ₽"],
+    ["30 000 ₽", "50 %", "не включены", "30 000 ₽"],
+    ["0 ₽", "0 %", "включены", "120 000 ₽"],
+]
+EXTRA_FEATURES = [
+    phrase
+    for config in transformer.CONFIG["extra_features"]["features"].values()
+    for phrase in config["values"]
+]
+
+
+def sample_raw_data(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Samples raw data with the flat_type, main_info, fee_info and
+    extra_features fields
+
+    Args:
+        n_rows (int):
+            Number of rows
+        seed (int, default 0):
+            Seed of the sampling
+
+    Returns:
+        pd.DataFrame:
+            Raw data
+    """
+    rng = random.Random(seed)
+    return pd.DataFrame(
+        {
+            "flat_type": [rng.choice(FLAT_TYPES) for _ in range(n_rows)],
+            "main_info": [
+                rng.sample(MAIN_INFO, rng.randint(2, len(MAIN_INFO)))
+                for _ in range(n_rows)
+            ],
+            "fee_info": [list(rng.choice(FEE_INFO)) for _ in range(n_rows)],
+            "extra_features": [
+                rng.sample(EXTRA_FEATURES, rng.randint(0, 15)) for _ in range(n_rows)
+            ],
+        }
+    )
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n",
+        "--rows",
+        help="Number of rows. Default: 100000",
+        default=100000,
+        type=int,
+    )
+    args = parser.parse_args()
+
+    df = sample_raw_data(n_rows=args.rows)
+    logger.info(f"Benchmarking transforms on {len(df)} rows")
+
+    print(
+        f"{'feature':<16}{'per row, s':>12}{'vectorized, s':>15}"
+        + f"{'speedup':>9}{'same':>6}"
+    )
+    for feature in ["flat_type", "main_info", "fee_info", "extra_features"]:
+        config = transformer.CONFIG[feature]
+        func = getattr(transformer, config["transform_func"])
+        vectorized_func = getattr(transformer, config["vectorized_transform_func"])
+
+        # Transforming per observation as RealtyYaTransformer.transform does
+        start = time.perf_counter()
+        expected = pd.DataFrame(
+            df[feature].apply(lambda x: func(raw_content=x)).tolist(), index=df.index
+        )
+        time_per_row = time.perf_counter() - start
+
+        start = time.perf_counter()
+        output = vectorized_func(series=df[feature])
+        time_vectorized = time.perf_counter() - start
+
+        expected.columns = output.columns
+        line = (
+            f"{feature:<16}{time_per_row:>12.2f}{time_vectorized:>15.2f}"
+            + f"{time_per_row / time_vectorized:>9.1f}{str(expected.equals(output)):>6}"
+        )
+        print(line)
+        logger.info(f"Benchmark: {line}")
@@ -0,0 +1,46 @@
+#!/usr/local/bin/python3
+
+import argparse
+import warnings
+
+warnings.filterwarnings("ignore")
+
+from etl.utils import boolean
+from etl.parser import RealtyYaParser
+from etl.work_queue import WorkQueue, CrawlCoordinator, CrawlWorker
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "-s",
+    "--seed",
+    help="Whether to seed the work-queue with the listing pages before "
+    + "processing tasks. Exactly one process (the coordinator) should seed "
+    + "the queue. Default: False",
+    default=False,
+    type=boolean,
+)
+parser.add_argument(
+    "-w",
+    "--work",
+    help="Whether to process tasks from the work-queue until it is drained. "
+    + "Default: True",
+    default=True,
+    type=boolean,
+)
+parser.add_argument(
+    "-id",
+    "--worker-id",
+    help="Id of the worker. Default: hostname and pid",
+    default=None,
+    type=str,
+)
+
+args = parser.parse_args()
+
+realty_parser = RealtyYaParser()
+queue = WorkQueue(config=realty_parser.config["distributed"])
+if args.seed:
+    CrawlCoordinator(parser=realty_parser, queue=queue).seed()
+if args.work:
+    CrawlWorker(parser=realty_parser, queue=queue, worker_id=args.worker_id).run()
@@ -21,8 +21,8 @@ parser.add_argument(
     "-t",
     "--transform",
     help="Whether to transform data. If --parse is True - newly parsed "
-    + "data is transformed, else - the parsed data at the curren day. "
-    + "Default: True",
+    + "data is transformed, else - the parsed data at the curren day "
+    + "(or at --reextract-date). Default: True",
     default=True,
     type=boolean,
 )
@@ -43,6 +43,33 @@ parser.add_argument(
     type=boolean,
 )
 
+parser.add_argument(
+    "-fc",
+    "--fresh-crawl",
+    help="Whether to start a fresh crawl instead of resuming the interrupted "
+    + "crawl of the same day (if extraction.checkpoint is enabled). Default: False",
+    default=False,
+    type=boolean,
+)
+parser.add_argument(
+    "-rd",
+    "--reextract-date",
+    help="Date (YYYY-MM-DD) at which the archived offer pages are parsed again "
+    + "with the current parsing fields instead of crawling new data. The data "
+    + "of that date is replaced in both databases. Default: None",
+    default=None,
+    type=str,
+)
+parser.add_argument(
+    "-tb",
+    "--time-budget",
+    help="Time budget of the crawl in minutes. New offers are requested first, "
+    + "then changed offers, then refreshes, and the crawl stops at the deadline "
+    + "with the collected data saved. Default: None (no limit)",
+    default=None,
+    type=float,
+)
+
 args = parser.parse_args()
 
 run_etl_pipeline(
@@ -50,4 +77,7 @@ run_etl_pipeline(
     transform=args.transform,
     overwrite_source=args.overwrite_source,
     overwrite_destination=args.overwrite_destination,
+    fresh_crawl=args.fresh_crawl,
+    reextract_date=args.reextract_date,
+    time_budget=args.time_budget,
 )
@@ -0,0 +1,230 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+from etl import logger
+from etl.crawler import init_parse_worker, parse_in_worker
+
+
+class HtmlArchive:
+    """
+    Archive of the fetched offer pages. Pages of each day are appended to
+    a single segment file as independent zstd frames, while an sqlite
+    index maps (date_parsed, offer_id) to the offset and size of the
+    frame. The archive allows to re-extract the content of a day with
+    updated parsing fields without crawling the site again
+    """
+
+    def __init__(self, config: dict, path: Path):
+        """
+        Initializes HtmlArchive
+
+        Args:
+            config (dict):
+                Dictionary with the archive config
+            path (Path):
+                Path to the archive directory
+
+        Parameters:
+            stats (dict):
+                Number of archived pages and their raw and compressed size
+        """
+        import zstandard
+
+        self.config = config
+        self.path = path
+        self.compressor = zstandard.ZstdCompressor(level=config["compression_level"])
+        self.decompressor = zstandard.ZstdDecompressor()
+        self.stats = {"pages": 0, "raw_bytes": 0, "compressed_bytes": 0}
+        self.lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+        self.db = sqlite3.connect(self.path / "index.sqlite", check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            + "date_parsed TEXT, offer_id INTEGER, offset INTEGER, size INTEGER, "
+            + "PRIMARY KEY (date_parsed, offer_id))"
+        )
+        self.db.commit()
+        self.remove_expired()
+
+    def segment_path(self, date_parsed: str) -> Path:
+        """Path to the segment file of the day"""
+        return self.path / f"{date_parsed}.zst"
+
+    def remove_expired(self):
+        """Removes segments which are older than retention_days"""
+        threshold = datetime.now().date() - timedelta(days=self.config["retention_days"])
+        threshold = threshold.strftime("%Y-%m-%d")
+        with self.lock:
+            dates = [
+                x[0]
+                for x in self.db.execute(
+                    "SELECT DISTINCT date_parsed FROM records WHERE date_parsed < ?",
+                    (threshold,),
+                ).fetchall()
+            ]
+            for date_parsed in dates:
+                if os.path.exists(self.segment_path(date_parsed)):
+                    os.remove(self.segment_path(date_parsed))
+            self.db.execute("DELETE FROM records WHERE date_parsed < ?", (threshold,))
+            self.db.commit()
+        if len(dates) > 0:
+            logger.info(f"Archived pages of {len(dates)} expired days have been removed")
+
+    def store(self, offer_id: int, html: str, date_parsed: str | None = None):
+        """
+        Appends the offer page to the segment of the day (unless the page
+        of the offer is already archived for that day)
+
+        Args:
+            offer_id (int):
+                Id of the offer
+            html (str):
+                Html content of the offer page
+            date_parsed (str | None, default None):
+                Date in the format %Y-%m-%d (the current date if None)
+        """
+        date_parsed = date_parsed or datetime.now().date().strftime("%Y-%m-%d")
+        raw = html.encode("utf-8")
+        frame = self.compressor.compress(raw)
+        with self.lock:
+            if (
+                self.db.execute(
+                    "SELECT 1 FROM records WHERE date_parsed=? AND offer_id=?",
+                    (date_parsed, offer_id),
+                ).fetchone()
+                != None
+            ):
+                return
+            with open(self.segment_path(date_parsed), "ab") as f:
+                offset = f.tell()
+                f.write(frame)
+            self.db.execute(
+                "INSERT INTO records VALUES (?, ?, ?, ?)",
+                (date_parsed, offer_id, offset, len(frame)),
+            )
+            self.db.commit()
+            self.stats["pages"] += 1
+            self.stats["raw_bytes"] += len(raw)
+            self.stats["compressed_bytes"] += len(frame)
+
+    def offer_ids(self, date_parsed: str) -> list[int]:
+        """Ids of the offers archived at the day"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT offer_id FROM records WHERE date_parsed=? ORDER BY offset",
+                (date_parsed,),
+            ).fetchall()
+        return [x[0] for x in rows]
+
+    def read(self, date_parsed: str, offer_id: int) -> str | None:
+        """
+        Reads the archived offer page
+
+        Args:
+            date_parsed (str):
+                Date in the format %Y-%m-%d
+            offer_id (int):
+                Id of the offer
+
+        Returns:
+            str | None:
+                Html content of the offer page (None if it is not archived)
+        """
+        with self.lock:
+            row = self.db.execute(
+                "SELECT offset, size FROM records WHERE date_parsed=? AND offer_id=?",
+                (date_parsed, offer_id),
+            ).fetchone()
+        if row == None:
+            return None
+        with open(self.segment_path(date_parsed), "rb") as f:
+            f.seek(row[0])
+            return self.decompressor.decompress(f.read(row[1])).decode("utf-8")
+
+    def iter_pages(self, date_parsed: str):
+        """
+        Reads all archived offer pages of the day sequentially
+
+        Args:
+            date_parsed (str):
+                Date in the format %Y-%m-%d
+
+        Yields:
+            tuple[int, str]:
+                Id of the offer and html content of the offer page
+        """
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT offer_id, offset, size FROM records WHERE date_parsed=? "
+                + "ORDER BY offset",
+                (date_parsed,),
+            ).fetchall()
+        if len(rows) == 0:
+            return
+        with open(self.segment_path(date_parsed), "rb") as f:
+            for offer_id, offset, size in rows:
+                f.seek(offset)
+                yield offer_id, self.decompressor.decompress(f.read(size)).decode(
+                    "utf-8"
+                )
+
+    def reextract(
+        self,
+        date_parsed: str,
+        parser: str,
+        fields: dict,
+        state_config: dict | None = None,
+    ) -> list[list]:
+        """
+        Parses all archived offer pages of the day in parallel
+
+        Args:
+            date_parsed (str):
+                Date in the format %Y-%m-%d
+            parser (str):
+                Name of the extractor (see bs_parser in config)
+            fields (dict):
+                Dictionary with the parsing fields
+            state_config (dict | None, default None):
+                Dictionary with the embedded_state config
+
+        Returns:
+            list[list]:
+                Parsed content of each offer with the offer_id appended.
+                Offers which could not be parsed are skipped
+        """
+        content = []
+        chunk_size = self.config["reextract_chunk_size"]
+        pages = self.iter_pages(date_parsed=date_parsed)
+        with ProcessPoolExecutor(
+            max_workers=self.config["reextract_workers"],
+            initializer=init_parse_worker,
+            initargs=(parser, fields, state_config),
+        ) as executor:
+            while True:
+                chunk = [x for _, x in zip(range(chunk_size), pages)]
+                if len(chunk) == 0:
+                    break
+                offer_ids = [offer_id for offer_id, _ in chunk]
+                for offer_id, (content_, _) in zip(
+                    offer_ids,
+                    executor.map(parse_in_worker, [html for _, html in chunk]),
+                ):
+                    if content_ == None:
+                        logger.info(f"Offer {offer_id} : unable to parse content")
+                    else:
+                        content.append(content_ + [str(offer_id)])
+        return content
+
+    def log_stats(self):
+        """Logs the number and the compression ratio of the archived pages"""
+        ratio = self.stats["raw_bytes"] / max(1, self.stats["compressed_bytes"])
+        logger.info(
+            f"HTML archive: {self.stats['pages']} pages archived, "
+            + f"{self.stats['compressed_bytes'] / 1024 / 1024:.1f} MB, "
+            + f"compression ratio {ratio:.1f}"
+        )
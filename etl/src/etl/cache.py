@@ -0,0 +1,257 @@
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+import requests
+from pathlib import Path
+from requests.structures import CaseInsensitiveDict
+
+from etl import logger
+
+
+class ResponseCache:
+    """
+    Content-addressed on-disk cache of HTTP responses. Bodies are stored
+    zlib-compressed under the sha256 of their content, while an sqlite
+    index maps each url to its body, validators (ETag, Last-Modified)
+    and access times. Entries expire according to the TTL of their url
+    class and the least recently used entries are evicted when the
+    cache exceeds the configured size
+    """
+
+    def __init__(self, config: dict, path: Path):
+        """
+        Initializes ResponseCache
+
+        Args:
+            config (dict):
+                Dictionary with the cache config
+            path (Path):
+                Path to the cache directory
+
+        Parameters:
+            stats (dict):
+                Number of fresh hits, revalidated hits and misses
+        """
+        self.config = config
+        self.path = path
+        self.max_size = int(self.config["max_size_mb"] * 1024 * 1024)
+        self.stats = {"hits": 0, "revalidated": 0, "misses": 0}
+        self.lock = threading.Lock()
+        os.makedirs(self.path / "objects", exist_ok=True)
+        self.db = sqlite3.connect(self.path / "index.sqlite", check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            + "url TEXT PRIMARY KEY, digest TEXT, url_class TEXT, "
+            + "stored_at REAL, accessed_at REAL, size INTEGER, "
+            + "etag TEXT, last_modified TEXT, encoding TEXT)"
+        )
+        self.db.commit()
+        self.size = sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(self.path / "objects")
+            for name in names
+        )
+
+    def object_path(self, digest: str) -> Path:
+        """Path to the compressed body with the specified digest"""
+        return self.path / "objects" / digest[:2] / digest
+
+    def lookup(self, url: str, url_class: str) -> tuple[dict | None, bool]:
+        """
+        Looks up the cached entry for the url
+
+        Args:
+            url (str):
+                Requested url
+            url_class (str):
+                Class of the url which defines the TTL (see config)
+
+        Returns:
+            tuple[dict | None, bool]:
+                Cached entry (None if there is no entry) and whether
+                it is still fresh
+        """
+        with self.lock:
+            row = self.db.execute(
+                "SELECT digest, stored_at, etag, last_modified, encoding "
+                + "FROM entries WHERE url=?",
+                (url,),
+            ).fetchone()
+        if row == None or not os.path.exists(self.object_path(row[0])):
+            return None, False
+        entry = dict(zip(["digest", "stored_at", "etag", "last_modified"], row))
+        entry["encoding"] = row[4]
+        is_fresh = time.time() - entry["stored_at"] < self.config["ttl"][url_class]
+        if is_fresh:
+            self.stats["hits"] += 1
+            self.touch(url=url)
+        return entry, is_fresh
+
+    @staticmethod
+    def conditional_headers(entry: dict) -> dict:
+        """
+        Builds headers for the conditional revalidation of the entry
+
+        Args:
+            entry (dict):
+                Cached entry
+
+        Returns:
+            dict:
+                If-None-Match and If-Modified-Since headers
+        """
+        headers = {}
+        if entry["etag"] != None:
+            headers["if-none-match"] = entry["etag"]
+        if entry["last_modified"] != None:
+            headers["if-modified-since"] = entry["last_modified"]
+        return headers
+
+    def build_response(self, url: str, entry: dict) -> requests.models.Response:
+        """
+        Builds a response from the cached entry
+
+        Args:
+            url (str):
+                Requested url
+            entry (dict):
+                Cached entry
+
+        Returns:
+            requests.models.Response:
+                Response with the cached content
+        """
+        with open(self.object_path(entry["digest"]), "rb") as f:
+            content = zlib.decompress(f.read())
+        response = requests.models.Response()
+        response.status_code = 200
+        response.url = url
+        response.encoding = entry["encoding"]
+        response.headers = CaseInsensitiveDict()
+        if entry["etag"] != None:
+            response.headers["etag"] = entry["etag"]
+        if entry["last_modified"] != None:
+            response.headers["last-modified"] = entry["last_modified"]
+        response._content = content
+        response.from_cache = True
+        return response
+
+    def touch(self, url: str, revalidated: bool = False):
+        """
+        Updates the access time of the entry (and it's storing time
+        if it was revalidated)
+
+        Args:
+            url (str):
+                Cached url
+            revalidated (bool, default False):
+                Whether the entry was revalidated by the server
+        """
+        now = time.time()
+        with self.lock:
+            if revalidated:
+                self.stats["revalidated"] += 1
+                self.db.execute(
+                    "UPDATE entries SET accessed_at=?, stored_at=? WHERE url=?",
+                    (now, now, url),
+                )
+            else:
+                self.db.execute(
+                    "UPDATE entries SET accessed_at=? WHERE url=?", (now, url)
+                )
+            self.db.commit()
+
+    def store(self, url: str, url_class: str, response: requests.models.Response):
+        """
+        Stores the successful response in the cache
+
+        Args:
+            url (str):
+                Requested url
+            url_class (str):
+                Class of the url
+            response (requests.models.Response):
+                Response to be stored
+        """
+        digest = hashlib.sha256(response.content).hexdigest()
+        path = self.object_path(digest)
+        data = zlib.compress(response.content, self.config["compression_level"])
+        now = time.time()
+        with self.lock:
+            self.stats["misses"] += 1
+            is_new = not os.path.exists(path)
+            if is_new:
+                os.makedirs(path.parent, exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(data)
+            size = len(data)
+            previous = self.db.execute(
+                "SELECT digest FROM entries WHERE url=?", (url,)
+            ).fetchone()
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    url,
+                    digest,
+                    url_class,
+                    now,
+                    now,
+                    size,
+                    response.headers.get("etag"),
+                    response.headers.get("last-modified"),
+                    response.encoding,
+                ),
+            )
+            self.db.commit()
+            if is_new:
+                self.size += size
+            if previous != None and previous[0] != digest:
+                self.release(digest=previous[0])
+            if self.size > self.max_size:
+                self.evict()
+
+    def release(self, digest: str):
+        """
+        Removes the body with the specified digest if it is no longer
+        referenced by any entry. Must be called under the lock
+
+        Args:
+            digest (str):
+                Digest of the body
+        """
+        n_refs = self.db.execute(
+            "SELECT COUNT(*) FROM entries WHERE digest=?", (digest,)
+        ).fetchone()[0]
+        if n_refs == 0 and os.path.exists(self.object_path(digest)):
+            self.size -= os.path.getsize(self.object_path(digest))
+            os.remove(self.object_path(digest))
+
+    def evict(self):
+        """
+        Evicts the least recently used entries until the cache fits into
+        the configured size. Must be called under the lock
+        """
+        rows = self.db.execute(
+            "SELECT url, digest FROM entries ORDER BY accessed_at"
+        ).fetchall()
+        n_evicted = 0
+        for url, digest in rows:
+            if self.size <= self.max_size:
+                break
+            self.db.execute("DELETE FROM entries WHERE url=?", (url,))
+            self.release(digest=digest)
+            n_evicted += 1
+        self.db.commit()
+        logger.info(f"Response cache: {n_evicted} entries have been evicted")
+
+    def log_stats(self):
+        """Logs statistics of the cache"""
+        logger.info(
+            f"Response cache: {self.stats['hits']} hits, "
+            + f"{self.stats['revalidated']} revalidated, "
+            + f"{self.stats['misses']} misses, "
+            + f"{self.size} bytes stored"
+        )
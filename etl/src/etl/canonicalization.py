@@ -0,0 +1,108 @@
+"""
+Canonicalization of addresses (see address_info.canonicalization in
+config). All spellings of an address share a single canonical key, which
+is stored in the address_key column of the addresses table together with
+the version of the canonicalization (keys of other versions are rebuilt
+on the first lookup), and the cache, the bulk read and the join in the
+database match stored addresses by it. Ambiguous abbreviations such as
+'пр' (проспект or проезд) are left as they are
+"""
+
+import re
+
+from etl.geocoding import normalize_address
+
+
+# Version of the canonicalization code, which must be increased whenever a
+# change of the code changes the keys (the stored keys are rebuilt then)
+CANONICALIZATION_VERSION = 1
+
+# Parts of a house number, e.g. 'д. 12, лит. А', 'дом 5 корпус 2 строение 1'
+HOUSE = re.compile(r"\b(?:дом|д)\s*(?=\d)")
+CORPUS = re.compile(r"\b(?:корпус|корп|к)\s*(?=\d)")
+BUILDING = re.compile(r"\b(?:строение|стр|с)\s*(?=\d)")
+LETTER = re.compile(r"\b(?:литера|литер|лит|буква)\s*(?=[а-я]\b)")
+# Suffixes which are glued to the house number: '12 а' -> '12а', '5 к2' -> '5к2'
+SUFFIX = re.compile(r"(\d)[\s,]+(?=(?:[а-я]|[кс]\d+)\b)")
+
+
+class AddressCanonicalizer:
+    """
+    Maps the spellings of an address to a single canonical key. The
+    address is normalized (see normalize_address), the known prefixes
+    (e.g. the address_adjustment prefixes) are removed, the street types
+    are replaced with their canonical abbreviation at the end of the
+    street name, the punctuation is dropped and the parts of the house
+    number are written compactly ('д. 12, корпус 2, лит. А' -> '12ак2')
+    """
+
+    def __init__(self, config: dict, address_adjustment: dict):
+        """
+        Initializes AddressCanonicalizer
+
+        Args:
+            config (dict):
+                Dictionary with the canonicalization config
+            address_adjustment (dict):
+                Prefix to be added to an address which contains the key
+
+        Parameters:
+            prefixes (list[str]):
+                Normalized prefixes to be removed (the longest first)
+            street_types (dict):
+                Canonical abbreviation of each spelling of a street type
+        """
+        prefixes = config["prefixes"] + list(address_adjustment.values())
+        self.prefixes = sorted(
+            set([normalize_address(x) for x in prefixes]), key=len, reverse=True
+        )
+        self.street_types = {
+            spelling: street_type
+            for street_type, spellings in config["street_types"].items()
+            for spelling in spellings
+        }
+
+    def strip_prefixes(self, address: str) -> str:
+        """Removes the known prefixes from the normalized address"""
+        is_stripped = True
+        while is_stripped:
+            is_stripped = False
+            for prefix in self.prefixes:
+                if address.startswith(prefix):
+                    address = address[len(prefix) :].lstrip(" ,")
+                    is_stripped = True
+                    break
+        return address
+
+    def canonicalize(self, address: str) -> str:
+        """
+        Builds the canonical key of the address
+
+        Args:
+            address (str):
+                Address
+
+        Returns:
+            str:
+                Canonical key
+        """
+        address = self.strip_prefixes(normalize_address(address))
+        address = re.sub(r"[^\w\s,/-]", " ", address)
+        address = HOUSE.sub("", address)
+        address = CORPUS.sub("к", address)
+        address = BUILDING.sub("с", address)
+        address = LETTER.sub("", address)
+        address = SUFFIX.sub(r"\1", address)
+
+        components = []
+        for component in address.split(","):
+            tokens = component.split()
+            street_types = [
+                self.street_types[x] for x in tokens if x in self.street_types
+            ]
+            if len(street_types) == 1 and len(tokens) > 1:
+                tokens = [x for x in tokens if x not in self.street_types]
+                tokens.append(street_types[0])
+            if len(tokens) > 0:
+                components.append(" ".join(tokens))
+        return ", ".join(components)
@@ -0,0 +1,207 @@
+import os
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+from etl import logger
+
+
+class CrawlFrontier:
+    """
+    Persisted frontier of a crawl for a single date_parsed. The frontier
+    keeps the listing pages which were already requested (with the hrefs
+    of their cards, the offers to be fetched and the classification of
+    the offers by the incremental index) and the status of each offer:
+    'pending', 'done' (parsed content is stored), 'failed' or 'saved'
+    (the content is already saved to the source database). An
+    interrupted crawl is resumed from the frontier: requested listing
+    pages are not requested again, parsed offers are replayed from the
+    frontier and only pending and failed offers are requested
+    """
+
+    def __init__(self, path: Path, date_parsed: str, fresh: bool = False):
+        """
+        Initializes CrawlFrontier
+
+        Args:
+            path (Path):
+                Path to the directory with the frontiers
+            date_parsed (str):
+                Date of the crawl in the format %Y-%m-%d
+            fresh (bool, optional, default False):
+                Whether to drop the existing frontier of the date and
+                start a fresh crawl
+        """
+        self.path = path
+        self.date_parsed = date_parsed
+        self.lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+        # Removing frontiers of the previous dates (and of the current
+        # date if a fresh crawl is requested)
+        filename = f"crawl_{date_parsed}.sqlite"
+        for name in os.listdir(self.path):
+            if name.startswith("crawl_") and (name != filename or fresh):
+                os.remove(self.path / name)
+
+        self.db = sqlite3.connect(self.path / filename, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            + "page INTEGER PRIMARY KEY, hrefs TEXT, offers TEXT, seen TEXT)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS offers ("
+            + "href TEXT PRIMARY KEY, page INTEGER, offer_id INTEGER, "
+            + "status TEXT, content TEXT)"
+        )
+        self.db.commit()
+        self.is_resumed = len(self.pages()) > 0
+        if self.is_resumed:
+            logger.info(f"Resuming the crawl of {date_parsed}: {self.stats()}")
+
+    def get_meta(self, key: str) -> str | None:
+        """Returns the value of the frontier's metadata"""
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return None if row == None else row[0]
+
+    def set_meta(self, key: str, value: str):
+        """Sets the value of the frontier's metadata"""
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+            self.db.commit()
+
+    def add_page(self, page: int, hrefs: list[str], offers: list[str], seen: dict):
+        """
+        Records a requested listing page and it's offers as pending
+
+        Args:
+            page (int):
+                Number of the listing page
+            hrefs (list[str]):
+                Relative urls of all offers on the page
+            offers (list[str]):
+                Relative urls of the offers to be fetched
+            seen (dict):
+                Fingerprint and status of each offer classified by the
+                incremental index
+        """
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)",
+                (page, json.dumps(hrefs), json.dumps(offers), json.dumps(seen)),
+            )
+            self.db.executemany(
+                "INSERT OR IGNORE INTO offers VALUES (?, ?, ?, 'pending', NULL)",
+                [(x, page, int(x.split("/")[-2])) for x in offers],
+            )
+            self.db.commit()
+
+    def pages(self) -> list[tuple[int, list[str], list[str], dict]]:
+        """
+        Returns the recorded listing pages
+
+        Returns:
+            list[tuple[int, list[str], list[str], dict]]:
+                Number, hrefs, offers to be fetched and classified offers
+                of each page in the order of the pages
+        """
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT page, hrefs, offers, seen FROM pages ORDER BY page"
+            ).fetchall()
+        return [
+            (page, json.loads(hrefs), json.loads(offers), json.loads(seen))
+            for page, hrefs, offers, seen in rows
+        ]
+
+    def unresolved_offers(self, page: int) -> list[str]:
+        """Relative urls of the pending and failed offers of the page"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT href FROM offers WHERE page=? "
+                + "AND status IN ('pending', 'failed') ORDER BY rowid",
+                (page,),
+            ).fetchall()
+        return [x[0] for x in rows]
+
+    def mark_offer(self, offer: str, content: list | None):
+        """
+        Records the result of fetching the offer
+
+        Args:
+            offer (str):
+                Relative url of the offer
+            content (list | None):
+                Parsed content (None if it was not possible to parse it)
+        """
+        status = "failed" if content == None else "done"
+        content = None if content == None else json.dumps(content, ensure_ascii=False)
+        with self.lock:
+            self.db.execute(
+                "UPDATE offers SET status=?, content=? WHERE href=?",
+                (status, content, offer),
+            )
+            self.db.commit()
+
+    def mark_saved(self, offer_ids: list[int]):
+        """Marks the offers as saved to the source database"""
+        with self.lock:
+            self.db.executemany(
+                "UPDATE offers SET status='saved' WHERE offer_id=? AND status='done'",
+                [(x,) for x in offer_ids],
+            )
+            self.db.commit()
+
+    def unmark_saved(self):
+        """Marks all saved offers as done (after their rows were deleted)"""
+        with self.lock:
+            self.db.execute("UPDATE offers SET status='done' WHERE status='saved'")
+            self.db.commit()
+
+    def contents(self, statuses: list[str]) -> list[list]:
+        """
+        Returns the stored parsed content of the offers
+
+        Args:
+            statuses (list[str]):
+                Statuses of the offers ('done' and/or 'saved')
+
+        Returns:
+            list[list]:
+                Parsed content of each offer with the offer_id appended
+        """
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT content FROM offers WHERE status IN "
+                + f"({', '.join('?' * len(statuses))}) ORDER BY page, rowid",
+                statuses,
+            ).fetchall()
+        return [json.loads(x[0]) for x in rows]
+
+    def offer_ids(self, statuses: list[str]) -> list[int]:
+        """Ids of the offers with the specified statuses"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT offer_id FROM offers WHERE status IN "
+                + f"({', '.join('?' * len(statuses))})",
+                statuses,
+            ).fetchall()
+        return [x[0] for x in rows]
+
+    def stats(self) -> dict:
+        """Number of the recorded pages and of the offers by status"""
+        with self.lock:
+            n_pages = self.db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+            rows = self.db.execute(
+                "SELECT status, COUNT(*) FROM offers GROUP BY status"
+            ).fetchall()
+        return {"pages": n_pages, **dict(rows)}
+
+    def log_stats(self):
+        """Logs the state of the frontier"""
+        logger.info(f"Crawl frontier of {self.date_parsed}: {self.stats()}")
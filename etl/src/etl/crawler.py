@@ -0,0 +1,407 @@
+import queue
+import asyncio
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from etl import logger
+from etl.extractors import get_extractor, StateFirstExtractor
+
+
+# Extractor of the parse worker process (see init_parse_worker)
+worker_extractor = None
+
+
+def init_parse_worker(name: str, fields: dict, state_config: dict | None = None):
+    """
+    Initializes the extractor of a parse worker process
+
+    Args:
+        name (str):
+            Name of the extractor (see bs_parser in config)
+        fields (dict):
+            Dictionary with the parsing fields
+        state_config (dict | None, default None):
+            Dictionary with the embedded_state config
+    """
+    global worker_extractor
+    worker_extractor = get_extractor(name=name, fields=fields, state_config=state_config)
+
+
+def parse_in_worker(html: str) -> tuple[list, dict]:
+    """
+    Parses the html in a parse worker process
+
+    Args:
+        html (str):
+            Html document
+
+    Returns:
+        tuple[list, dict]:
+            Parsed content of each parsing field and the extraction
+            statistics of the document (see StateFirstExtractor.stats,
+            empty if the embedded state is not used)
+    """
+    if not isinstance(worker_extractor, StateFirstExtractor):
+        return worker_extractor.parse(html=html), {}
+    stats = dict(worker_extractor.stats)
+    content = worker_extractor.parse(html=html)
+    return content, {k: v - stats[k] for k, v in worker_extractor.stats.items()}
+
+
+class AsyncCrawler:
+    """
+    Asyncio based crawl engine for RealtyYaParser. Offer pages are
+    requested concurrently with a bounded global and
+    per-host concurrency. Blocking requests and parsing are performed by
+    the parser in a pool of threads, where the request rate is bounded
+    by the parser's rate limiter
+    """
+
+    def __init__(self, parser):
+        """
+        Initializes AsyncCrawler
+
+        Args:
+            parser (RealtyYaParser):
+                Parser which performs requests and parses responses
+
+        Parameters:
+            config (dict):
+                Dictionary with the async_crawl config
+        """
+        self.parser = parser
+        self.config = parser.config["async_crawl"]
+
+    async def fetch(self, url: str):
+        """
+        Requests content for the specified url respecting concurrency limits
+
+        Args:
+            url (str):
+                Url from which the content must be requested
+
+        Returns:
+            requests.models.Response | None:
+                Response from the url (None if there is no successive
+                response)
+        """
+        host = urlsplit(url).netloc
+        if host not in self.host_semaphores:
+            self.host_semaphores[host] = asyncio.Semaphore(
+                self.config["max_concurrency_per_host"]
+            )
+        async with self.semaphore, self.host_semaphores[host]:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, self.parser.get, url)
+
+    async def crawl_offer(self, offer: str) -> list | None:
+        """
+        Requests and parses a single offer
+
+        Args:
+            offer (str):
+                Relative url of the offer
+
+        Returns:
+            list | None:
+                Parsed content with the offer_id appended (None if it was
+                not possible to parse content)
+        """
+        response = await self.fetch(url=f"{self.parser.config['offers_url']}{offer}")
+        # Parsing in the pool of threads, so the event loop keeps
+        # dispatching requests while the document is parsed
+        loop = asyncio.get_running_loop()
+        content = await loop.run_in_executor(self.executor, self.parser.parse, response)
+        if content == None:
+            logger.info(
+                f"URL = {self.parser.config['offers_url']}{offer} : "
+                + "unable to parse content"
+            )
+        else:
+            content.append(offer.split("/")[-2])
+        self.parser.record_offer(offer=offer, content=content)
+        return content
+
+    async def crawl_page(self, offers: list[str]) -> list[list | None]:
+        """
+        Requests and parses all offers from a listing page
+
+        Args:
+            offers (list[str]):
+                Relative urls of the offers
+
+        Returns:
+            list[list | None]:
+                Parsed content of each offer in the order of the listing
+        """
+        output = await asyncio.gather(*[self.crawl_offer(offer) for offer in offers])
+        self.progress.update(1)
+        return output
+
+    def prefetch(self, pages: list[int]) -> dict:
+        """
+        Requests the listing pages concurrently on the event loop (called
+        by the listing iteration of the parser from the pool of threads)
+
+        Args:
+            pages (list[int]):
+                Numbers of the listing pages
+
+        Returns:
+            dict:
+                Future of the response of each listing page
+        """
+        return {
+            page: asyncio.run_coroutine_threadsafe(
+                self.fetch(url=f"{self.parser.config['url']}?page={page}"), self.loop
+            )
+            for page in pages
+        }
+
+    async def crawl_pages(self, pages: queue.Queue):
+        """
+        Crawls the listing pages. The first listing page is requested
+        alone (so that pagination is discovered), then the remaining
+        listing pages are requested concurrently together with the
+        offers. Listing pages are handled in their order (so the crawl
+        stops early on an exhausted listing), while the offers of each
+        page are crawled concurrently. Parsed content of each page is
+        pushed into the queue in the order of the listing pages
+
+        Args:
+            pages (queue.Queue):
+                Queue with parsed content of each offer grouped by the
+                listing page
+        """
+        self.semaphore = asyncio.Semaphore(self.config["max_concurrency"])
+        self.host_semaphores = {}
+        self.loop = asyncio.get_running_loop()
+        listing = self.parser.iter_listing_pages(
+            progress=self.progress, prefetch=self.prefetch
+        )
+        tasks = deque()
+        while True:
+            item = await self.loop.run_in_executor(self.executor, next, listing, None)
+            if item == None:
+                break
+            tasks.append(asyncio.ensure_future(self.crawl_page(offers=item[1])))
+            while len(tasks) > 0 and tasks[0].done():
+                pages.put(tasks.popleft().result())
+        while len(tasks) > 0:
+            pages.put(await tasks.popleft())
+
+    def run(self, pages: queue.Queue):
+        """
+        Runs the event loop of the crawl in the current thread. None
+        marks the end of the crawl
+
+        Args:
+            pages (queue.Queue):
+                Queue with parsed content of each offer grouped by the
+                listing page
+        """
+        try:
+            with ThreadPoolExecutor(
+                max_workers=self.config["max_concurrency"]
+            ) as executor:
+                self.executor = executor
+                asyncio.run(self.crawl_pages(pages))
+        except Exception as e:
+            self.error = e
+        finally:
+            pages.put(None)
+
+    def iter_crawl(self, progress):
+        """
+        Runs the crawl in a separate thread and yields parsed content of
+        each listing page as soon as it is crawled
+
+        Args:
+            progress (tqdm):
+                Progress bar which is updated after each crawled page
+
+        Yields:
+            list[list | None]:
+                Parsed content of each offer of a listing page in the
+                order of the listing pages
+        """
+        self.progress = progress
+        self.error = None
+        pages = queue.Queue()
+        thread = threading.Thread(target=self.run, args=(pages,))
+        thread.start()
+        while True:
+            output = pages.get()
+            if output == None:
+                break
+            yield output
+        thread.join()
+        if self.error != None:
+            logger.error(f"An exception occured in the async crawl. Error: {self.error}")
+            raise self.error
+
+
+class PipelineCrawler:
+    """
+    Producer/consumer crawl engine for RealtyYaParser. A fetch thread
+    requests listing and offer pages and pushes raw html into a bounded
+    queue, while the html is parsed by a pool of worker processes. The
+    number of queued and in-flight documents is bounded, so the memory
+    stays bounded and fetching is throttled when parsing falls behind
+    """
+
+    def __init__(self, parser):
+        """
+        Initializes PipelineCrawler
+
+        Args:
+            parser (RealtyYaParser):
+                Parser which performs requests
+
+        Parameters:
+            config (dict):
+                Dictionary with the pipeline_crawl config
+        """
+        self.parser = parser
+        self.config = parser.config["pipeline_crawl"]
+
+    def fetch(self, documents: queue.Queue, progress):
+        """
+        Fetch stage: requests all offers from the listing pages and pushes
+        (page, offer, html) into the queue. None marks the end of the
+        stage
+
+        Args:
+            documents (queue.Queue):
+                Bounded queue with the fetched documents
+            progress (tqdm):
+                Progress bar whose total is adjusted to the number of
+                pages
+        """
+        try:
+            for page, offers in self.parser.iter_listing_pages(progress=progress):
+                for offer in offers:
+                    response = self.parser.get(
+                        url=f"{self.parser.config['offers_url']}{offer}"
+                    )
+                    html = None if response == None else response.text
+                    documents.put((page, offer, html))
+                documents.put((page, None, None))
+        except Exception as e:
+            self.error = e
+        finally:
+            documents.put(None)
+
+    def collect(self, output: dict, page: int, offer: str, content: list | None):
+        """
+        Stores parsed content of the offer with the offer_id appended
+
+        Args:
+            output (dict):
+                Parsed content grouped by the listing page
+            page (int):
+                Number of the listing page
+            offer (str):
+                Relative url of the offer
+            content (list | None):
+                Parsed content (None if it was not possible to parse it)
+        """
+        if content == None:
+            logger.info(
+                f"URL = {self.parser.config['offers_url']}{offer} : "
+                + "unable to parse content"
+            )
+        else:
+            content.append(offer.split("/")[-2])
+        self.parser.record_offer(offer=offer, content=content)
+        output.setdefault(page, []).append(content)
+
+    def iter_crawl(self, progress):
+        """
+        Runs the crawl and yields parsed content of each listing page as
+        soon as all it's offers are parsed
+
+        Args:
+            progress (tqdm):
+                Progress bar which is updated after each crawled page
+
+        Yields:
+            list[list | None]:
+                Parsed content of each offer of a listing page in the
+                order of the listing pages
+        """
+        self.error = None
+        output = {}
+        documents = queue.Queue(maxsize=self.config["queue_size"])
+        fetcher = threading.Thread(target=self.fetch, args=(documents, progress))
+        fetcher.start()
+
+        # Parsing documents in the order they were fetched, while keeping
+        # at most max_in_flight documents in the pool
+        in_flight = deque()
+        with ProcessPoolExecutor(
+            max_workers=self.config["parse_workers"],
+            initializer=init_parse_worker,
+            initargs=(
+                self.parser.config["bs_parser"],
+                self.parser.config["parsing_fields"]["sub_fields"],
+                self.parser.config["embedded_state"],
+            ),
+        ) as executor:
+            while True:
+                item = documents.get()
+                if item == None:
+                    break
+                page, offer, html = item
+                if offer == None:
+                    in_flight.append((page, None, None))
+                elif html == None:
+                    in_flight.append((page, offer, None))
+                else:
+                    in_flight.append((page, offer, executor.submit(parse_in_worker, html)))
+                while len(in_flight) > self.config["max_in_flight"] or (
+                    len(in_flight) > 0
+                    and (in_flight[0][2] == None or in_flight[0][2].done())
+                ):
+                    page_output = self.drain(output, in_flight, progress)
+                    if page_output != None:
+                        yield page_output
+            while len(in_flight) > 0:
+                page_output = self.drain(output, in_flight, progress)
+                if page_output != None:
+                    yield page_output
+        fetcher.join()
+        if self.error != None:
+            logger.error(f"An exception occured in the fetch stage. Error: {self.error}")
+            raise self.error
+
+    def drain(self, output: dict, in_flight: deque, progress) -> list | None:
+        """
+        Waits for the oldest in-flight document and stores it's content
+
+        Args:
+            output (dict):
+                Parsed content grouped by the listing page
+            in_flight (deque):
+                Documents in the order they were fetched
+            progress (tqdm):
+                Progress bar which is updated after each crawled page
+
+        Returns:
+            list | None:
+                Parsed content of each offer of the listing page if the
+                page is complete, otherwise None
+        """
+        page, offer, future = in_flight.popleft()
+        if offer == None:
+            progress.update(1)
+            return output.pop(page, [])
+        elif future == None:
+            self.collect(output, page, offer, None)
+        else:
+            content, stats = future.result()
+            if isinstance(self.parser.extractor, StateFirstExtractor):
+                self.parser.extractor.add_stats(stats=stats)
+            self.collect(output, page, offer, content)
@@ -0,0 +1,182 @@
+import re
+import json
+
+
+# Placeholders of the templates, e.g. {area.value} or {floorsOffered.0}
+PLACEHOLDER = re.compile(r"\{([^{}]+)\}")
+
+# Marks a missing value while the state is resolved
+MISSING = object()
+
+
+def find_state(html: str, marker: str) -> dict | None:
+    """
+    Locates the embedded state with a plain string scan and decodes only
+    the JSON object which follows the marker
+
+    Args:
+        html (str):
+            Html document
+        marker (str):
+            Code which precedes the JSON object (e.g. 'window.INITIAL_STATE = ')
+
+    Returns:
+        dict | None:
+            Decoded state (None if there is no state in the document or
+            it can not be decoded)
+    """
+    start = html.find(marker)
+    if start == -1:
+        return None
+    start += len(marker)
+    while start < len(html) and html[start].isspace():
+        start += 1
+    try:
+        state, _ = json.JSONDecoder().raw_decode(html, start)
+    except ValueError:
+        return None
+    return state if isinstance(state, dict) else None
+
+
+def resolve(state, path: str):
+    """
+    Resolves a dotted path in the state. Numeric keys index lists
+
+    Args:
+        state (dict | list):
+            Decoded state
+        path (str):
+            Dotted path, e.g. 'area.value' or 'floorsOffered.0'
+
+    Returns:
+        Any:
+            Value at the path (MISSING if there is no such value)
+    """
+    value = state
+    for key in path.split("."):
+        if isinstance(value, dict) and key in value:
+            value = value[key]
+        elif isinstance(value, list) and key.isdigit() and int(key) < len(value):
+            value = value[int(key)]
+        else:
+            return MISSING
+    return MISSING if value == None else value
+
+
+def render(template: dict, state: dict) -> str | None:
+    """
+    Renders a template of a raw field from the state
+
+    Args:
+        template (dict):
+            Template with the text (where placeholders are replaced with
+            the values at their paths) and an optional condition: the
+            value at the 'when' path must exist and (if 'equals' is
+            specified) be equal to it
+        state (dict):
+            Decoded state
+
+    Returns:
+        str | None:
+            Rendered text (None if the condition does not hold or any
+            placeholder can not be resolved)
+    """
+    if "when" in template:
+        value = resolve(state, template["when"])
+        if value is MISSING:
+            return None
+        if "equals" in template and value != template["equals"]:
+            return None
+    values = {}
+    for path in PLACEHOLDER.findall(template["text"]):
+        value = resolve(state, path)
+        if value is MISSING or isinstance(value, (dict, list)):
+            return None
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        values[path] = str(value)
+    return PLACEHOLDER.sub(lambda x: values[x.group(1)], template["text"])
+
+
+class StateExtractor:
+    """
+    Extractor of the parsing fields from the JSON state which is embedded
+    into the offer pages. Each field is described by a list of slots
+    (see embedded_state in config), where each slot is a list of
+    alternative templates and the first rendered alternative fills the
+    slot. Fields with return_first_parsed take the first filled slot,
+    other fields take all filled slots, so the content has the same form
+    as the content extracted from the DOM. Positional fields (whose items
+    are read by position, e.g. fee_info) keep every slot in place with
+    None for the unfilled ones
+    """
+
+    def __init__(self, config: dict, fields: dict):
+        """
+        Initializes StateExtractor
+
+        Args:
+            config (dict):
+                Dictionary with the embedded_state config
+            fields (dict):
+                Dictionary with the parsing fields
+
+        Parameters:
+            slots (list[list[list[dict]]]):
+                Slots of each parsing field in the order of the fields
+            positional (list[bool]):
+                Whether each field keeps it's slots in place
+            required (list[bool]):
+                Whether each field must be found for the content to be
+                complete
+        """
+        self.config = config
+        self.first_only = [cfg["return_first_parsed"] for cfg in fields.values()]
+        self.slots = [config["fields"].get(name, []) for name in fields]
+        self.positional = [name in config["positional"] for name in fields]
+        self.required = [name in config["required"] for name in fields]
+
+    def parse(self, html: str) -> list | None:
+        """
+        Extracts the content of each parsing field from the embedded state
+
+        Args:
+            html (str):
+                Html document
+
+        Returns:
+            list | None:
+                Content of each field (see BaseExtractor.parse). None if
+                the document has no embedded state
+        """
+        state = find_state(html=html, marker=self.config["marker"])
+        if state == None:
+            return None
+        if self.config["root"] != None:
+            state = resolve(state, self.config["root"])
+            if not isinstance(state, dict):
+                return None
+        content = []
+        for slots, first_only, positional in zip(
+            self.slots, self.first_only, self.positional
+        ):
+            found = []
+            for alternatives in slots:
+                text = None
+                for template in alternatives:
+                    text = render(template=template, state=state)
+                    if text != None:
+                        break
+                if text != None or positional:
+                    found.append(text)
+                if first_only and len(found) > 0:
+                    break
+            if all(x == None for x in found):
+                content.append(None)
+            else:
+                content.append(found[0] if first_only else found)
+        return content
+
+    def is_complete(self, content: list) -> bool:
+        """Whether all required fields are found in the content"""
+        return all(x != None for x, y in zip(content, self.required) if y)
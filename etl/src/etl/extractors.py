@@ -0,0 +1,411 @@
+import threading
+from abc import ABC, abstractmethod
+from bs4 import BeautifulSoup, Tag
+
+from etl import logger
+from etl.embedded_state import StateExtractor
+
+
+def matches_classes(class_attr: str | None, classes: list[str]) -> bool:
+    """
+    Checks if an element with the specified class attribute matches any
+    of the classes in the same way as BeautifulSoup's class_ filter: a
+    class matches either one of the element's classes or the whole
+    class attribute string
+
+    Args:
+        class_attr (str | None):
+            Value of the class attribute of an element
+        classes (list[str]):
+            Classes to be matched
+
+    Returns:
+        bool:
+            Whether the element matches
+    """
+    if class_attr == None:
+        return False
+    class_attr = " ".join(class_attr.split())
+    tokens = class_attr.split(" ")
+    return any(x == class_attr or x in tokens for x in classes)
+
+
+class FieldMatcher:
+    """
+    Parsing fields compiled into a lookup from a tag to the fields which
+    may match an element with that tag, so that all fields are matched
+    during a single walk over the document
+    """
+
+    def __init__(self, fields: dict):
+        """
+        Initializes FieldMatcher
+
+        Args:
+            fields (dict):
+                Dictionary with the parsing fields
+
+        Parameters:
+            first_only (list[bool]):
+                Whether only the first match is required for each field
+            by_tag (dict):
+                Indices and classes of the fields for each tag
+            tags (set[str]):
+                Tags of all fields
+        """
+        self.first_only = [cfg["return_first_parsed"] for cfg in fields.values()]
+        self.by_tag = {}
+        for i, cfg in enumerate(fields.values()):
+            self.by_tag.setdefault(cfg["tag"], []).append((i, cfg["classes"]))
+        self.tags = set(self.by_tag)
+
+
+class BaseExtractor(ABC):
+    """
+    Common interface of the html extractors. An extractor takes the
+    parsing fields (see config: tag, classes and return_first_parsed for
+    each field) and extracts the text of the matching elements from a
+    html document
+    """
+
+    # Features of BeautifulSoup to be used where a full tree is required
+    soup_features = "html.parser"
+
+    def __init__(self, fields: dict):
+        """
+        Initializes the extractor
+
+        Args:
+            fields (dict):
+                Dictionary with the parsing fields
+
+        Parameters:
+            matcher (FieldMatcher):
+                Parsing fields compiled for the single pass extraction
+        """
+        self.fields = fields
+        self.matcher = FieldMatcher(fields=fields)
+
+    @abstractmethod
+    def load(self, html: str):
+        """Builds a document from the html"""
+
+    @abstractmethod
+    def iter_elements(self, document, tags: set[str]):
+        """Yields (tag, element) for elements with the tags in document order"""
+
+    @abstractmethod
+    def class_attribute(self, element) -> str | None:
+        """Returns the class attribute of the element"""
+
+    def find_all(self, document, tag: str, classes: list[str]) -> list:
+        """Finds all elements with the specified tag and classes"""
+        return [
+            x
+            for _, x in self.iter_elements(document, {tag})
+            if matches_classes(self.class_attribute(x), classes)
+        ]
+
+    @abstractmethod
+    def text(self, element) -> str:
+        """Returns the text of the element and all it's descendants"""
+
+    @abstractmethod
+    def attribute(self, element, name: str) -> str | None:
+        """Returns the value of the element's attribute"""
+
+    def parse(self, html: str) -> list:
+        """
+        Extracts the content of each parsing field walking the document
+        only once. Every element is routed to the fields with the same
+        tag and matching classes. Fields with return_first_parsed stop
+        matching after the first match, and the walk stops as soon as
+        nothing else can be matched
+
+        Args:
+            html (str):
+                Html document
+
+        Returns:
+            list:
+                Content of each field: None if nothing was found, the
+                first found text if return_first_parsed, otherwise the
+                list of all found texts
+        """
+        matcher = self.matcher
+        found = [[] for _ in matcher.first_only]
+        n_pending = len(found) if all(matcher.first_only) else -1
+        for tag, element in self.iter_elements(self.load(html), matcher.tags):
+            class_attr = self.class_attribute(element)
+            text = None
+            for i, classes in matcher.by_tag[tag]:
+                if matcher.first_only[i] and len(found[i]) > 0:
+                    continue
+                if matches_classes(class_attr, classes):
+                    if text == None:
+                        text = self.text(element)
+                    found[i].append(text)
+                    n_pending -= 1
+            if n_pending == 0:
+                break
+        content = []
+        for content_, first_only in zip(found, matcher.first_only):
+            if len(content_) == 0:
+                content_ = None
+            elif first_only:
+                content_ = content_[0]
+            content.append(content_)
+        return content
+
+    def links(self, html: str, tag: str, classes: list[str]) -> list[str | None]:
+        """
+        Extracts href attributes of the matching elements
+
+        Args:
+            html (str):
+                Html document
+            tag (str):
+                Tag of the elements
+            classes (list[str]):
+                Classes of the elements
+
+        Returns:
+            list[str | None]:
+                Values of the href attributes
+        """
+        document = self.load(html)
+        return [
+            self.attribute(x, "href") for x in self.find_all(document, tag, classes)
+        ]
+
+
+class SoupExtractor(BaseExtractor):
+    """Extractor based on BeautifulSoup with any of it's builtin parsers"""
+
+    def __init__(self, fields: dict, features: str = "html.parser"):
+        """
+        Initializes SoupExtractor
+
+        Args:
+            fields (dict):
+                Dictionary with the parsing fields
+            features (str, default 'html.parser'):
+                BeautifulSoup parser to be used
+        """
+        super().__init__(fields=fields)
+        self.soup_features = features
+
+    def load(self, html: str):
+        return BeautifulSoup(html, self.soup_features)
+
+    def iter_elements(self, document, tags: set[str]):
+        for x in document.descendants:
+            if isinstance(x, Tag) and x.name in tags:
+                yield x.name, x
+
+    def class_attribute(self, element) -> str | None:
+        value = element.get("class")
+        return " ".join(value) if isinstance(value, list) else value
+
+    def text(self, element) -> str:
+        return element.text
+
+    def attribute(self, element, name: str) -> str | None:
+        return element.get_attribute_list(name)[0]
+
+
+class LxmlExtractor(BaseExtractor):
+    """Extractor based on lxml.html which builds the tree in C"""
+
+    soup_features = "lxml"
+
+    def __init__(self, fields: dict):
+        super().__init__(fields=fields)
+        import lxml.html
+        import lxml.etree
+
+        self.html_parser = lxml.html
+        self.parser_error = lxml.etree.ParserError
+
+    def load(self, html: str):
+        try:
+            return self.html_parser.fromstring(html)
+        except self.parser_error:
+            # lxml refuses a document without elements (e.g. an empty
+            # page), which the other backends parse into an empty tree
+            return self.html_parser.Element("html")
+
+    def iter_elements(self, document, tags: set[str]):
+        for x in document.iter(*tags):
+            yield x.tag, x
+
+    def class_attribute(self, element) -> str | None:
+        return element.get("class")
+
+    def text(self, element) -> str:
+        return element.text_content()
+
+    def attribute(self, element, name: str) -> str | None:
+        return element.get(name)
+
+
+class SelectolaxExtractor(BaseExtractor):
+    """Extractor based on selectolax with the Lexbor html engine"""
+
+    def __init__(self, fields: dict):
+        super().__init__(fields=fields)
+        from selectolax.lexbor import LexborHTMLParser
+
+        self.html_parser = LexborHTMLParser
+
+    def load(self, html: str):
+        return self.html_parser(html)
+
+    def iter_elements(self, document, tags: set[str]):
+        for x in document.root.traverse():
+            if x.tag in tags:
+                yield x.tag, x
+
+    def class_attribute(self, element) -> str | None:
+        return element.attributes.get("class")
+
+    def text(self, element) -> str:
+        return element.text(deep=True)
+
+    def attribute(self, element, name: str) -> str | None:
+        return element.attributes.get(name)
+
+
+EXTRACTORS = {"lxml.html": LxmlExtractor, "selectolax": SelectolaxExtractor}
+
+
+class StateFirstExtractor(BaseExtractor):
+    """
+    Extractor which takes the content from the embedded state and falls
+    back to the DOM extractor for the pages without the state or with an
+    incomplete state (e.g. when the layout of the state has changed).
+    Links of the listing pages are extracted by the DOM extractor
+    """
+
+    def __init__(
+        self, state_extractor: StateExtractor, dom_extractor: BaseExtractor
+    ):
+        """
+        Initializes StateFirstExtractor
+
+        Args:
+            state_extractor (StateExtractor):
+                Extractor of the embedded state
+            dom_extractor (BaseExtractor):
+                Extractor which is used when there is no embedded state
+
+        Parameters:
+            stats (dict):
+                Number of pages parsed from the state and from the DOM
+                (and the number of the latter which had an incomplete
+                state)
+        """
+        super().__init__(fields=dom_extractor.fields)
+        self.state_extractor = state_extractor
+        self.dom_extractor = dom_extractor
+        self.stats = {"state": 0, "dom": 0, "incomplete": 0}
+        self.lock = threading.Lock()
+
+    @property
+    def soup_features(self) -> str:
+        return self.dom_extractor.soup_features
+
+    def load(self, html: str):
+        return self.dom_extractor.load(html=html)
+
+    def iter_elements(self, document, tags: set[str]):
+        return self.dom_extractor.iter_elements(document, tags)
+
+    def class_attribute(self, element) -> str | None:
+        return self.dom_extractor.class_attribute(element)
+
+    def text(self, element) -> str:
+        return self.dom_extractor.text(element)
+
+    def attribute(self, element, name: str) -> str | None:
+        return self.dom_extractor.attribute(element, name)
+
+    def links(self, html: str, tag: str, classes: list[str]) -> list[str | None]:
+        return self.dom_extractor.links(html=html, tag=tag, classes=classes)
+
+    def parse(self, html: str) -> list:
+        """
+        Extracts the content from the embedded state or from the DOM. The
+        statistics are updated under the lock, as pages are parsed by
+        several threads in the async crawl
+
+        Args:
+            html (str):
+                Html document
+
+        Returns:
+            list:
+                Content of each field (see BaseExtractor.parse)
+        """
+        content = self.state_extractor.parse(html=html)
+        if content != None and self.state_extractor.is_complete(content=content):
+            with self.lock:
+                self.stats["state"] += 1
+            return content
+        with self.lock:
+            if content != None:
+                self.stats["incomplete"] += 1
+            self.stats["dom"] += 1
+        return self.dom_extractor.parse(html=html)
+
+    def add_stats(self, stats: dict):
+        """Adds the statistics of the pages parsed by another extractor"""
+        with self.lock:
+            for key, value in stats.items():
+                self.stats[key] += value
+
+    def log_stats(self):
+        """Logs the number of pages parsed from the state and from the DOM"""
+        logger.info(
+            f"Embedded state extraction: {self.stats['state']} pages from the state, "
+            + f"{self.stats['dom']} pages from the DOM "
+            + f"({self.stats['incomplete']} with an incomplete state)"
+        )
+
+
+def get_extractor(
+    name: str, fields: dict, state_config: dict | None = None
+) -> BaseExtractor:
+    """
+    Creates the extractor by it's name. Names of the BeautifulSoup's
+    builtin parsers ('html.parser', 'lxml', 'html5lib') create a
+    SoupExtractor
+
+    Args:
+        name (str):
+            Name of the extractor (see bs_parser in config)
+        fields (dict):
+            Dictionary with the parsing fields
+        state_config (dict | None, default None):
+            Dictionary with the embedded_state config. If it is enabled,
+            the content is taken from the embedded state of the page and
+            the extractor is used as a fallback
+
+    Returns:
+        BaseExtractor:
+            Extractor instance
+    """
+    try:
+        if name in EXTRACTORS:
+            extractor = EXTRACTORS[name](fields=fields)
+        else:
+            extractor = SoupExtractor(fields=fields, features=name)
+    except ImportError as e:
+        logger.error(f"Unable to initialise the '{name}' extractor. Error: {e}")
+        raise e
+    if state_config != None and state_config["enabled"]:
+        extractor = StateFirstExtractor(
+            state_extractor=StateExtractor(config=state_config, fields=fields),
+            dom_extractor=extractor,
+        )
+    return extractor
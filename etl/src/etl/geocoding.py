@@ -0,0 +1,323 @@
+"""
+Geocoding of new addresses. GeocodingExecutor resolves addresses in a
+pool of threads at a shared rate limit (see address_info.geocoding in
+config) and GeocodeCache keeps the results in an in-process LRU backed by
+an sqlite store under data/geocode_cache, keyed by the normalized
+address, with negative entries retried after negative_ttl
+"""
+
+import os
+import re
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Callable
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from geopy.geocoders import ArcGIS
+
+from etl import logger
+from etl.rate_limiter import TokenBucket
+
+
+class GeocodingExecutor:
+    """
+    Concurrent geocoder of addresses. Queries are performed by a pool of
+    threads (each with it's own geocoder) at a bounded rate. The
+    adjusted variants of an address (see address_adjustment in config)
+    are resolved speculatively together with the address itself, so an
+    address which is not found costs a single round trip. The location
+    of an address is taken from it's first found variant in the order
+    of the variants, so the results do not depend on the order in which
+    the queries complete
+    """
+
+    def __init__(
+        self,
+        config: dict,
+        address_adjustment: dict,
+        geocoder_factory: Callable | None = None,
+    ):
+        """
+        Initializes GeocodingExecutor
+
+        Args:
+            config (dict):
+                Dictionary with the geocoding config
+            address_adjustment (dict):
+                Prefix to be added to an address which contains the key
+            geocoder_factory (Callable | None, default None):
+                Function which creates a geocoder (ArcGIS if None)
+
+        Parameters:
+            stats (dict):
+                Number of queries, failed queries and cancelled
+                speculative queries
+        """
+        self.config = config
+        self.address_adjustment = address_adjustment
+        self.geocoder_factory = geocoder_factory or ArcGIS
+        self.bucket = TokenBucket(rate=config["rate_limit"], capacity=config["burst"])
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stats = {"queries": 0, "failed": 0, "cancelled": 0}
+
+    def variants(self, address: str) -> list[str]:
+        """The address followed by it's adjusted variants"""
+        return [address] + [
+            f"{prefix}{address}"
+            for key, prefix in self.address_adjustment.items()
+            if key in address
+        ]
+
+    def query(self, query: str) -> list[float] | None:
+        """
+        Geocodes a single query at the bounded rate
+
+        Args:
+            query (str):
+                Address to be geocoded
+
+        Returns:
+            list[float] | None:
+                Latitude and longitude (None if the query is not found
+                or failed)
+        """
+        if not hasattr(self.local, "geocoder"):
+            self.local.geocoder = self.geocoder_factory()
+        with self.lock:
+            delay = self.bucket.reserve()
+            self.stats["queries"] += 1
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            location = self.local.geocoder.geocode(query)
+        except Exception as e:
+            with self.lock:
+                self.stats["failed"] += 1
+            logger.warning(f"Unable to geocode '{query}'. Error: {e}")
+            return None
+        return None if location == None else list(location.point[:2])
+
+    def query_first(self, queries: list[str]) -> list[float] | None:
+        """Geocodes the queries one by one until one of them is found"""
+        for query in queries:
+            location = self.query(query=query)
+            if location != None:
+                return location
+        return None
+
+    def locate(self, addresses: list[str]) -> list[list[float | None]]:
+        """
+        Geocodes the addresses
+
+        Args:
+            addresses (list[str]):
+                Addresses to be geocoded
+
+        Returns:
+            list[list[float | None]]:
+                Latitude and longitude of each address in the order of
+                the addresses (filled with None if it was not possible
+                to locate the address)
+        """
+        with ThreadPoolExecutor(max_workers=self.config["workers"]) as executor:
+            futures = []
+            for address in addresses:
+                if self.config["speculative"]:
+                    futures.append(
+                        [executor.submit(self.query, x) for x in self.variants(address)]
+                    )
+                else:
+                    futures.append(
+                        [executor.submit(self.query_first, self.variants(address))]
+                    )
+
+            locations = []
+            for address, futures_ in zip(addresses, futures):
+                location = None
+                for it, future in enumerate(futures_):
+                    location = future.result()
+                    if location != None:
+                        # The remaining variants are not needed
+                        for future_ in futures_[it + 1 :]:
+                            if future_.cancel():
+                                with self.lock:
+                                    self.stats["cancelled"] += 1
+                        break
+                if location == None:
+                    logger.warning(
+                        f"Unable to locate address '{address}' after adjustments"
+                    )
+                    location = [None, None]
+                locations.append(location)
+        logger.info(
+            f"Geocoding: {len(addresses)} addresses, {self.stats['queries']} queries, "
+            + f"{self.stats['failed']} failed, {self.stats['cancelled']} cancelled"
+        )
+        return locations
+
+
+def normalize_address(address: str) -> str:
+    """
+    Normalizes an address into the key of the geocode cache: lower case,
+    'ё' replaced with 'е', single spaces and no spaces before punctuation
+
+    Args:
+        address (str):
+            Address
+
+    Returns:
+        str:
+            Normalized address
+    """
+    key = address.lower().replace("ё", "е")
+    key = re.sub(r"\s+", " ", key).strip(" ,.")
+    return re.sub(r" ([,.])", r"\1", key)
+
+
+class GeocodeCache:
+    """
+    Two-tier cache of the geocoded addresses keyed by the normalized
+    (or canonical) address. The in-process LRU tier is backed by an sqlite store, so
+    the addresses of the previous runs are resolved without reading the
+    addresses table. Addresses which could not be located are stored as
+    negative entries and are not geocoded again until their retry-after
+    time
+    """
+
+    def __init__(self, config: dict, path: Path, key_func: Callable | None = None):
+        """
+        Initializes GeocodeCache
+
+        Args:
+            config (dict):
+                Dictionary with the geocode cache config
+            path (Path):
+                Path to the cache directory
+            key_func (Callable | None, default None):
+                Function which maps an address to it's key
+                (normalize_address if None)
+
+        Parameters:
+            entries (OrderedDict):
+                LRU tier: entry of each key in the order of access
+            stats (dict):
+                Number of hits of each tier, negative hits and misses
+        """
+        self.config = config
+        self.key_func = key_func or normalize_address
+        self.entries = OrderedDict()
+        self.stats = {
+            "memory_hits": 0,
+            "store_hits": 0,
+            "negative_hits": 0,
+            "misses": 0,
+        }
+        os.makedirs(path, exist_ok=True)
+        self.db = sqlite3.connect(path / "geocodes.sqlite")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            + "key TEXT PRIMARY KEY, address_id INTEGER, latitude REAL, "
+            + "longitude REAL, stored_at REAL, retry_after REAL)"
+        )
+        self.db.commit()
+
+    def remember(self, key: str, entry: dict):
+        """Puts the entry into the LRU tier and evicts the oldest entries"""
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.config["lru_size"]:
+            self.entries.popitem(last=False)
+
+    def get(self, address: str) -> dict | None:
+        """
+        Looks up the address
+
+        Args:
+            address (str):
+                Address
+
+        Returns:
+            dict | None:
+                Entry with the address_id, latitude and longitude (all
+                None for a negative entry). None if the address is not
+                cached or the negative entry has reached it's
+                retry-after time
+        """
+        key = self.key_func(address)
+        if key in self.entries:
+            entry = self.entries[key]
+            self.entries.move_to_end(key)
+            tier = "memory_hits"
+        else:
+            row = self.db.execute(
+                "SELECT address_id, latitude, longitude, retry_after "
+                + "FROM entries WHERE key=?",
+                (key,),
+            ).fetchone()
+            if row == None:
+                self.stats["misses"] += 1
+                return None
+            entry = dict(
+                zip(["address_id", "latitude", "longitude", "retry_after"], row)
+            )
+            self.remember(key=key, entry=entry)
+            tier = "store_hits"
+        if entry["address_id"] == None:
+            if time.time() >= entry["retry_after"]:
+                self.stats["misses"] += 1
+                return None
+            tier = "negative_hits"
+        self.stats[tier] += 1
+        return entry
+
+    def put(
+        self,
+        address: str,
+        address_id: int | None,
+        latitude: float | None = None,
+        longitude: float | None = None,
+    ):
+        """
+        Stores the address in both tiers
+
+        Args:
+            address (str):
+                Address
+            address_id (int | None):
+                Id of the address in the addresses table (None for an
+                address which could not be located)
+            latitude (float | None, default None):
+                Latitude of the address
+            longitude (float | None, default None):
+                Longitude of the address
+        """
+        now = time.time()
+        retry_after = None if address_id != None else now + self.config["negative_ttl"]
+        entry = {
+            "address_id": address_id,
+            "latitude": latitude,
+            "longitude": longitude,
+            "retry_after": retry_after,
+        }
+        key = self.key_func(address)
+        self.remember(key=key, entry=entry)
+        self.db.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+            (key, address_id, latitude, longitude, now, retry_after),
+        )
+
+    def commit(self):
+        """Persists the stored entries"""
+        self.db.commit()
+
+    def log_stats(self):
+        """Logs statistics of the cache"""
+        logger.info(
+            f"Geocode cache: {self.stats['memory_hits']} memory hits, "
+            + f"{self.stats['store_hits']} store hits, "
+            + f"{self.stats['negative_hits']} negative hits, "
+            + f"{self.stats['misses']} misses"
+        )
@@ -0,0 +1,268 @@
+import re
+import hashlib
+import pandas as pd
+from sqlalchemy import text
+from datetime import datetime, timedelta
+
+from etl import logger
+from etl.utils import (
+    create_connection_engine,
+    read_table_from_database,
+    read_query_from_database,
+    save_data_to_database,
+    ensure_annotations,
+)
+
+
+@ensure_annotations()
+def offer_fingerprint(price: str | None, title: str | None) -> str:
+    """
+    Computes a fingerprint of an offer from it's price and title. Only
+    digits of the price are used and the title is reduced to the sorted
+    set of it's lowercase words. Without the title the fingerprint
+    depends on the price only
+
+    Args:
+        price (str | None):
+            Raw price of the offer
+        title (str | None):
+            Raw title of the offer
+
+    Returns:
+        str:
+            Fingerprint of the offer
+    """
+    price = "".join(re.findall(r"\d+", price or ""))
+    title = " ".join(sorted(set(re.findall(r"[\w\-²]+", (title or "").lower()))))
+    return hashlib.md5(f"{price}|{title}".encode("utf-8")).hexdigest()
+
+
+class OfferIndex:
+    """
+    Persistent index of already captured offers, which is stored in the
+    source database. For each offer_id it keeps the fingerprint of the
+    listing card and the dates when the offer was last fetched and seen.
+    The index is used to fetch only new or changed offers (and the ones
+    which were not refreshed for too long), while the raw rows of all
+    other offers are carried forward from the last parsed date.
+
+    The title of a listing card (e.g. '45,5 м², 2-комнатная квартира')
+    differs from the flat_type of the offer page, so the seeded offers
+    are fingerprinted by the price only, which is the same on both
+    pages. The fingerprint of a seeded offer is replaced with the one
+    of it's listing card when the offer is seen
+    """
+
+    def __init__(self, config: dict, main_table_name: str):
+        """
+        Initializes OfferIndex
+
+        Args:
+            config (dict):
+                Dictionary with the incremental config
+            main_table_name (str):
+                Name of the table with the raw data in the source database
+
+        Parameters:
+            index (pd.DataFrame):
+                Index data with offer_id as the index
+            seen (dict):
+                Fingerprint and status of each offer seen during the
+                current crawl
+        """
+        self.config = config
+        self.main_table_name = main_table_name
+        self.current_date = datetime.now().date()
+        self.seen = {}
+        self.prepare_table()
+        self.index = read_table_from_database(
+            table_name=self.config["table_name"], is_source_db=True
+        )
+        if len(self.index) == 0:
+            self.index = self.seed()
+        self.index = self.index.set_index("offer_id")
+
+    def prepare_table(self):
+        """
+        Creates the index table if it is missing (the databases created
+        before the table was added to init.sql)
+        """
+        engine = create_connection_engine(is_source_db=True)
+        with engine.begin() as connection:
+            connection.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS {self.config['table_name']} ("
+                    + "offer_id BIGINT PRIMARY KEY, fingerprint VARCHAR(32), "
+                    + "date_fetched DATE, date_seen DATE)"
+                )
+            )
+
+    def seed(self) -> pd.DataFrame:
+        """
+        Seeds the index from the latest raw rows of each offer. The
+        fingerprints are computed from the price (the last value of
+        fee_info) only
+
+        Returns:
+            pd.DataFrame:
+                Seeded index data
+        """
+        df = read_query_from_database(
+            query=(
+                f"SELECT DISTINCT ON (offer_id) offer_id, date_parsed, "
+                + f"fee_info FROM {self.main_table_name} "
+                + "ORDER BY offer_id, date_parsed DESC"
+            ),
+            is_source_db=True,
+        )
+        df["fingerprint"] = [
+            offer_fingerprint(
+                price=next((x for x in reversed(fee_info or []) if x != None), None),
+                title=None,
+            )
+            for fee_info in df["fee_info"]
+        ]
+        df = df.rename(columns={"date_parsed": "date_fetched"})
+        df["date_seen"] = df["date_fetched"]
+        df = df[["offer_id", "fingerprint", "date_fetched", "date_seen"]]
+        save_data_to_database(
+            df=df,
+            table_name=self.config["table_name"],
+            is_source_db=True,
+            index=False,
+            if_exists="append",
+        )
+        logger.info(f"Offer index has been seeded with {len(df)} offers")
+        return df
+
+    @ensure_annotations()
+    def classify(self, offer_id: int, price: str | None, title: str | None) -> str:
+        """
+        Classifies an offer from the listing and remembers it as seen
+        together with the fingerprint of it's listing card
+
+        Args:
+            offer_id (int):
+                Id of the offer
+            price (str | None):
+                Raw price from the listing card
+            title (str | None):
+                Raw title from the listing card
+
+        Returns:
+            str:
+                One of the following statuses:
+                - new: The offer is not in the index
+                - changed: The listing card of the offer has changed
+                - refresh: The offer was not fetched for too long
+                - unchanged: The offer can be carried forward
+        """
+        fingerprint = offer_fingerprint(price=price, title=title)
+        if offer_id not in self.index.index:
+            status = "new"
+        elif self.index.at[offer_id, "fingerprint"] not in (
+            fingerprint,
+            offer_fingerprint(price=price, title=None),
+        ):
+            status = "changed"
+        elif pd.to_datetime(self.index.at[offer_id, "date_fetched"]).date() <= (
+            self.current_date - timedelta(days=self.config["refresh_age_days"])
+        ):
+            status = "refresh"
+        else:
+            status = "unchanged"
+        self.seen[offer_id] = (fingerprint, status)
+        return status
+
+    def carried_offer_ids(self) -> list[int]:
+        """Ids of the seen offers which must be carried forward"""
+        return [k for k, (_, status) in self.seen.items() if status == "unchanged"]
+
+    def carry_forward(self, columns: list[str]) -> pd.DataFrame:
+        """
+        Reads the latest raw rows of the unchanged offers
+
+        Args:
+            columns (list[str]):
+                Columns of the raw data to be returned
+
+        Returns:
+            pd.DataFrame:
+                Latest raw rows of the unchanged offers
+        """
+        offer_ids = self.carried_offer_ids()
+        if len(offer_ids) == 0:
+            return pd.DataFrame(columns=columns)
+        df = read_query_from_database(
+            query=(
+                f"SELECT DISTINCT ON (offer_id) * FROM {self.main_table_name} "
+                + "WHERE offer_id = ANY(:offer_ids) "
+                + "ORDER BY offer_id, date_parsed DESC"
+            ),
+            is_source_db=True,
+            params={"offer_ids": [int(x) for x in offer_ids]},
+        )
+        return df[columns]
+
+    @ensure_annotations()
+    def update(self, fetched_offer_ids: list[int]):
+        """
+        Updates the index with the seen offers in a single transaction.
+        The fetched and the unchanged offers get the fingerprint of
+        their listing card, while the offers which were to be fetched
+        but failed keep their previous entry, so they are fetched again
+        during the next crawl
+
+        Args:
+            fetched_offer_ids (list[int]):
+                Ids of the offers which were fetched and parsed
+        """
+        fetched_offer_ids = set(fetched_offer_ids)
+        rows = []
+        for offer_id, (fingerprint, status) in self.seen.items():
+            if offer_id in fetched_offer_ids:
+                rows.append([offer_id, fingerprint, self.current_date])
+            elif status == "unchanged":
+                rows.append(
+                    [offer_id, fingerprint, self.index.at[offer_id, "date_fetched"]]
+                )
+            elif offer_id in self.index.index:
+                rows.append(
+                    [
+                        offer_id,
+                        self.index.at[offer_id, "fingerprint"],
+                        self.index.at[offer_id, "date_fetched"],
+                    ]
+                )
+        if len(rows) == 0:
+            return
+        df = pd.DataFrame(rows, columns=["offer_id", "fingerprint", "date_fetched"])
+        df["date_seen"] = self.current_date
+        engine = create_connection_engine(is_source_db=True)
+        with engine.begin() as connection:
+            connection.execute(
+                text(
+                    f"DELETE FROM {self.config['table_name']} "
+                    + "WHERE offer_id = ANY(:offer_ids)"
+                ),
+                {"offer_ids": [int(x) for x in df["offer_id"]]},
+            )
+            df.to_sql(
+                name=self.config["table_name"],
+                con=connection,
+                if_exists="append",
+                index=False,
+            )
+        logger.info(f"Offer index has been updated with {len(df)} offers")
+
+    def log_stats(self):
+        """Logs the number of seen offers of each status"""
+        counts = pd.Series([status for _, status in self.seen.values()])
+        counts = counts.value_counts().to_dict()
+        logger.info(
+            "Offer index: "
+            + ", ".join(
+                f"{counts.get(x, 0)} {x}"
+                for x in ["new", "changed", "refresh", "unchanged"]
+            )
+        )
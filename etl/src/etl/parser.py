@@ -2,28 +2,59 @@
 
 import re
 import time
-import random
 import requests
+import threading
+from typing import Callable
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed
 import pandas as pd
 from tqdm.auto import tqdm
 from datetime import datetime
 from bs4 import BeautifulSoup
 
-from etl import logger, PROXIES_PATH, CONFIG_PATH, LOG_PATH
+from etl import logger, PROXIES_PATH, CONFIG_PATH, LOG_PATH, STORAGE_PATH
+from etl.archive import HtmlArchive
+from etl.cache import ResponseCache
+from etl.checkpoint import CrawlFrontier
+from etl.crawler import AsyncCrawler, PipelineCrawler
+from etl.extractors import get_extractor, StateFirstExtractor
+from etl.incremental import OfferIndex
+from etl.proxy_pool import ProxyPool
+from etl.rate_limiter import AdaptiveRateLimiter
+from etl.retry import RetryPolicy, LatencyTracker, CircuitBreaker
+from etl.transport import HttpTransport
 from etl.utils import (
     save_txt,
     read_txt,
     read_yaml,
     save_data_to_database,
+    execute_sql_query,
     ensure_annotations,
 )
 
 
-def scrape_proxies():
-    """Retrieves available free proxies and saves them in the txt file"""
+# Statuses of the offers to be fetched in the order of their priority
+OFFER_PRIORITIES = ["new", "changed", "refresh"]
+
+
+def scrape_proxies(transport: HttpTransport | None = None):
+    """
+    Retrieves available free proxies, validates them and saves the
+    working ones in the txt file. If none of them works, the previously
+    saved proxies are kept (or all candidates are saved if there are no
+    saved proxies)
+
+    Args:
+        transport (HttpTransport | None, default None):
+            Transport to be used for the request. A new one is created
+            if not specified
+    """
     url = "https://free-proxy-list.net/"
-    with requests.Session() as s:
-        response = s.get(url, timeout=5)
+    config = read_yaml(path=CONFIG_PATH)["extraction"]
+    is_own_transport = transport == None
+    if is_own_transport:
+        transport = HttpTransport(config=config["transport"])
+    response = transport.get(url=url, timeout=5.0)
     bs = BeautifulSoup(response.text, "html.parser")
     data = list(map(lambda q: q.text, bs.find_all("td")))
     proxies = []
@@ -31,9 +62,27 @@ def scrape_proxies():
     while i * 8 + 1 < len(data):
         if re.match(r"\d+\.\d+\.\d+\.\d+", data[i * 8]) == None:
             break
-        proxies.append(f"{data[i*8]}:{i*8+1}")
+        proxies.append(f"{data[i*8]}:{data[i*8+1]}")
         i += 1
-    save_txt(data=proxies, path=PROXIES_PATH, verbose=True)
+
+    # Keeping only the proxies which pass the validation
+    pool = ProxyPool(
+        config=config["proxy_pool"],
+        proxies=proxies,
+        transport=transport,
+        path=STORAGE_PATH / "proxy_scores.json",
+    )
+    valid = pool.validate()
+    pool.save()
+    if len(valid) > 0:
+        save_txt(data=valid, path=PROXIES_PATH, verbose=True)
+    elif PROXIES_PATH.exists() and any(read_txt(path=PROXIES_PATH, verbose=False)):
+        logger.warning("No valid proxies have been found, the saved ones are kept")
+    else:
+        logger.warning("No valid proxies have been found, all candidates are saved")
+        save_txt(data=pool.proxies, path=PROXIES_PATH, verbose=True)
+    if is_own_transport:
+        transport.close()
 
 
 class RealtyYaParser:
@@ -49,17 +98,80 @@ class RealtyYaParser:
         Parameters:
             config (dict):
                 Dictionary with the config
-            proxies (list[str]):
-                List with proxies (if they are required)
+            proxy_pool (ProxyPool):
+                Pool of proxies with health scores (if they are required)
+            extractor (BaseExtractor):
+                Html extractor selected by bs_parser (see config)
+            transport (HttpTransport):
+                Pooled HTTP transport shared by all requests
+            rate_limiter (AdaptiveRateLimiter):
+                Rate limiter shared by all requests
+            retry_policy (RetryPolicy):
+                Classification of the failed attempts and their backoff
+            circuit_breaker (CircuitBreaker):
+                Circuit breaker which pauses the crawl on error spikes
+            latencies (LatencyTracker):
+                Latencies of the successful requests (with retries)
+            cache (ResponseCache | None):
+                On-disk response cache (if it is enabled)
+            offer_index (OfferIndex | None):
+                Index of already captured offers (if the incremental
+                crawl is enabled)
+            frontier (CrawlFrontier | None):
+                Persisted frontier of the current crawl (if checkpointing
+                is enabled)
+            archive (HtmlArchive | None):
+                Archive of the fetched offer pages (if it is enabled)
         """
         self.config = read_yaml(path=CONFIG_PATH)["extraction"]
+        self.extractor = get_extractor(
+            name=self.config["bs_parser"],
+            fields=self.config["parsing_fields"]["sub_fields"],
+            state_config=self.config["embedded_state"],
+        )
+        self.transport = HttpTransport(config=self.config["transport"])
+        self.rate_limiter = AdaptiveRateLimiter(config=self.config["rate_limiter"])
+        self.retry_policy = RetryPolicy(config=self.config["retry_policy"])
+        self.circuit_breaker = CircuitBreaker(config=self.config["circuit_breaker"])
+        self.latencies = LatencyTracker(size=self.config["hedging"]["window"])
+        self.attempt_latencies = LatencyTracker(size=self.config["hedging"]["window"])
+        self.retry_stats = dict(
+            (k, 0)
+            for k in ["ok", "timeout", "connection", "throttled", "server", "client"]
+            + ["hedged", "hedge_wins"]
+        )
+        self.stats_lock = threading.Lock()
+        self.hedging_executor = None
+        self.hedging_lock = threading.Lock()
+        self.offer_index = None
+        self.frontier = None
+        self.deadline = None
+        self.cards = {}
+        self.archive = None
+        if self.config["archive"]["enabled"]:
+            self.archive = HtmlArchive(
+                config=self.config["archive"], path=STORAGE_PATH / "html_archive"
+            )
+        self.cache = None
+        if self.config["cache"]["enabled"]:
+            self.cache = ResponseCache(
+                config=self.config["cache"], path=STORAGE_PATH / "http_cache"
+            )
         if self.config["use_proxy"]:
-            self.proxies = read_txt(path=PROXIES_PATH, verbose=True)
+            self.proxy_pool = ProxyPool(
+                config=self.config["proxy_pool"],
+                proxies=read_txt(path=PROXIES_PATH, verbose=True),
+                transport=self.transport,
+                path=STORAGE_PATH / "proxy_scores.json",
+            )
+            if self.config["proxy_pool"]["validate_on_load"]:
+                self.proxy_pool.validate()
 
     @ensure_annotations(False)
     def get(self, url: str) -> requests.models.Response | None:
         """
-        Requesting content for the specified url
+        Requesting content for the specified url. Offer pages are
+        archived (if the archive is enabled)
 
         Args:
             url (str):
@@ -70,28 +182,226 @@ class RealtyYaParser:
                 Reponse from the url. Returns None if there is no
                 successive response.
         """
-        # Looping until a successful response or the maximum number
-        # of tries is reached
-        for _ in range(self.config["number_of_tries"]):
-            proxy = None
-            # Getting a proxy if necessary
-            if self.config["use_proxy"]:
-                proxy = self.proxies[random.randint(0, len(self.proxies) - 1)]
-                proxy = {"http": proxy, "https": proxy}
-            # Trying to get a response
-            try:
-                with requests.Session() as s:
-                    response = s.get(
-                        url=url,
-                        timeout=self.config["waiting_time"],
-                        headers=self.config["headers"],
-                        proxies=proxy,
-                    )
-                    response.raise_for_status()
-                # Returning the response after a successful request
-                return response
-            except:
-                continue
+        response = self.request(url=url)
+        if self.archive != None and response != None:
+            if not url.startswith(self.config["url"]):
+                self.archive.store(offer_id=int(url.split("/")[-2]), html=response.text)
+        return response
+
+    def request(self, url: str) -> requests.models.Response | None:
+        """
+        Requesting content for the specified url through the cache, the
+        rate limiter and the proxy pool. Failed attempts are retried
+        according to the retry policy, slow attempts are hedged and all
+        requests are paused while the circuit breaker is open
+
+        Args:
+            url (str):
+                Url from which the content must be parsed
+
+        Returns:
+            requests.models.Response | None:
+                Reponse from the url. Returns None if there is no
+                successive response.
+        """
+        # Consulting the cache first
+        headers = self.config["headers"]
+        entry = None
+        if self.cache != None:
+            url_class = "listing" if url.startswith(self.config["url"]) else "offer"
+            entry, is_fresh = self.cache.lookup(url=url, url_class=url_class)
+            if is_fresh:
+                return self.cache.build_response(url=url, entry=entry)
+            if entry != None:
+                headers = {**headers, **self.cache.conditional_headers(entry=entry)}
+
+        # Looping until a successful response, a response which must not
+        # be retried or the maximum number of tries is reached
+        start = time.monotonic()
+        for attempt in range(self.config["number_of_tries"]):
+            self.circuit_breaker.wait()
+            response, kind, retry_after = self.hedged_attempt(url=url, headers=headers)
+            self.circuit_breaker.record(is_error=kind not in ["ok", "client"])
+            self.count_attempt(kind=kind)
+            if kind == "ok":
+                break
+            if not self.retry_policy.should_retry(kind):
+                logger.info(f"URL = {url} : {response.status_code} response")
+                return None
+            if attempt + 1 < self.config["number_of_tries"]:
+                time.sleep(self.retry_policy.backoff(attempt, retry_after))
+        else:
+            logger.info(f"URL = {url} : no successful response")
+            return None
+        self.latencies.add(time.monotonic() - start)
+
+        # Returning the cached content if it was not modified
+        if self.cache != None:
+            if response.status_code == 304 and entry != None:
+                self.cache.touch(url=url, revalidated=True)
+                return self.cache.build_response(url=url, entry=entry)
+            self.cache.store(url=url, url_class=url_class, response=response)
+        # Returning the response after a successful request
+        return response
+
+    def attempt(
+        self,
+        url: str,
+        headers: dict,
+        proxy: str | None = None,
+        is_reserved: bool = False,
+    ) -> tuple[requests.models.Response | None, str, float | None]:
+        """
+        Performs a single attempt to request the url
+
+        Args:
+            url (str):
+                Url from which the content must be parsed
+            headers (dict):
+                Headers of the request
+            proxy (str | None, default None):
+                Proxy to be used (the healthiest one is chosen if
+                proxies are used and it is not specified)
+            is_reserved (bool, default False):
+                Whether the tokens of the rate limiter have already been
+                taken for the attempt
+
+        Returns:
+            tuple[requests.models.Response | None, str, float | None]:
+                Response (None if there is no response), it's class (see
+                RetryPolicy.classify) and the Retry-After delay (s)
+        """
+        # Getting the healthiest proxy if necessary
+        if self.config["use_proxy"] and proxy == None:
+            proxy = self.proxy_pool.choose()
+        # Waiting for the rate limiter
+        if not is_reserved:
+            self.rate_limiter.acquire(url=url, proxy=proxy)
+        # Trying to get a response
+        start = time.monotonic()
+        response, retry_after = None, None
+        try:
+            response = self.transport.get(
+                url=url,
+                timeout=self.config["waiting_time"],
+                headers=headers,
+                proxy=proxy,
+            )
+            retry_after = response.headers.get("retry-after")
+            kind = self.retry_policy.classify(status_code=response.status_code)
+            self.rate_limiter.feedback(
+                url=url,
+                proxy=proxy,
+                status_code=response.status_code,
+                retry_after=retry_after,
+            )
+        except Exception as e:
+            kind = self.retry_policy.classify(status_code=None, error=e)
+            self.rate_limiter.feedback(url=url, proxy=proxy)
+        latency = time.monotonic() - start
+        if kind == "ok":
+            self.attempt_latencies.add(latency)
+        # Client errors are caused by the url itself rather than the proxy
+        if proxy != None:
+            self.proxy_pool.report(
+                proxy=proxy, success=kind in ["ok", "client"], latency=latency
+            )
+        return response, kind, self.rate_limiter.retry_after(retry_after)
+
+    def hedged_attempt(
+        self, url: str, headers: dict
+    ) -> tuple[requests.models.Response | None, str, float | None]:
+        """
+        Performs an attempt to request the url. If hedging is enabled and
+        the attempt takes longer than the configured percentile of the
+        latencies, a second attempt is fired (via another proxy if
+        proxies are used) and the first successful one is taken. The
+        second attempt is fired only if the rate limiter has a token
+        available right away, so hedging never waits for (or takes) the
+        tokens of the regular requests, and it is cancelled if the first
+        attempt succeeds before it has started
+
+        Args:
+            url (str):
+                Url from which the content must be parsed
+            headers (dict):
+                Headers of the request
+
+        Returns:
+            tuple[requests.models.Response | None, str, float | None]:
+                See attempt
+        """
+        cfg = self.config["hedging"]
+        if not cfg["enabled"] or len(self.attempt_latencies) < cfg["min_samples"]:
+            return self.attempt(url=url, headers=headers)
+        delay = self.attempt_latencies.percentile(cfg["percentile"])
+        executor = self.get_hedging_executor()
+        first = executor.submit(self.attempt, url, headers)
+        done, _ = wait([first], timeout=delay)
+        if len(done) > 0:
+            return first.result()
+        proxy = self.proxy_pool.choose() if self.config["use_proxy"] else None
+        if not self.rate_limiter.try_acquire(url=url, proxy=proxy):
+            return first.result()
+        self.count_attempt(kind="hedged")
+        second = executor.submit(self.attempt, url, headers, proxy, True)
+        for future in as_completed([first, second]):
+            result = future.result()
+            if result[1] == "ok":
+                if future is second:
+                    self.count_attempt(kind="hedge_wins")
+                else:
+                    second.cancel()
+                return result
+        return result
+
+    def count_attempt(self, kind: str):
+        """
+        Counts an attempt in retry_stats (attempts are made by several
+        threads in the async crawl and with hedging)
+        """
+        with self.stats_lock:
+            self.retry_stats[kind] += 1
+
+    def get_hedging_executor(self) -> ThreadPoolExecutor:
+        """Executor of the hedged attempts (it is created on first use)"""
+        with self.hedging_lock:
+            if self.hedging_executor == None:
+                self.hedging_executor = ThreadPoolExecutor(
+                    max_workers=self.config["hedging"]["max_workers"]
+                )
+            return self.hedging_executor
+
+    def close(self):
+        """
+        Releases the resources of the parser: shuts down the executor of
+        the hedged attempts (waiting for the attempts in flight) and
+        closes the pooled connections. The parser may be used again
+        afterwards
+        """
+        with self.hedging_lock:
+            executor, self.hedging_executor = self.hedging_executor, None
+        if executor != None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def log_request_stats(self):
+        """Logs the outcomes of the attempts and the latencies of the requests"""
+        p50, p95, p99 = [self.latencies.percentile(q) for q in [50, 95, 99]]
+        if p50 != None:
+            logger.info(
+                f"Request latency: p50 {p50:.2f} s, p95 {p95:.2f} s, p99 {p99:.2f} s"
+            )
+        logger.info(
+            f"Request attempts: {self.retry_stats}, "
+            + f"circuit breaker opened {self.circuit_breaker.n_opened} times"
+        )
 
     @ensure_annotations(False)
     def parse(
@@ -108,113 +418,661 @@ class RealtyYaParser:
             list[list[str | None]] | list:
                 Parsed content
         """
-        # Getting the content using BeautifulSoup
-        bs = BeautifulSoup(response.text, self.config["bs_parser"])
-        # Parsing information for each parsing field
-        content = []
-        for cfg in self.config["parsing_fields"]["sub_fields"].values():
-            content_ = bs.find_all(name=cfg["tag"], class_=cfg["classes"])
-            if len(content_) == 0:
-                content_ = None
-            else:
-                content_ = list(map(lambda x: x.text, content_))
-                if cfg["return_first_parsed"]:
-                    content_ = content_[0]
-            content.append(content_)
-        return content
+        # Parsing information for each parsing field with the extractor
+        return self.extractor.parse(html=response.text)
 
-    @ensure_annotations()
-    def retrieve(
-        self, return_data: bool = False, save_data: bool = False
-    ) -> pd.DataFrame | None:
+    @ensure_annotations(False, [])
+    def get_offer_urls(self, response: requests.models.Response) -> list[str]:
         """
-        Requests the content from the specific url (see class
-        definition above) and parses necessary information
+        Retrieves relative urls to all offers available on a listing page
 
         Args:
-            return_data (bool, optional): Whether to return parsed data.
-                Defaults to False.
-            save_data (bool, optional): Whether to save parsed data.
-                Defaults to False.
+            response (requests.models.Response):
+                Response from the listing page
 
         Returns:
-            pd.DataFrame | None: Parsed content as Pandas DataFrame
-                (if return_data=True)
+            list[str]:
+                Relative urls to the offers
+        """
+        return self.extractor.links(
+            html=response.text,
+            tag=self.config["parsing_fields"]["main_field"]["tag"],
+            classes=self.config["parsing_fields"]["main_field"]["classes"],
+        )
+
+    @ensure_annotations(False, [])
+    def get_offer_cards(self, response: requests.models.Response) -> list[dict]:
+        """
+        Retrieves relative urls and listing card fields (see config) of
+        all offers available on a listing page
+
+        Args:
+            response (requests.models.Response):
+                Response from the listing page
+
+        Returns:
+            list[dict]:
+                Relative url, offer_id and card fields of each offer
+        """
+        cards = []
+        offers = BeautifulSoup(response.text, self.extractor.soup_features).find_all(
+            name=self.config["parsing_fields"]["main_field"]["tag"],
+            class_=self.config["parsing_fields"]["main_field"]["classes"],
+        )
+        for offer in offers:
+            href = offer.get_attribute_list("href")[0]
+            card = {"href": href, "offer_id": int(href.split("/")[-2])}
+            container = offer.find_parent(
+                name=self.config["parsing_fields"]["card_field"]["tag"],
+                class_=self.config["parsing_fields"]["card_field"]["classes"],
+            )
+            for field, cfg in self.config["parsing_fields"]["card_sub_fields"].items():
+                content_ = []
+                if container != None:
+                    content_ = container.find_all(name=cfg["tag"], class_=cfg["classes"])
+                if len(content_) == 0:
+                    content_ = None
+                else:
+                    content_ = list(map(lambda x: x.text, content_))
+                    if cfg["return_first_parsed"]:
+                        content_ = content_[0]
+                card[field] = content_
+            cards.append(card)
+        return cards
+
+    @ensure_annotations(False, [])
+    def get_offers_to_fetch(
+        self, response: requests.models.Response
+    ) -> list[str] | None:
+        """
+        Retrieves relative urls of the offers from a listing page which
+        must be fetched. If the incremental crawl is enabled, unchanged
+        offers are skipped (they are carried forward after the crawl)
+
+        Args:
+            response (requests.models.Response):
+                Response from the listing page
+
+        Returns:
+            list[str] | None:
+                Relative urls to the offers to be fetched. None if the
+                page yields no new offers (the listing is exhausted)
+        """
+        if self.offer_index == None and not self.config["shallow"]["enabled"]:
+            cards = [{"href": x} for x in self.get_offer_urls(response=response)]
+        else:
+            cards = self.get_offer_cards(response=response)
+
+        # Checking if the page has any offers which were not seen before
+        hrefs = [card["href"] for card in cards]
+        if self.config["pagination"]["stop_early"] and all(
+            x in self.seen_offers for x in hrefs
+        ):
+            return None
+        self.seen_offers.update(hrefs)
+        if self.config["shallow"]["enabled"]:
+            self.cards.update((card["href"], card) for card in cards)
+
+        if self.offer_index == None:
+            return hrefs
+        offers = []
+        for card in cards:
+            status = self.offer_index.classify(
+                offer_id=card["offer_id"], price=card["price"], title=card["title"]
+            )
+            if status != "unchanged":
+                offers.append(card["href"])
+        return offers
+
+    @ensure_annotations(False)
+    def discover_number_of_pages(
+        self, response: requests.models.Response
+    ) -> int | None:
+        """
+        Discovers the number of listing pages from the pagination links
+        of a listing page
+
+        Args:
+            response (requests.models.Response):
+                Response from the listing page
+
+        Returns:
+            int | None:
+                Number of listing pages (None if there are no pagination
+                links)
         """
+        pages = list(map(int, re.findall(r"[?&]page=(\d+)", response.text)))
+        if len(pages) == 0:
+            return None
+        return max(pages) + 1
+
+    def iter_listing_pages(self, progress, prefetch: Callable | None = None):
+        """
+        Requests listing pages one by one and yields the offers to be
+        fetched from each of them. The number of pages is discovered from
+        the first page and limited by number_of_pages (or by hard_cap if
+        extend_beyond_limit is set). The iteration stops as soon as a
+        page yields no new offers. If prefetch is specified, only the
+        first requested page is requested by the parser: the remaining
+        pages are requested concurrently by prefetch as soon as the
+        number of pages is known, and their responses are still handled
+        in the order of the pages (the requests of the pages which follow
+        an exhausted page are cancelled)
+
+        Args:
+            progress (tqdm):
+                Progress bar whose total is adjusted to the number of
+                pages
+            prefetch (Callable | None, default None):
+                Function which requests the listing pages with the
+                specified numbers and returns a future of the response
+                of each page
+
+        Yields:
+            tuple[int, list[str]]:
+                Number of the page and relative urls of the offers
+        """
+        cfg = self.config["pagination"]
+        limit = self.config["number_of_pages"]
+        if cfg["extend_beyond_limit"]:
+            limit = cfg["hard_cap"]
+        n_pages = limit
+        self.seen_offers = set()
+        self.cards = {}
+        self.n_viewed_pages = 0
+        page = 0
+        prefetched = None
+
+        # Loading the listing pages recorded by an interrupted crawl
+        recorded, exhausted = {}, None
+        if self.frontier != None:
+            if self.frontier.get_meta("n_pages") != None:
+                n_pages = min(int(self.frontier.get_meta("n_pages")), limit)
+                progress.total = n_pages
+                progress.refresh()
+            if self.frontier.get_meta("exhausted") != None:
+                exhausted = int(self.frontier.get_meta("exhausted"))
+            for page_, hrefs, _, seen in self.frontier.pages():
+                recorded[page_] = hrefs
+                self.seen_offers.update(hrefs)
+                if self.offer_index != None:
+                    self.offer_index.seen.update(
+                        (int(k), tuple(v)) for k, v in seen.items()
+                    )
 
+        while page < n_pages:
+
+            # Replaying a recorded page without requesting it again
+            if page in recorded:
+                yield page, self.frontier.unresolved_offers(page=page)
+                page += 1
+                continue
+            if exhausted != None and page >= exhausted:
+                break
+
+            if prefetched != None and page in prefetched:
+                response = prefetched.pop(page).result()
+            else:
+                response = self.get(url=f"{self.config['url']}?page={page}")
+            self.n_viewed_pages += 1
+
+            # Adjusting the number of pages after the first page
+            if page == 0 and cfg["discover"]:
+                n_discovered = self.discover_number_of_pages(response=response)
+                if n_discovered != None:
+                    n_pages = min(n_discovered, limit)
+                    logger.info(f"Number of discovered pages: {n_discovered}")
+                    if self.frontier != None:
+                        self.frontier.set_meta("n_pages", str(n_discovered))
+                progress.total = n_pages
+                progress.refresh()
+
+            # Stopping if the listing is exhausted (recorded pages which
+            # follow the current one are still replayed)
+            seen_offers = set(self.seen_offers)
+            seen = {} if self.offer_index == None else dict(self.offer_index.seen)
+            offers = self.get_offers_to_fetch(response=response)
+            if offers == None:
+                logger.info(f"Page {page} yields no new offers, stopping")
+                if self.frontier != None:
+                    self.frontier.set_meta("exhausted", str(page))
+                exhausted = page
+                self.cancel_prefetched(prefetched=prefetched)
+                page += 1
+                continue
+
+            # Requesting the remaining pages concurrently once the number
+            # of pages is known
+            if prefetch != None and prefetched == None:
+                prefetched = prefetch(
+                    pages=[x for x in range(page + 1, n_pages) if x not in recorded]
+                )
+
+            # Recording the page in the frontier (unless it was not possible
+            # to request it, so that it is requested again on resume)
+            if self.frontier != None and response != None:
+                if self.offer_index != None:
+                    seen = dict(
+                        (k, v) for k, v in self.offer_index.seen.items() if k not in seen
+                    )
+                self.frontier.add_page(
+                    page=page,
+                    hrefs=sorted(self.seen_offers - seen_offers),
+                    offers=offers,
+                    seen=seen,
+                )
+            yield page, offers
+            page += 1
+        self.cancel_prefetched(prefetched=prefetched)
+
+    @staticmethod
+    def cancel_prefetched(prefetched: dict | None):
+        """Cancels the requests of the prefetched pages which are not needed"""
+        for future in (prefetched or {}).values():
+            future.cancel()
+        if prefetched != None:
+            prefetched.clear()
+
+    def start_retrieval(
+        self, fresh_crawl: bool = False, time_budget: float | None = None
+    ):
+        """
+        Prepares the parser for a crawl: loads the index of already
+        captured offers and the crawl frontier (if required) and
+        initialises the progress bar, counters and the deadline
+
+        Args:
+            fresh_crawl (bool, optional, default False):
+                Whether to drop the frontier of an interrupted crawl
+                at the current date and start from the first page
+            time_budget (float | None, optional, default None):
+                Time budget of the crawl in minutes (None if the crawl
+                is not limited)
+        """
         logger.info(f"STARTING PARSING STAGE")
 
-        # Inititialisation of the list to store parsed data
-        content = [
-            None
-            for _ in range(
-                self.config["max_number_of_offers_per_page"]
-                * self.config["number_of_pages"]
+        # Setting the deadline of the crawl if required
+        self.deadline = None
+        self.deferred_offers = []
+        if time_budget != None:
+            self.deadline = time.monotonic() + 60 * time_budget
+            logger.info(f"Time budget of the crawl: {time_budget} min")
+
+        # Opening the frontier of the current crawl if required
+        self.frontier = None
+        if self.config["checkpoint"]["enabled"]:
+            self.frontier = CrawlFrontier(
+                path=STORAGE_PATH / "checkpoints",
+                date_parsed=datetime.now().date().strftime("%Y-%m-%d"),
+                fresh=fresh_crawl,
+            )
+
+        # Loading the index of already captured offers if required
+        self.offer_index = None
+        if self.config["incremental"]["enabled"]:
+            self.offer_index = OfferIndex(
+                config=self.config["incremental"],
+                main_table_name=self.config["main_table_name"],
             )
-        ]
 
-        # Inititialisation of the tqdm iterator with a postfix over the pages
-        iterator = tqdm(
-            iterable=range(self.config["number_of_pages"]),
+        # Inititialisation of the tqdm progress bar with a postfix over the pages
+        self.progress = tqdm(
+            total=self.config["number_of_pages"],
             file=open(f"{LOG_PATH}/running_logs.log", "a"),
         )
-        d = {"content_size": 0, "skipped": 0}
-        iterator.set_postfix(d)
+        self.counters = {"content_size": 0, "skipped": 0}
+        self.progress.set_postfix(self.counters)
+
+    def record_offer(self, offer: str, content: list | None):
+        """
+        Records the result of fetching the offer in the crawl frontier
+        (if checkpointing is enabled)
+
+        Args:
+            offer (str):
+                Relative url of the offer
+            content (list | None):
+                Parsed content with the offer_id appended (None if it was
+                not possible to parse it)
+        """
+        if self.frontier != None:
+            self.frontier.mark_offer(offer=offer, content=content)
+
+    def iter_content(self, replay: list[str]):
+        """
+        Crawls the listing pages with the requested crawl mode and yields
+        parsed content of each offer. If an interrupted crawl is resumed,
+        the content which was parsed before is replayed first
+
+        Args:
+            replay (list[str]):
+                Statuses of the offers in the frontier to be replayed
+
+        Yields:
+            list:
+                Parsed content of the offer with the offer_id appended
+        """
+        d = self.counters
+
+        # Replaying the content parsed by an interrupted crawl
+        if self.frontier != None and self.frontier.is_resumed:
+            contents = self.frontier.contents(statuses=replay)
+            logger.info(f"Number of replayed observations: {len(contents)}")
+            for content_ in contents:
+                d["content_size"] += 1
+                yield content_
+
+        # Building the content from the listing cards only
+        if self.config["shallow"]["enabled"]:
+            yield from self.iter_shallow_content()
+
+        # Crawling the prioritised offers within the time budget
+        elif self.deadline != None:
+            yield from self.iter_budgeted_content()
+
+        # Crawling all pages with a concurrent engine if it is requested
+        elif self.config["crawl_mode"] in ["async", "pipeline"]:
+            crawler = {"async": AsyncCrawler, "pipeline": PipelineCrawler}
+            pages = crawler[self.config["crawl_mode"]](parser=self).iter_crawl(
+                progress=self.progress
+            )
+            for offers_content in pages:
+                for content_ in offers_content:
+                    if content_ == None:
+                        d["skipped"] += 1
+                    else:
+                        d["content_size"] += 1
+                        yield content_
+                self.progress.set_postfix(d)
 
         # Parsing each page in the loop
-        for page in iterator:
+        else:
+            for page, offers in self.iter_listing_pages(progress=self.progress):
+
+                # Parsing each offer separately
+                for offer in offers:
+                    content_ = self.fetch_offer(offer=offer)
+
+                    # Updating counters & checking if anything was parsed
+                    if content_ == None:
+                        d["skipped"] += 1
+                    else:
+                        d["content_size"] += 1
+                        yield content_
+
+                # Updating tqdm progress bar and postfix
+                self.progress.update(1)
+                self.progress.set_postfix(d)
+
+    def fetch_offer(self, offer: str) -> list | None:
+        """
+        Requests and parses a single offer and records the result in the
+        crawl frontier
+
+        Args:
+            offer (str):
+                Relative url of the offer
 
-            # Retrieving urls to all available offers
-            response = self.get(url=f"{self.config['url']}?page={page}")
-            offers = BeautifulSoup(response.text, self.config["bs_parser"]).find_all(
-                name=self.config["parsing_fields"]["main_field"]["tag"],
-                class_=self.config["parsing_fields"]["main_field"]["classes"],
+        Returns:
+            list | None:
+                Parsed content with the offer_id appended (None if it was
+                not possible to parse content)
+        """
+        response = self.get(url=f"{self.config['offers_url']}{offer}")
+        content = self.parse(response=response)
+        if content == None:
+            with open(f"{LOG_PATH}/running_logs.log", "a") as f:
+                f.write("\n")
+            logger.info(
+                f"URL = {self.config['offers_url']}{offer} : unable to parse content"
             )
-            offers = list(map(lambda x: x.get_attribute_list("href")[0], offers))
+        else:
+            content.append(offer.split("/")[-2])
+        self.record_offer(offer=offer, content=content)
+        return content
 
-            # Parsing each offer separately
-            for offer in offers:
+    def card_content(self, card: dict) -> list:
+        """
+        Builds the content of an offer from it's listing card. Only the
+        fields which are shown on the card are filled (the area and the
+        floor of main_info and the price of fee_info), while other
+        fields are None
 
-                # getting a response for the current offer
-                response = self.get(url=f"{self.config['offers_url']}{offer}")
+        Args:
+            card (dict):
+                Listing card of the offer (see get_offer_cards)
 
-                # Parsing data
-                content_ = self.parse(response=response)
+        Returns:
+            list:
+                Content of the offer in the form of the parsed content
+                with the offer_id appended
+        """
+        main_info = []
+        if card["title"] != None:
+            area = re.search(r"(\d+(?:[.,]\d+)?)\s*м²", card["title"])
+            if area != None:
+                main_info.append(f"{area.group(1).replace(',', '.')} м² общая")
+        if card["floor"] != None:
+            main_info.append(card["floor"])
+        content = {
+            "flat_type": card["title"],
+            "main_info": main_info if len(main_info) > 0 else None,
+            "fee_info": None if card["price"] == None else [None] * 3 + [card["price"]],
+            "address_info": card["address"],
+        }
+        fields = self.config["parsing_fields"]["sub_fields"]
+        return [content.get(field) for field in fields] + [str(card["offer_id"])]
 
-                # Updating counters & checking if anything was parsed
+    def iter_shallow_content(self):
+        """
+        Crawls the listing pages only and yields the content of each
+        offer built from it's listing card. If deep_fetch_new is set,
+        new offers (see offer_priority) are requested and parsed as
+        usual. Offers of the replayed listing pages have no cards, so
+        they are requested as well
+
+        Yields:
+            list:
+                Content of the offer with the offer_id appended
+        """
+        d = self.counters
+        d["from_cards"] = 0
+        deep_fetch_new = self.config["shallow"]["deep_fetch_new"]
+        for _, offers in self.iter_listing_pages(progress=self.progress):
+            for offer in offers:
+                if offer not in self.cards or (
+                    deep_fetch_new and self.offer_priority(offer) == 0
+                ):
+                    content_ = self.fetch_offer(offer=offer)
+                else:
+                    content_ = self.card_content(card=self.cards.pop(offer))
+                    self.record_offer(offer=offer, content=content_)
+                    d["from_cards"] += 1
                 if content_ == None:
                     d["skipped"] += 1
-                    with open(f"{LOG_PATH}/running_logs.log", "a") as f:
-                        f.write("\n")
-                    logger.info(
-                        f"URL = {self.config['offers_url']}{offer} : "
-                        + "unable to parse content"
-                    )
                 else:
-                    content_.append(offer.split("/")[-2])
-                    content[d["content_size"]] = content_
                     d["content_size"] += 1
+                    yield content_
+            self.progress.update(1)
+            self.progress.set_postfix(d)
+
+    def offer_priority(self, offer: str) -> int:
+        """
+        Priority of the offer in a time-budgeted crawl (the lower the
+        earlier): new offers, then changed offers, then refreshes
 
-                # Timeout between requests
-                time.sleep(self.config["timeout_between_requests"])
+        Args:
+            offer (str):
+                Relative url of the offer
+
+        Returns:
+            int:
+                Priority of the offer
+        """
+        if self.offer_index == None:
+            return 0
+        _, status = self.offer_index.seen.get(int(offer.split("/")[-2]), (None, "new"))
+        return OFFER_PRIORITIES.index(status)
+
+    def estimate_latency(self) -> float:
+        """Estimated latency (s) of the next request from the observed ones"""
+        latency = self.latencies.percentile(50)
+        if latency == None:
+            return self.config["time_budget"]["initial_latency"]
+        return latency
+
+    def iter_budgeted_content(self):
+        """
+        Crawls the listing pages within the time budget: all listing
+        pages are requested first, then the offers are requested in the
+        order of their priority (see offer_priority) until the next
+        request is not expected to finish before the deadline. The
+        remaining offers are deferred
+
+        Yields:
+            list:
+                Parsed content of the offer with the offer_id appended
+        """
+        d = self.counters
 
-            # Updating tqdm postfix
-            iterator.set_postfix(d)
+        # Requesting the listing pages first
+        offers = []
+        for _, offers_ in self.iter_listing_pages(progress=self.progress):
+            offers.extend(offers_)
+            self.progress.update(1)
+            if time.monotonic() >= self.deadline:
+                logger.warning(
+                    "Time budget is exhausted while requesting the listing pages"
+                )
+                break
+        offers = deque(sorted(offers, key=self.offer_priority))
 
-        # Logging the final status
+        # Requesting the offers in the order of their priority, while the
+        # next request is expected to finish before the deadline
+        n_workers = 1
+        if self.config["crawl_mode"] != "serial":
+            n_workers = self.config["async_crawl"]["max_concurrency"]
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            while len(offers) > 0 or len(in_flight) > 0:
+                while len(offers) > 0 and len(in_flight) < n_workers:
+                    if time.monotonic() + self.estimate_latency() > self.deadline:
+                        self.deferred_offers.extend(offers)
+                        offers.clear()
+                        break
+                    offer = offers.popleft()
+                    in_flight.append(executor.submit(self.fetch_offer, offer))
+                if len(in_flight) == 0:
+                    break
+                content_ = in_flight.popleft().result()
+                if content_ == None:
+                    d["skipped"] += 1
+                else:
+                    d["content_size"] += 1
+                    yield content_
+                d["eta_s"] = round(self.estimate_latency() * len(offers) / n_workers)
+                self.progress.set_postfix(d)
+
+    def finish_retrieval(self):
+        """Closes the progress bar and logs the final status of the crawl"""
+        self.progress.close()
         with open(f"{LOG_PATH}/running_logs.log", "a") as f:
             f.write("\n")
-        logger.info(f"Number of parsed observations: {d['content_size']}")
-        logger.info(f"Number of skipped observations: {d['skipped']}")
-        logger.info(f"Number of viewed pages: {self.config['number_of_pages']}")
+        logger.info(f"Number of parsed observations: {self.counters['content_size']}")
+        logger.info(f"Number of skipped observations: {self.counters['skipped']}")
+        logger.info(f"Number of viewed pages: {self.n_viewed_pages}")
+        if self.config["shallow"]["enabled"]:
+            logger.info(
+                "Number of observations built from listing cards: "
+                + f"{self.counters['from_cards']}"
+            )
+        if self.deadline != None:
+            priorities = [self.offer_priority(x) for x in self.deferred_offers]
+            counts = {x: priorities.count(i) for i, x in enumerate(OFFER_PRIORITIES)}
+            logger.info(
+                f"Number of deferred offers: {len(self.deferred_offers)} {counts}"
+            )
+        self.transport.log_stats()
+        self.close()
+        self.rate_limiter.log_rates()
+        self.log_request_stats()
+        if self.cache != None:
+            self.cache.log_stats()
+        if self.config["use_proxy"]:
+            self.proxy_pool.save()
+        if self.frontier != None:
+            self.frontier.log_stats()
+        if self.archive != None:
+            self.archive.log_stats()
+        if isinstance(self.extractor, StateFirstExtractor):
+            self.extractor.log_stats()
 
-        # Creating DataFrame with parsed data
+    def to_frame(self, content: list[list]) -> pd.DataFrame:
+        """
+        Creates DataFrame with parsed data
+
+        Args:
+            content (list[list]):
+                Parsed content of the offers with the offer_id appended
+
+        Returns:
+            pd.DataFrame:
+                Parsed content as Pandas DataFrame
+        """
         content = pd.DataFrame(
-            data=content[: d["content_size"]],
+            data=content,
             columns=list(self.config["parsing_fields"]["sub_fields"].keys())
             + ["offer_id"],
         )
         content["offer_id"] = content["offer_id"].astype("int64")
+        return content
+
+    @ensure_annotations()
+    def retrieve(
+        self,
+        return_data: bool = False,
+        save_data: bool = False,
+        fresh_crawl: bool = False,
+        time_budget: float | None = None,
+    ) -> pd.DataFrame | None:
+        """
+        Requests the content from the specific url (see class
+        definition above) and parses necessary information
+
+        Args:
+            return_data (bool, optional): Whether to return parsed data.
+                Defaults to False.
+            save_data (bool, optional): Whether to save parsed data.
+                Defaults to False.
+            fresh_crawl (bool, optional): Whether to start a fresh crawl
+                instead of resuming an interrupted one. Defaults to False.
+            time_budget (float | None, optional): Time budget of the crawl
+                in minutes. Offers are requested in the order of their
+                priority and the remaining ones are deferred at the
+                deadline. Defaults to None (no limit).
+
+        Returns:
+            pd.DataFrame | None: Parsed content as Pandas DataFrame
+                (if return_data=True)
+        """
+
+        self.start_retrieval(fresh_crawl=fresh_crawl, time_budget=time_budget)
+
+        # Crawling and parsing all offers
+        content = list(self.iter_content(replay=["done", "saved"]))
+        self.finish_retrieval()
+
+        # Creating DataFrame with parsed data
+        content = self.to_frame(content=content)
+
+        # Updating the index and carrying forward unchanged offers
+        if self.offer_index != None:
+            self.offer_index.update(fetched_offer_ids=content["offer_id"].tolist())
+            self.offer_index.log_stats()
+            carried = self.offer_index.carry_forward(columns=list(content.columns))
+            if len(carried) > 0:
+                content = pd.concat([content, carried], ignore_index=True)
+            logger.info(f"Number of carried forward observations: {len(carried)}")
 
         # Dropping duplicates (if any) based on offer_id column
         content = content.drop_duplicates(subset="offer_id")
@@ -236,3 +1094,170 @@ class RealtyYaParser:
         # Returning DataFrame if required
         if return_data:
             return content
+
+    @ensure_annotations()
+    def reextract(self, date_parsed: str) -> pd.DataFrame:
+        """
+        Parses the archived offer pages of the day with the current
+        parsing fields (see config) without requesting them again
+
+        Args:
+            date_parsed (str):
+                Date in the format %Y-%m-%d
+
+        Returns:
+            pd.DataFrame:
+                Parsed content as Pandas DataFrame
+        """
+        logger.info(f"STARTING RE-EXTRACTION STAGE ({date_parsed})")
+        if self.archive == None:
+            logger.error("Unable to re-extract the content: the archive is disabled")
+            raise ValueError("The archive is disabled")
+        start = time.monotonic()
+        content = self.archive.reextract(
+            date_parsed=date_parsed,
+            parser=self.config["bs_parser"],
+            fields=self.config["parsing_fields"]["sub_fields"],
+            state_config=self.config["embedded_state"],
+        )
+        content = self.to_frame(content=content)
+        content = content.drop_duplicates(subset="offer_id")
+        content["date_parsed"] = date_parsed
+        logger.info(
+            f"Number of re-extracted observations: {len(content)} "
+            + f"({time.monotonic() - start:.1f} s)"
+        )
+        logger.info(f"ENDING RE-EXTRACTION STAGE")
+        return content
+
+    def flush_batch(
+        self, batch: pd.DataFrame, date_parsed: str, save_data: bool
+    ) -> pd.DataFrame:
+        """
+        Completes a batch of parsed content and saves it if required
+
+        Args:
+            batch (pd.DataFrame):
+                Batch of parsed content
+            date_parsed (str):
+                Date of the crawl
+            save_data (bool):
+                Whether to append the batch to the main table of the
+                source database
+
+        Returns:
+            pd.DataFrame:
+                Batch with date_parsed column
+        """
+        batch = batch.drop_duplicates(subset="offer_id")
+        batch["date_parsed"] = date_parsed
+        if save_data:
+            save_data_to_database(
+                df=batch,
+                table_name=self.config["main_table_name"],
+                is_source_db=True,
+                index=False,
+                if_exists="append",
+            )
+            if self.frontier != None:
+                self.frontier.mark_saved(offer_ids=batch["offer_id"].tolist())
+        return batch
+
+    def retrieve_batches(
+        self,
+        save_data: bool = True,
+        overwrite: bool = False,
+        fresh_crawl: bool = False,
+        time_budget: float | None = None,
+    ):
+        """
+        Streaming version of retrieve. Parsed offers are grouped into
+        micro-batches of streaming.batch_size rows (see config), each
+        batch is written to the source database as soon as it is
+        complete and yielded. Offers which were already yielded during
+        the crawl are dropped, so the memory is proportional to the batch
+        size rather than to the crawl size. If an interrupted crawl is
+        resumed, offers which were already saved are not saved again
+
+        Args:
+            save_data (bool, optional, default True):
+                Whether to append each batch to the main table of the
+                source database
+            overwrite (bool, optional, default False):
+                Whether to delete rows with the current date from the
+                main table before the first batch is saved
+            fresh_crawl (bool, optional, default False):
+                Whether to start a fresh crawl instead of resuming an
+                interrupted one
+            time_budget (float | None, optional, default None):
+                Time budget of the crawl in minutes (see retrieve)
+
+        Yields:
+            pd.DataFrame:
+                Batch of parsed content with offer_id and date_parsed
+                columns
+        """
+        batch_size = self.config["streaming"]["batch_size"]
+        date_parsed = datetime.now().date().strftime("%Y-%m-%d")
+        seen_offer_ids = set()
+        n_duplicates = 0
+        n_batches = 0
+
+        self.start_retrieval(fresh_crawl=fresh_crawl, time_budget=time_budget)
+
+        # Deleting rows from the main table with the current date (the
+        # offers saved by an interrupted crawl must be saved again)
+        if save_data and overwrite:
+            execute_sql_query(
+                query=(
+                    f"DELETE FROM {self.config['main_table_name']} "
+                    + f"WHERE date_parsed='{date_parsed}';"
+                ),
+                is_source_db=True,
+            )
+            logger.info(
+                f"Rows from {self.config['main_table_name']} table "
+                + f"with date_parsed='{date_parsed}' have been deleted"
+            )
+            if self.frontier != None:
+                self.frontier.unmark_saved()
+
+        # Offers saved by an interrupted crawl are not saved again
+        if self.frontier != None:
+            seen_offer_ids.update(self.frontier.offer_ids(statuses=["saved"]))
+
+        # Crawling offers and flushing each complete batch
+        batch = []
+        for content_ in self.iter_content(replay=["done"]):
+            offer_id = int(content_[-1])
+            if offer_id in seen_offer_ids:
+                n_duplicates += 1
+                continue
+            seen_offer_ids.add(offer_id)
+            batch.append(content_)
+            if len(batch) == batch_size:
+                n_batches += 1
+                yield self.flush_batch(self.to_frame(content=batch), date_parsed, save_data)
+                batch = []
+        if len(batch) > 0:
+            n_batches += 1
+            yield self.flush_batch(self.to_frame(content=batch), date_parsed, save_data)
+        self.finish_retrieval()
+        logger.info(f"Number of in-flight duplicates: {n_duplicates}")
+
+        # Updating the index and carrying forward unchanged offers
+        if self.offer_index != None:
+            self.offer_index.update(fetched_offer_ids=sorted(seen_offer_ids))
+            self.offer_index.log_stats()
+            columns = list(self.config["parsing_fields"]["sub_fields"].keys())
+            carried = self.offer_index.carry_forward(columns=columns + ["offer_id"])
+            carried = carried[~carried["offer_id"].isin(seen_offer_ids)]
+            for i in range(0, len(carried), batch_size):
+                n_batches += 1
+                yield self.flush_batch(
+                    carried.iloc[i : i + batch_size].copy(), date_parsed, save_data
+                )
+            logger.info(f"Number of carried forward observations: {len(carried)}")
+
+        logger.info(f"Number of flushed batches: {n_batches}")
+        logger.info(f"ENDING PARSING STAGE")
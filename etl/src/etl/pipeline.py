@@ -1,25 +1,78 @@
 #!/usr/local/bin/python3
 
 import sys
+import pandas as pd
 from datetime import datetime
 
 from etl import logger
 from etl.parser import RealtyYaParser
 from etl.transformer import RealtyYaTransformer
 from etl.utils import (
-    read_table_from_database,
+    read_query_from_database,
     save_data_to_database,
     execute_sql_query,
     ensure_annotations,
 )
 
 
+@ensure_annotations()
+def delete_rows_at_date(table_name: str, date: str, is_source_db: bool) -> None:
+    """
+    Deletes rows from the table with the specified date_parsed
+
+    Args:
+        table_name (str):
+            Name of the table
+        date (str):
+            Date in the format %Y-%m-%d
+        is_source_db (bool):
+            Whether the table is in the source database
+    """
+    query = f"DELETE FROM {table_name} WHERE date_parsed='{date}';"
+    _ = execute_sql_query(
+        query=query,
+        is_source_db=is_source_db,
+    )
+    logger.info(
+        f"Rows from {table_name} table with date_parsed='{date}' have been deleted"
+    )
+
+
+@ensure_annotations()
+def read_rows_at_date(table_name: str, date: str, is_source_db: bool) -> pd.DataFrame:
+    """
+    Reads rows from the table with the specified date_parsed
+
+    Args:
+        table_name (str):
+            Name of the table
+        date (str):
+            Date in the format %Y-%m-%d
+        is_source_db (bool):
+            Whether the table is in the source database
+
+    Returns:
+        pd.DataFrame:
+            Rows with the date_parsed
+    """
+    df = read_query_from_database(
+        query=f"SELECT * FROM {table_name} WHERE date_parsed=:date_parsed",
+        is_source_db=is_source_db,
+        params={"date_parsed": date},
+    )
+    logger.info(f"Rows from {table_name} table with date_parsed='{date}' have been read")
+    return df
+
+
 @ensure_annotations()
 def run_etl_pipeline(
     parse: bool = True,
     transform: bool = True,
     overwrite_source: bool = False,
     overwrite_destination: bool = False,
+    fresh_crawl: bool = False,
+    reextract_date: str | None = None,
+    time_budget: float | None = None,
 ) -> None:
     """
     Runs the ETL pipeline
@@ -30,17 +83,34 @@ def run_etl_pipeline(
         transform (bool, optional, default True):
             Whether to transform data. If parse is True then newly
             parsed data is transformed, else - the parsed data at
-            the current date if it exists.
+            the current date (or at reextract_date) if it exists.
         overwrite_source (bool, optional, default False):
             Whether to overwrite recently obtained source data,
             if it was obtained at the same day.
         overwrite_destination (bool, optional, default False):
             Whether to overwrite recently obtained destination data,
             if it was obtained at the same day.
+        fresh_crawl (bool, optional, default False):
+            Whether to start a fresh crawl instead of resuming the
+            interrupted crawl of the same day.
+        reextract_date (str | None, optional, default None):
+            Date (%Y-%m-%d) at which the archived offer pages are
+            parsed again instead of crawling new data. Data of that
+            date is then saved and transformed, replacing the rows of
+            that date in both databases (as if overwrite_source and
+            overwrite_destination were set).
+        time_budget (float | None, optional, default None):
+            Time budget of the crawl in minutes. The most valuable
+            offers are requested first and the remaining ones are
+            deferred at the deadline.
     """
 
-    # Getting the current date
-    current_date = datetime.now().date().strftime("%Y-%m-%d")
+    # Getting the current date (or the date to be re-extracted). Re-extracted
+    # data replaces the data of that date
+    current_date = reextract_date or datetime.now().date().strftime("%Y-%m-%d")
+    if reextract_date != None:
+        overwrite_source = True
+        overwrite_destination = True
 
     if (not parse) and (not transform):
         logger.warning(f"Neither parsing nor transforming is requested")
@@ -54,38 +124,68 @@ def run_etl_pipeline(
         # Checking if it is required to parse new data
         if parse:
 
-            # Extracting raw data
-            df = parser.retrieve(return_data=True, save_data=False)
+            # Extracting raw data and saving it to the source database
+            # batch by batch
+            if parser.config["streaming"]["enabled"] and reextract_date == None:
+                n_rows = 0
+                for batch in parser.retrieve_batches(
+                    save_data=True,
+                    overwrite=overwrite_source,
+                    fresh_crawl=fresh_crawl,
+                    time_budget=time_budget,
+                ):
+                    n_rows += len(batch)
+
+                # Checking if the raw data is empty
+                if n_rows == 0:
+                    logger.warning("There is no raw data parsed")
+                    logger.info("=== ENDING ETL PIPELINE ===")
+                    sys.exit()
 
-            # Checking if the raw data is empty
-            if len(df) == 0:
-                logger.warning("There is no raw data parsed")
-                logger.info("=== ENDING ETL PIPELINE ===")
-                sys.exit()
+                # Reading the saved raw data back if it must be transformed
+                if transform:
+                    df = read_rows_at_date(
+                        table_name=parser.config["main_table_name"],
+                        date=current_date,
+                        is_source_db=True,
+                    )
 
-            # Deleting rows from the main table with the current date
-            if overwrite_source:
-                query = (
-                    f"DELETE FROM {parser.config['main_table_name']} "
-                    + f"WHERE date_parsed='{current_date}';"
-                )
-                _ = execute_sql_query(
-                    query=query,
+            else:
+
+                # Extracting raw data (either crawling it or parsing the
+                # archived offer pages)
+                if reextract_date == None:
+                    df = parser.retrieve(
+                        return_data=True,
+                        save_data=False,
+                        fresh_crawl=fresh_crawl,
+                        time_budget=time_budget,
+                    )
+                else:
+                    df = parser.reextract(date_parsed=reextract_date)
+
+                # Checking if the raw data is empty
+                if len(df) == 0:
+                    logger.warning("There is no raw data parsed")
+                    logger.info("=== ENDING ETL PIPELINE ===")
+                    sys.exit()
+
+                # Deleting rows from the main table with the current date
+                if overwrite_source:
+                    delete_rows_at_date(
+                        table_name=parser.config["main_table_name"],
+                        date=current_date,
+                        is_source_db=True,
+                    )
+
+                # Saving raw data to the source database
+                save_data_to_database(
+                    df=df,
+                    table_name=parser.config["main_table_name"],
                     is_source_db=True,
+                    index=False,
+                    if_exists="append",
                 )
-                logger.info(
-                    f"Rows from {parser.config['main_table_name']} table "
-                    + f"with date_parsed='{current_date}' have been deleted"
-                )
-
-            # Saving raw data to the source database
-            save_data_to_database(
-                df=df,
-                table_name=parser.config["main_table_name"],
-                is_source_db=True,
-                index=False,
-                if_exists="append",
-            )
 
         # Checking if it is required to transform raw data
         if transform:
@@ -93,10 +193,10 @@ def run_etl_pipeline(
             # Checking if it is not required to parse new data
             # In that case the parsed data at the current date is used
             if not parse:
-                df = read_table_from_database(
+                df = read_rows_at_date(
                     table_name=parser.config["main_table_name"],
+                    date=current_date,
                     is_source_db=True,
-                    date="current",
                 )
                 # Checking if the data is empty
                 if len(df) == 0:
@@ -118,18 +218,11 @@ def run_etl_pipeline(
 
             # Deleting rows from the main table with the current date
             if overwrite_destination:
-                query = (
-                    f"DELETE FROM {transformer.config['main_table_name']} "
-                    + f"WHERE date_parsed='{current_date}';"
-                )
-                _ = execute_sql_query(
-                    query=query,
+                delete_rows_at_date(
+                    table_name=transformer.config["main_table_name"],
+                    date=current_date,
                     is_source_db=False,
                 )
-                logger.info(
-                    f"Rows from {transformer.config['main_table_name']} table "
-                    + f"with date_parsed='{current_date}' have been deleted"
-                )
 
             # Saving transformed data to the destination database
             save_data_to_database(
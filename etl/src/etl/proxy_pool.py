@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import random
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from etl import logger
+from etl.transport import HttpTransport
+
+
+class ProxyPool:
+    """
+    Pool of proxies with health scores. For each proxy the success rate
+    and the latency are tracked as exponentially weighted moving averages
+    (EWMA), proxies are picked randomly with weights proportional to
+    their health, and proxies which fail several times in a row are
+    quarantined for a cooldown period. Scores are persisted between runs
+    """
+
+    def __init__(
+        self,
+        config: dict,
+        proxies: list[str],
+        transport: HttpTransport,
+        path: Path,
+    ):
+        """
+        Initializes ProxyPool
+
+        Args:
+            config (dict):
+                Dictionary with the proxy_pool config
+            proxies (list[str]):
+                Candidate proxies
+            transport (HttpTransport):
+                Transport used for the validation requests
+            path (Path):
+                Path to the json file with persisted scores
+
+        Parameters:
+            scores (dict):
+                Health scores of each proxy: success (EWMA of the success
+                rate), latency (EWMA of the latency, s), failures (number
+                of consecutive failures) and quarantined_until (unix time)
+        """
+        self.config = config
+        self.transport = transport
+        self.path = path
+        self.lock = threading.Lock()
+        self.scores = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.scores = json.load(f)
+        self.proxies = [x for x in dict.fromkeys(proxies) if x != ""]
+        for proxy in self.proxies:
+            if proxy not in self.scores:
+                self.scores[proxy] = {
+                    "success": self.config["initial_success"],
+                    "latency": self.config["validation_timeout"],
+                    "failures": 0,
+                    "quarantined_until": 0.0,
+                }
+
+    def report(self, proxy: str, success: bool, latency: float):
+        """
+        Updates health scores of the proxy after a request
+
+        Args:
+            proxy (str):
+                Proxy address
+            success (bool):
+                Whether the request was successful
+            latency (float):
+                Duration of the request, s
+        """
+        alpha = self.config["ewma_alpha"]
+        is_quarantined = False
+        with self.lock:
+            score = self.scores[proxy]
+            score["success"] = (1 - alpha) * score["success"] + alpha * float(success)
+            if success:
+                score["latency"] = (1 - alpha) * score["latency"] + alpha * latency
+                score["failures"] = 0
+            else:
+                score["failures"] += 1
+                if score["failures"] >= self.config["max_consecutive_failures"]:
+                    score["quarantined_until"] = (
+                        time.time() + self.config["quarantine_cooldown"]
+                    )
+                    score["failures"] = 0
+                    is_quarantined = True
+        # Connections of a quarantined proxy are not kept open
+        if is_quarantined:
+            self.transport.evict(proxy=proxy)
+
+    def weight(self, proxy: str) -> float:
+        """Health of the proxy used as it's sampling weight"""
+        score = self.scores[proxy]
+        return score["success"] ** 2 / (score["latency"] + 0.1)
+
+    def choose(self) -> str:
+        """
+        Picks a proxy weighted by health among the ones which are not
+        quarantined. If all proxies are quarantined, the one which is
+        released first is returned
+
+        Returns:
+            str:
+                Proxy address
+        """
+        now = time.time()
+        with self.lock:
+            available = [
+                x for x in self.proxies if self.scores[x]["quarantined_until"] <= now
+            ]
+            if len(available) == 0:
+                return min(
+                    self.proxies, key=lambda x: self.scores[x]["quarantined_until"]
+                )
+            weights = [self.weight(x) for x in available]
+            return random.choices(available, weights=weights)[0]
+
+    def check(self, proxy: str) -> bool:
+        """
+        Checks if the proxy works by requesting the validation url
+
+        Args:
+            proxy (str):
+                Proxy address
+
+        Returns:
+            bool:
+                Whether the proxy works
+        """
+        start = time.monotonic()
+        try:
+            response = self.transport.get(
+                url=self.config["validation_url"],
+                timeout=self.config["validation_timeout"],
+                proxy=proxy,
+            )
+            response.raise_for_status()
+            success = True
+        except Exception:
+            success = False
+        self.report(proxy=proxy, success=success, latency=time.monotonic() - start)
+        return success
+
+    def validate(self) -> list[str]:
+        """
+        Validates all proxies concurrently and keeps only the working ones
+        in the pool (the pool is left unchanged if none of them works)
+
+        Returns:
+            list[str]:
+                Working proxies
+        """
+        with ThreadPoolExecutor(
+            max_workers=self.config["validation_workers"]
+        ) as executor:
+            results = list(executor.map(self.check, self.proxies))
+        valid = [x for x, is_valid in zip(self.proxies, results) if is_valid]
+        logger.info(f"Proxy pool: {len(valid)} of {len(self.proxies)} proxies are valid")
+        if len(valid) > 0:
+            for proxy in self.proxies:
+                if proxy not in valid:
+                    self.transport.evict(proxy=proxy)
+            self.proxies = valid
+        else:
+            logger.warning("Proxy pool: no valid proxies, all candidates are kept")
+        return valid
+
+    def save(self):
+        """
+        Persists health scores of the proxies of the pool (scores of the
+        proxies which are no longer in the pool are dropped)
+        """
+        os.makedirs(self.path.parent, exist_ok=True)
+        with self.lock:
+            self.scores = {x: self.scores[x] for x in self.proxies}
+            with open(self.path, "w") as f:
+                json.dump(self.scores, f)
+        logger.info(f"Proxy pool: scores have been saved at {self.path}")
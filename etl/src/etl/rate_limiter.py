@@ -0,0 +1,225 @@
+import time
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+from etl import logger
+
+
+class TokenBucket:
+    """
+    Token bucket which is refilled at the specified rate. Tokens are
+    reserved in advance, so each caller gets the delay after which it may
+    perform the request
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        Initializes TokenBucket
+
+        Args:
+            rate (float):
+                Refill rate, tokens per second
+            capacity (float):
+                Maximum number of tokens (burst size)
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.adapted_at = self.updated
+
+    def reserve(self) -> float:
+        """
+        Reserves a token
+
+        Returns:
+            float:
+                Delay (s) after which the token is available
+        """
+        now = self.refill()
+        self.tokens -= 1
+        delay = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+        return max(delay, self.blocked_until - now)
+
+    def refill(self) -> float:
+        """Adds the tokens accumulated since the last update"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return now
+
+    def is_available(self) -> bool:
+        """Whether a token may be taken without any delay"""
+        now = self.refill()
+        return self.tokens >= 1 and self.blocked_until <= now
+
+
+class AdaptiveRateLimiter:
+    """
+    Shared rate limiter with a token bucket per host and per (host, proxy).
+    Rates adapt in AIMD fashion: successful requests additively increase
+    the rate up to the ceiling (at most once per increase_interval, so
+    the rate grows per time window rather than per response), while a
+    429, 5xx or a timeout multiplicatively decreases it. Retry-After headers block the bucket
+    for the requested time. The limiter is thread-safe and is used by
+    RealtyYaParser.get, so it applies to all crawl modes
+    """
+
+    def __init__(self, config: dict):
+        """
+        Initializes AdaptiveRateLimiter
+
+        Args:
+            config (dict):
+                Dictionary with the rate_limiter config
+
+        Parameters:
+            buckets (dict):
+                Token buckets by key (host or host|proxy)
+        """
+        self.config = config
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.last_logged = time.monotonic()
+
+    def bucket(self, key: str) -> TokenBucket:
+        """Returns the bucket for the key (creates it if necessary)"""
+        if key not in self.buckets:
+            self.buckets[key] = TokenBucket(
+                rate=self.config["initial_rate"], capacity=self.config["burst"]
+            )
+        return self.buckets[key]
+
+    @staticmethod
+    def keys(url: str, proxy: str | None) -> list[str]:
+        """Keys of the buckets which apply to the request"""
+        host = urlsplit(url).netloc
+        return [host] if proxy == None else [host, f"{host}|{proxy}"]
+
+    def reserve(self, url: str, proxy: str | None = None) -> float:
+        """
+        Reserves a token in each applicable bucket
+
+        Args:
+            url (str):
+                Url to be requested
+            proxy (str | None, default None):
+                Proxy to be used
+
+        Returns:
+            float:
+                Delay (s) before the request may be performed
+        """
+        with self.lock:
+            return max(self.bucket(x).reserve() for x in self.keys(url, proxy))
+
+    def try_acquire(self, url: str, proxy: str | None = None) -> bool:
+        """
+        Takes a token in each applicable bucket only if the request may
+        be performed right away (e.g. for an optional hedged request)
+
+        Args:
+            url (str):
+                Url to be requested
+            proxy (str | None, default None):
+                Proxy to be used
+
+        Returns:
+            bool:
+                Whether the tokens have been taken
+        """
+        with self.lock:
+            buckets = [self.bucket(x) for x in self.keys(url, proxy)]
+            if not all(x.is_available() for x in buckets):
+                return False
+            for bucket in buckets:
+                bucket.tokens -= 1
+            return True
+
+    def acquire(self, url: str, proxy: str | None = None):
+        """Blocks until the request may be performed"""
+        delay = self.reserve(url=url, proxy=proxy)
+        if delay > 0:
+            time.sleep(delay)
+
+    @staticmethod
+    def retry_after(value: str | None) -> float | None:
+        """
+        Parses a Retry-After header
+
+        Args:
+            value (str | None):
+                Value of the header (seconds or a http date)
+
+        Returns:
+            float | None:
+                Number of seconds to wait (None if there is no header)
+        """
+        if value == None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            date = parsedate_to_datetime(value)
+            return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+    def feedback(
+        self,
+        url: str,
+        proxy: str | None = None,
+        status_code: int | None = None,
+        retry_after: str | None = None,
+    ):
+        """
+        Adapts the rates after a request
+
+        Args:
+            url (str):
+                Requested url
+            proxy (str | None, default None):
+                Used proxy
+            status_code (int | None, default None):
+                Status code of the response (None in case of a timeout
+                or a connection error)
+            retry_after (str | None, default None):
+                Value of the Retry-After header
+        """
+        is_throttled = status_code == None or status_code == 429 or status_code >= 500
+        wait = self.retry_after(retry_after)
+        with self.lock:
+            now = time.monotonic()
+            for key in self.keys(url, proxy):
+                bucket = self.bucket(key)
+                if is_throttled:
+                    bucket.rate = max(
+                        self.config["min_rate"],
+                        bucket.rate * self.config["multiplicative_decrease"],
+                    )
+                    bucket.adapted_at = now
+                elif now - bucket.adapted_at >= self.config["increase_interval"]:
+                    bucket.rate = min(
+                        self.config["max_rate"],
+                        bucket.rate + self.config["additive_increase"],
+                    )
+                    bucket.adapted_at = now
+                if wait != None:
+                    bucket.blocked_until = max(
+                        bucket.blocked_until, time.monotonic() + wait
+                    )
+            if time.monotonic() - self.last_logged >= self.config["log_interval"]:
+                self.last_logged = time.monotonic()
+                self.log_rates()
+
+    def log_rates(self):
+        """Logs the effective rate of each host"""
+        rates = ", ".join(
+            f"{k}: {v.rate:.2f} req/s" for k, v in self.buckets.items() if "|" not in k
+        )
+        logger.info(f"Rate limiter: {rates}")
@@ -0,0 +1,195 @@
+import time
+import random
+import requests
+import threading
+from collections import deque
+
+from etl import logger
+
+
+class RetryPolicy:
+    """
+    Retry policy of the requests. Failures are classified into timeouts,
+    connection errors, throttling (429), server errors (5xx) and client
+    errors (4xx). Client errors (except 408) are not retried, while
+    other failures are retried after a jittered exponential backoff
+    which respects the Retry-After header
+    """
+
+    def __init__(self, config: dict):
+        """
+        Initializes RetryPolicy
+
+        Args:
+            config (dict):
+                Dictionary with the retry_policy config
+        """
+        self.config = config
+
+    @staticmethod
+    def classify(status_code: int | None, error: Exception | None = None) -> str:
+        """
+        Classifies the outcome of a request
+
+        Args:
+            status_code (int | None):
+                Status code of the response (None if there is no response)
+            error (Exception | None, default None):
+                Exception raised by the request
+
+        Returns:
+            str:
+                One of 'ok', 'timeout', 'connection', 'throttled', 'server'
+                or 'client'
+        """
+        if status_code == None:
+            if isinstance(error, requests.exceptions.Timeout):
+                return "timeout"
+            return "connection"
+        if status_code == 429:
+            return "throttled"
+        if status_code >= 500:
+            return "server"
+        if status_code >= 400:
+            return "timeout" if status_code == 408 else "client"
+        return "ok"
+
+    def should_retry(self, kind: str) -> bool:
+        """Whether a request with the outcome must be retried"""
+        return kind != "ok" and (kind != "client" or self.config["retry_client_errors"])
+
+    def backoff(self, attempt: int, retry_after: float | None = None) -> float:
+        """
+        Delay before the next attempt: a uniformly jittered exponential
+        backoff ("full jitter"), but not less than Retry-After
+
+        Args:
+            attempt (int):
+                Number of the failed attempt (starting from 0)
+            retry_after (float | None, default None):
+                Delay requested by the server (s)
+
+        Returns:
+            float:
+                Delay (s)
+        """
+        delay = min(self.config["max_delay"], self.config["base_delay"] * 2**attempt)
+        delay = random.uniform(0, delay)
+        if retry_after != None:
+            delay = max(delay, min(retry_after, self.config["max_delay"]))
+        return delay
+
+
+class LatencyTracker:
+    """Rolling window of latencies with percentiles"""
+
+    def __init__(self, size: int):
+        """
+        Initializes LatencyTracker
+
+        Args:
+            size (int):
+                Number of the latest latencies to be kept
+        """
+        self.latencies = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.latencies)
+
+    def add(self, latency: float):
+        """Adds a latency (s)"""
+        with self.lock:
+            self.latencies.append(latency)
+
+    def percentile(self, q: float) -> float | None:
+        """
+        Returns the q-th percentile of the latencies
+
+        Args:
+            q (float):
+                Percentile in [0, 100]
+
+        Returns:
+            float | None:
+                Latency (s). None if there are no latencies
+        """
+        with self.lock:
+            latencies = sorted(self.latencies)
+        if len(latencies) == 0:
+            return None
+        return latencies[min(len(latencies) - 1, int(q / 100 * len(latencies)))]
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker shared by all requests. When the error rate over the
+    latest requests exceeds the threshold, the circuit opens and all
+    requests wait for the cooldown. After the cooldown the circuit is
+    half-open: the first failure opens it again, while a success closes
+    it
+    """
+
+    def __init__(self, config: dict):
+        """
+        Initializes CircuitBreaker
+
+        Args:
+            config (dict):
+                Dictionary with the circuit_breaker config
+
+        Parameters:
+            outcomes (deque):
+                Outcomes (True for an error) of the latest requests
+            opened_until (float):
+                Time until which the circuit is open
+            n_opened (int):
+                Number of times the circuit was opened
+        """
+        self.config = config
+        self.outcomes = deque(maxlen=config["window"])
+        self.opened_until = 0.0
+        self.is_half_open = False
+        self.n_opened = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Blocks while the circuit is open"""
+        delay = self.opened_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def record(self, is_error: bool):
+        """
+        Records the outcome of a request and opens the circuit if required
+
+        Args:
+            is_error (bool):
+                Whether the request failed
+        """
+        with self.lock:
+            # Outcomes of the requests which were in flight when the
+            # circuit was opened are ignored
+            if time.monotonic() < self.opened_until:
+                return
+            if self.is_half_open:
+                self.is_half_open = False
+                if is_error:
+                    self.open()
+                return
+            self.outcomes.append(is_error)
+            if (
+                len(self.outcomes) >= self.config["min_samples"]
+                and sum(self.outcomes) / len(self.outcomes) >= self.config["error_rate"]
+            ):
+                self.open()
+
+    def open(self):
+        """Opens the circuit for the cooldown"""
+        self.opened_until = time.monotonic() + self.config["cooldown"]
+        self.is_half_open = True
+        self.outcomes.clear()
+        self.n_opened += 1
+        logger.warning(
+            f"Circuit breaker is open: the crawl is paused for {self.config['cooldown']} s"
+        )
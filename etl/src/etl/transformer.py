@@ -1,13 +1,38 @@
+"""
+Transformer of the raw data of the source database. With
+transformation.vectorized the flat_type, main_info, fee_info and
+extra_features fields are transformed column-wise, and with
+transformation.parallel large backfills are transformed in chunks of
+rows in a pool of processes. Addresses are located through the
+geocode cache (see geocoding.py) and the addresses table. With
+address_info.join_in_database the distinct addresses of a batch are
+bulk-loaded into a temporary table and joined to the addresses table
+inside the source database, so only unmatched addresses come back for
+geocoding. The indexes the lookups rely on are created on the first
+lookup if the database predates them
+"""
+
+import io
 import re
+import csv
 import sys
-import time
+import json
+import hashlib
 import pandas as pd
-from geopy.geocoders import ArcGIS
+from sqlalchemy import text
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.exc import IntegrityError
+from typing import Any, Callable
+from concurrent.futures import ProcessPoolExecutor
 
-from etl import logger, CONFIG_PATH
+from etl import logger, CONFIG_PATH, STORAGE_PATH
+from etl.geocoding import GeocodingExecutor, GeocodeCache, normalize_address
+from etl.canonicalization import AddressCanonicalizer, CANONICALIZATION_VERSION
 from etl.utils import (
     read_yaml,
     read_table_from_database,
+    read_query_from_database,
+    create_connection_engine,
     save_data_to_database,
     ensure_annotations,
 )
@@ -15,6 +40,18 @@ from etl.utils import (
 
 CONFIG = read_yaml(path=CONFIG_PATH)["transformation"]["features"]
 
+# Geocode cache of the process (see geocode_cache)
+GEOCODE_CACHE = None
+
+# Whether the index of the addresses table has been checked by the process
+# (see prepare_addresses_table)
+IS_ADDRESSES_TABLE_PREPARED = False
+
+ADDRESS_CANONICALIZER = AddressCanonicalizer(
+    config=CONFIG["address_info"]["canonicalization"],
+    address_adjustment=CONFIG["address_info"]["address_adjustment"],
+)
+
 
 @ensure_annotations(False, [None] * len(CONFIG["flat_type"]["features"]))
 def transform_flat_type(raw_content: str) -> list[int | bool | None]:
@@ -75,13 +112,16 @@ def transform_main_info(raw_content: list[str]) -> list[float | int | None]:
 
 
 @ensure_annotations(False, [None] * len(CONFIG["fee_info"]["features"]))
-def transform_fee_info(raw_content: list[str]) -> list[float | int | bool | None]:
+def transform_fee_info(
+    raw_content: list[str | None],
+) -> list[float | int | bool | None]:
     """
     Transforms a single record of the fee_info field into the
-    specified features (see config)
+    specified features (see config). Missing items (e.g. of the
+    records built from the listing cards) give missing features
 
     Args:
-        raw_content (list[str]):
+        raw_content (list[str | None]):
             Record to be transformed
 
     Returns:
@@ -91,142 +131,803 @@ def transform_fee_info(raw_content: list[str]) -> list[float | int | bool | None
     content = [None for _ in range(len(CONFIG["fee_info"]["features"]))]  #
     if raw_content[0] == "есть":
         content[0] = True
-    else:
+    elif raw_content[0] != None:
         content[1] = int("".join(re.findall(r"\d+", raw_content[0])))
         if content[1] == 0:
             content[0] = False  #
-    content[2] = int("".join(re.findall(r"\d+", raw_content[1])))  #
+    if raw_content[1] != None:
+        content[2] = int("".join(re.findall(r"\d+", raw_content[1])))  #
     content[3] = raw_content[2]  #
-    content[4] = int("".join(re.findall(r"\d+", raw_content[3])))
+    if raw_content[3] != None:
+        content[4] = int("".join(re.findall(r"\d+", raw_content[3])))
     return content
 
 
+def to_objects(series: pd.Series) -> pd.Series:
+    """
+    Converts a series to objects where missing values are None, so that
+    the features have the same values and dtypes as the features
+    obtained per observation
+    """
+    series = series.astype(object)
+    return series.where(series.notna(), None)
+
+
+def infer_features(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Infers the dtypes of the features as they are inferred for the lists
+    of features obtained per observation (features without any value
+    stay objects)
+    """
+    features = df.infer_objects()
+    is_missing = df.isna().all()
+    features[df.columns[is_missing]] = df[df.columns[is_missing]]
+    return features
+
+
+def to_features(columns: dict, index: pd.Index) -> pd.DataFrame:
+    """Builds the dataframe of features from the columns of objects"""
+    return infer_features(
+        pd.DataFrame(
+            dict((k, to_objects(v).values) for k, v in columns.items()), index=index
+        )
+    )
+
+
+def is_valid_record(series: pd.Series, allow_none: bool = False) -> pd.Series:
+    """
+    Checks which records are lists of strings. Other records give no
+    features, as they do not pass the annotations of the transforms
+    per observation
+
+    Args:
+        series (pd.Series):
+            Records with a unique index
+        allow_none (bool, default False):
+            Whether None items are valid
+
+    Returns:
+        pd.Series:
+            Whether each record is valid
+    """
+    is_list = series.map(lambda x: isinstance(x, list))
+    items = series[is_list].explode()
+    items = items[(series[is_list].str.len() > 0).reindex(items.index)]
+    is_valid = pd.Series(True, index=series.index).where(is_list, False)
+    if pd.api.types.infer_dtype(items, skipna=allow_none) != "string":
+        is_valid_item = items.map(
+            lambda x: isinstance(x, str) or (allow_none and x == None)
+        )
+        is_valid &= is_valid_item.groupby(level=0).all().reindex(
+            series.index, fill_value=True
+        )
+    return is_valid
+
+
+def map_unique(texts: pd.Series, func: Callable) -> pd.DataFrame:
+    """
+    Applies a vectorized function to the unique texts only and maps the
+    results back to all texts. Raw records repeat a lot (e.g. '3 этаж
+    из 9'), so the function processes a small fraction of the texts
+
+    Args:
+        texts (pd.Series):
+            Texts (missing values give missing results)
+        func (Callable):
+            Function which takes a series of unique texts and returns a
+            dataframe with the results with the same index
+
+    Returns:
+        pd.DataFrame:
+            Results for each text with the index of the texts
+    """
+    codes, uniques = pd.factorize(texts)
+    results = func(pd.Series(uniques, dtype=object))
+    return results.reindex(codes).set_axis(texts.index)
+
+
+def join_numbers(texts: pd.Series, separator: str) -> pd.Series:
+    """Joins all numbers of each text with the separator"""
+    return texts.str.replace(r"\D+", separator, regex=True).str.strip(separator)
+
+
+def parse_flat_type(texts: pd.Series) -> pd.DataFrame:
+    """Parses the features of the unique flat_type records"""
+    n_rooms = texts.str.extract(r"(\d+)\-комн", expand=False).astype("Int64")
+    is_studio = texts.str.contains("студия", regex=False)
+    n_rooms = n_rooms.where(texts.str.count(r"\d+\-комн") == 1)
+    n_rooms = n_rooms.mask(n_rooms.isna() & is_studio, 1)
+    return pd.DataFrame({"n_rooms": n_rooms, "is_studio": is_studio})
+
+
 @ensure_annotations()
-def transform_address_info(df: pd.DataFrame) -> pd.DataFrame:
+def vectorized_transform_flat_type(series: pd.Series) -> pd.DataFrame:
     """
-    Transforms address_info field into the specified features (see
-    config)
+    Vectorized transform_flat_type: transforms all records of the
+    flat_type field at once
 
     Args:
-        df (pd.DataFrame):
-            Dataframe with the raw data for the address_info field
+        series (pd.Series):
+            Records to be transformed
 
     Returns:
         pd.DataFrame:
-            Dataframe with the obtained features for the address_info
-            field
+            Obtained features with the index of the records
     """
+    texts = series.where(series.map(lambda x: isinstance(x, str)))
+    content = map_unique(texts=texts, func=parse_flat_type)
+    features = CONFIG["flat_type"]["features"]
+    columns = [content["n_rooms"], content["is_studio"]]
+    return to_features(dict(zip(features, columns)), index=series.index)
 
-    # Initialisation of the geolocator
-    geolocator_arcgis = ArcGIS()
 
-    @ensure_annotations(False, [None, None])
-    def coords(address: str) -> list[float | None]:
-        """
-        Decodes an address in order to obtain it's location:
-        latitude and longitude
+def parse_main_info(texts: pd.Series) -> pd.DataFrame:
+    """
+    Parses the unique texts of the main_info records: the kind of each
+    text (the first keyword found in the same order as in
+    transform_main_info) and it's values
+    """
+    kind = pd.Series(None, index=texts.index, dtype=object)
+    for keyword in ["год", "потолки", "этаж", "общая"]:
+        kind = kind.mask(texts.str.contains(keyword, regex=False), keyword)
+    numbers = join_numbers(texts, ".")
+    number = texts.str.extract(r"(\d+)", expand=False)
+    second_number = texts.str.extract(r"\d+\D+(\d+)", expand=False)
+    is_float = kind.isin(["общая", "потолки"])
+    is_floor = kind == "этаж"
+    return pd.DataFrame(
+        {
+            "kind": kind.astype("category"),
+            "float": numbers.where(is_float).astype(float),
+            "int": number.where(kind.isin(["этаж", "год"])).astype("Int64"),
+            "total_floors": second_number.where(
+                is_floor & (texts.str.count(r"\d+") == 2)
+            ).astype("Int64"),
+        }
+    )
 
-        Args:
-            address (str): Address
 
-        Returns:
-            list[float | None]:
-                Obtained location (filled with None if it was
-                not possible to locate the address)
-        """
-        # Getting coordinates for the address
-        try:
-            location = geolocator_arcgis.geocode(address)
-        except:
-            logger.warning(f"Unable to initially locate address '{address}'")
-        time.sleep(0.1)
-        # Checking if the address was not found
-        if location == None:
-            # Trying to apply existing adjustments to the address if it was not found
-            for k, v in CONFIG["address_info"]["address_adjustment"].items():
-                if k in address:
-                    try:
-                        location = geolocator_arcgis.geocode(f"{v}{address}")
-                        break
-                    except:
-                        time.sleep(0.1)
-
-            # Setting the location to Nones if it was not found after adjustments
-            if location == None:
-                logger.warning(
-                    f"Unable to locate address '{address}' after adjustments"
-                )
-                location = [None, None]
-            # Getting coordinates from the location
-            else:
-                location = location.point[:2]
-        # Getting coordinates from the location
-        else:
-            location = location.point[:2]
-        return location
+@ensure_annotations()
+def vectorized_transform_main_info(series: pd.Series) -> pd.DataFrame:
+    """
+    Vectorized transform_main_info: transforms all records of the
+    main_info field at once. The last text of a record which matches a
+    keyword gives the feature, as it does when transformed per
+    observation
 
-    # Reading existing data with addresses
-    df_a = read_table_from_database(
-        table_name="addresses", is_source_db=True
-    )  # .drop('id', axis=1)
+    Args:
+        series (pd.Series):
+            Records to be transformed
 
-    # Joining
-    df = df.merge(df_a, how="left", on="address_info")
+    Returns:
+        pd.DataFrame:
+            Obtained features with the index of the records
+    """
+    records = series.reset_index(drop=True)
+    texts = records[is_valid_record(records)].explode().dropna()
+    content = map_unique(texts=texts, func=parse_main_info)
 
-    # Checking if any new addresses exist in the data
-    if len(df[df["latitude"].isnull() & df["address_info"].notnull()]) > 0:
+    def last(values: pd.Series) -> pd.Series:
+        values = values.dropna()
+        values = values[~values.index.duplicated(keep="last")]
+        return values.reindex(records.index)
 
-        # Getting new addresses
-        df_a2 = df[df["latitude"].isnull() & df["address_info"].notnull()][
-            ["address_info"]
-        ].drop_duplicates()
+    kind = content["kind"]
+    columns = {
+        "area": last(content["float"][kind == "общая"]),
+        "floor": last(content["int"][kind == "этаж"]),
+        "total_floors": last(content["total_floors"]),
+        "height": last(content["float"][kind == "потолки"]),
+        "construction_year": last(content["int"][kind == "год"]),
+    }
+    features = CONFIG["main_info"]["features"]
+    return to_features(dict((k, columns[k]) for k in features), index=series.index)
 
-        # Getting coordinates for new addresses
-        df_a2[["latitude", "longitude"]] = pd.DataFrame(
-            df_a2["address_info"].map(coords).tolist(), index=df_a2.index
-        )
 
-        # Dropping data with not searchable coordinates
-        df_a2 = df_a2.dropna(subset="latitude", axis=0)
+def parse_fee(texts: pd.Series) -> pd.DataFrame:
+    """Parses the unique items of the fee_info records into integers"""
+    return pd.DataFrame({"value": join_numbers(texts, "").astype("Int64")})
 
-        # New address_ids for new addresses
-        df_a2["address_id"] = [len(df_a) + 1 + x for x in range(len(df_a2))]
 
-        # Saving new address data to the addresses table
+@ensure_annotations()
+def vectorized_transform_fee_info(series: pd.Series) -> pd.DataFrame:
+    """
+    Vectorized transform_fee_info: transforms all records of the
+    fee_info field at once
+
+    Args:
+        series (pd.Series):
+            Records to be transformed
+
+    Returns:
+        pd.DataFrame:
+            Obtained features with the index of the records
+    """
+    records = series.reset_index(drop=True)
+    is_valid = is_valid_record(records, allow_none=True)
+    items = pd.DataFrame(records[is_valid].tolist(), index=records.index[is_valid])
+    items = items.reindex(index=records.index, columns=range(4))
+
+    def to_int(texts: pd.Series) -> pd.Series:
+        return map_unique(texts=texts, func=parse_fee)["value"]
+
+    has_pledge = items[0] == "есть"
+    pledge = to_int(items[0].where(~has_pledge))
+    columns = [
+        has_pledge.where(has_pledge, None).mask((pledge == 0).fillna(False), False),
+        pledge,
+        to_int(items[1]),
+        items[2],
+        to_int(items[3]),
+    ]
+    features = CONFIG["fee_info"]["features"]
+    return to_features(dict(zip(features, columns)), index=series.index)
+
+
+@ensure_annotations()
+def address_key(address: str) -> str:
+    """
+    Key which is shared by all spellings of an address: the canonical
+    key if canonicalization is enabled, otherwise the normalized address
+    """
+    if CONFIG["address_info"]["canonicalization"]["enabled"]:
+        return ADDRESS_CANONICALIZER.canonicalize(address=address)
+    return normalize_address(address=address)
+
+
+@ensure_annotations()
+def select_new_addresses(addresses: list[str], df_a: pd.DataFrame) -> list[str]:
+    """
+    Selects the addresses whose key does not match any of the known
+    addresses. Only the first spelling of each key is selected, so all
+    spellings share a single geocode result
+
+    Args:
+        addresses (list[str]):
+            Distinct addresses
+        df_a (pd.DataFrame):
+            Dataframe with the known addresses (address_info column)
+
+    Returns:
+        list[str]:
+            New addresses
+    """
+    known_keys = set(df_a["address_info"].map(address_key))
+    new_addresses = {}
+    for address in addresses:
+        key = address_key(address=address)
+        if key not in known_keys and key not in new_addresses:
+            new_addresses[key] = address
+    return list(new_addresses.values())
+
+
+@ensure_annotations()
+def share_by_key(addresses: list[str], df_a: pd.DataFrame) -> pd.DataFrame:
+    """
+    Assigns each address the located address with the same key (the
+    one with the smallest address_id if there are several)
+
+    Args:
+        addresses (list[str]):
+            Distinct addresses
+        df_a (pd.DataFrame):
+            Dataframe with the address_id, address_info, latitude and
+            longitude of the located addresses
+
+    Returns:
+        pd.DataFrame:
+            Dataframe with the address_id, address_info, latitude and
+            longitude of each address with a located key
+    """
+    df_k = pd.DataFrame(
+        {
+            "address_info": addresses,
+            "key": [address_key(address=x) for x in addresses],
+        }
+    )
+    df_a = (
+        df_a.assign(key=df_a["address_info"].map(address_key))
+        .sort_values("address_id", kind="stable")
+        .drop_duplicates("key")
+    )
+    return df_k.merge(
+        df_a[["key", "address_id", "latitude", "longitude"]], how="inner", on="key"
+    )[["address_id", "address_info", "latitude", "longitude"]]
+
+
+@ensure_annotations()
+def geocode_new_addresses(addresses: list[str], next_address_id: int) -> pd.DataFrame:
+    """
+    Geocodes new addresses and saves the located ones to the addresses
+    table
+
+    Args:
+        addresses (list[str]):
+            New addresses
+        next_address_id (int):
+            address_id of the first located address
+
+    Returns:
+        pd.DataFrame:
+            Dataframe with the address_info, latitude, longitude and
+            address_id of each address (None for the addresses which
+            could not be located)
+    """
+    # Getting coordinates for new addresses
+    df_a = pd.DataFrame({"address_info": addresses})
+    executor = GeocodingExecutor(
+        config=CONFIG["address_info"]["geocoding"],
+        address_adjustment=CONFIG["address_info"]["address_adjustment"],
+    )
+    df_a[["latitude", "longitude"]] = pd.DataFrame(
+        executor.locate(addresses=addresses), index=df_a.index
+    )
+
+    if CONFIG["address_info"]["canonicalization"]["enabled"]:
+        df_a["address_key"] = df_a["address_info"].map(address_key)
+        df_a["address_key_version"] = address_key_version()
+
+    # New address_ids for the located addresses
+    is_located = df_a["latitude"].notnull()
+    df_a["address_id"] = (is_located.cumsum() + next_address_id - 1).where(is_located)
+
+    # Saving new address data to the addresses table
+    if is_located.any():
         save_data_to_database(
-            df=df_a2,
-            table_name="addresses",
+            df=df_a[is_located].astype({"address_id": int}),
+            table_name=CONFIG["address_info"]["table_name"],
             if_exists="append",
             index=False,
             is_source_db=True,
         )
+    return df_a
+
+
+@ensure_annotations()
+def create_address_index(engine: Engine, table_name: str, column: str):
+    """
+    Creates the unique index of the column in the addresses table if it
+    is missing. A non-unique index is created if the column already has
+    duplicated values
+
+    Args:
+        engine (Engine):
+            Connection engine of the source database
+        table_name (str):
+            Name of the addresses table
+        column (str):
+            Column to be indexed
+    """
+    index = f"CREATE INDEX IF NOT EXISTS {table_name}_{column}_idx "
+    index += f"ON {table_name} ({column})"
+    try:
+        with engine.begin() as connection:
+            connection.execute(text(index.replace("INDEX", "UNIQUE INDEX", 1)))
+    except IntegrityError as e:
+        logger.warning(
+            f"Unable to create the unique index of {column} in {table_name}: "
+            + "duplicated values, a non-unique index is created instead. "
+            + f"Error: {e.orig}"
+        )
+        with engine.begin() as connection:
+            connection.execute(text(index))
+
+
+@ensure_annotations()
+def address_key_version() -> str:
+    """
+    Version of the address keys: a hash of the canonicalization config,
+    the address_adjustment prefixes and the version of the
+    canonicalization code (see CANONICALIZATION_VERSION)
+    """
+    config = {
+        "canonicalization": CONFIG["address_info"]["canonicalization"],
+        "address_adjustment": CONFIG["address_info"]["address_adjustment"],
+        "code": CANONICALIZATION_VERSION,
+    }
+    config = json.dumps(config, sort_keys=True, ensure_ascii=False)
+    return hashlib.md5(config.encode("utf-8")).hexdigest()
+
+
+@ensure_annotations()
+def prepare_address_keys(engine: Engine, table_name: str):
+    """
+    Adds the address_key and address_key_version columns to the
+    addresses table if they are missing and rebuilds the keys of the
+    addresses whose keys were built by another version (see
+    address_key_version), so the keys follow the canonicalization
+    config. The index of address_key is non-unique: the spellings which
+    were geocoded before canonicalization (or before a change of it's
+    config) share a key
+
+    Args:
+        engine (Engine):
+            Connection engine of the source database
+        table_name (str):
+            Name of the addresses table
+    """
+    version = address_key_version()
+    index_name = f"{table_name}_address_key_idx"
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                f"ALTER TABLE {table_name} "
+                + "ADD COLUMN IF NOT EXISTS address_key VARCHAR(100), "
+                + "ADD COLUMN IF NOT EXISTS address_key_version VARCHAR(32)"
+            )
+        )
+        is_unique = connection.execute(
+            text(
+                "SELECT indisunique FROM pg_index "
+                + "WHERE indexrelid = to_regclass(:name)"
+            ),
+            {"name": index_name},
+        ).scalar()
+        if is_unique:
+            connection.execute(text(f"DROP INDEX {index_name}"))
+        connection.execute(
+            text(
+                f"CREATE INDEX IF NOT EXISTS {index_name} "
+                + f"ON {table_name} (address_key)"
+            )
+        )
+        df_a = pd.read_sql_query(
+            sql=text(
+                f"SELECT address_id, address_info FROM {table_name} "
+                + "WHERE address_info IS NOT NULL "
+                + "AND address_key_version IS DISTINCT FROM :version"
+            ),
+            con=connection,
+            params={"version": version},
+        )
+        if len(df_a) > 0:
+            connection.execute(
+                text(
+                    f"UPDATE {table_name} SET address_key = :address_key, "
+                    + "address_key_version = :version WHERE address_id = :address_id"
+                ),
+                [
+                    {
+                        "address_id": int(x),
+                        "address_key": address_key(address=y),
+                        "version": version,
+                    }
+                    for x, y in zip(df_a["address_id"], df_a["address_info"])
+                ],
+            )
+            logger.info(f"Address keys have been rebuilt for {len(df_a)} addresses")
+
+
+@ensure_annotations()
+def prepare_addresses_table():
+    """
+    Migrates the addresses table of the databases created before the
+    indexes and the address_key column were added to init.sql: creates
+    the index of address_info and, if canonicalization is enabled,
+    prepares the address keys (see prepare_address_keys). The table is
+    prepared once per process
+    """
+    global IS_ADDRESSES_TABLE_PREPARED
+    if IS_ADDRESSES_TABLE_PREPARED:
+        return
+    table_name = CONFIG["address_info"]["table_name"]
+    engine = create_connection_engine(is_source_db=True)
+    with engine.begin() as connection:
+        is_created = connection.execute(
+            text("SELECT to_regclass(:table_name) IS NOT NULL"),
+            {"table_name": table_name},
+        ).scalar()
+    if not is_created:
+        # The table is created by the first save of the located addresses
+        return
+    create_address_index(engine=engine, table_name=table_name, column="address_info")
+    if CONFIG["address_info"]["canonicalization"]["enabled"]:
+        prepare_address_keys(engine=engine, table_name=table_name)
+    IS_ADDRESSES_TABLE_PREPARED = True
+
+
+@ensure_annotations()
+def lookup_values(addresses: list[str]) -> tuple[str, list[str]]:
+    """
+    Column of the addresses table by which the addresses are looked up
+    and the distinct values to be matched: the canonical keys if
+    canonicalization is enabled (so any stored spelling of an address is
+    matched), otherwise the addresses themselves
+    """
+    if CONFIG["address_info"]["canonicalization"]["enabled"]:
+        return "address_key", sorted(set([address_key(x) for x in addresses]))
+    return "address_info", sorted(set(addresses))
+
+
+@ensure_annotations()
+def join_addresses_in_database(addresses: list[str]) -> pd.DataFrame:
+    """
+    Joins the addresses to the addresses table inside the source
+    database: the lookup values of the addresses (see lookup_values)
+    are bulk-loaded into a temporary table with COPY and joined on the
+    index of the lookup column
+
+    Args:
+        addresses (list[str]):
+            Distinct addresses
+
+    Returns:
+        pd.DataFrame:
+            Rows of the addresses table which match the addresses
+    """
+    table_name = CONFIG["address_info"]["table_name"]
+    column, values = lookup_values(addresses=addresses)
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([[x] for x in values])
+    buffer.seek(0)
+    engine = create_connection_engine(is_source_db=True)
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TEMP TABLE batch_addresses (value TEXT PRIMARY KEY) "
+                + "ON COMMIT DROP"
+            )
+        )
+        with connection.connection.cursor() as cursor:
+            cursor.copy_expert(
+                "COPY batch_addresses (value) FROM STDIN WITH (FORMAT csv)", buffer
+            )
+        df_a = pd.read_sql_query(
+            sql=text(
+                f"SELECT a.* FROM {table_name} a "
+                + f"JOIN batch_addresses b ON a.{column} = b.value"
+            ),
+            con=connection,
+        )
+    logger.info(
+        f"Addresses have been joined in the source database: {len(df_a)} rows "
+        + f"for {len(values)} values of {column} of {len(addresses)} addresses"
+    )
+    return df_a
+
+
+@ensure_annotations()
+def read_addresses(addresses: list[str]) -> pd.DataFrame:
+    """
+    Reads the rows of the addresses table which match the addresses (see
+    lookup_values), with a join in the source database if
+    join_in_database is enabled
+
+    Args:
+        addresses (list[str]):
+            Distinct addresses
+
+    Returns:
+        pd.DataFrame:
+            Rows of the addresses table which match the addresses
+    """
+    if len(addresses) == 0:
+        return pd.DataFrame(
+            columns=["address_id", "address_info", "latitude", "longitude"]
+        )
+    prepare_addresses_table()
+    if CONFIG["address_info"]["join_in_database"]:
+        return join_addresses_in_database(addresses=addresses)
+    column, values = lookup_values(addresses=addresses)
+    return read_query_from_database(
+        query=f"SELECT * FROM {CONFIG['address_info']['table_name']} "
+        + f"WHERE {column} = ANY(:values)",
+        is_source_db=True,
+        params={"values": values},
+    )
+
+
+@ensure_annotations()
+def next_address_id() -> int:
+    """address_id which follows the ids of the addresses table"""
+    return int(
+        read_query_from_database(
+            query="SELECT COALESCE(MAX(address_id), 0) + 1 AS address_id "
+            + f"FROM {CONFIG['address_info']['table_name']}",
+            is_source_db=True,
+        )["address_id"][0]
+    )
+
+
+@ensure_annotations()
+def locate_addresses(addresses: list[str]) -> pd.DataFrame:
+    """
+    Locates the addresses using the whole addresses table (or a join in
+    the source database if join_in_database is enabled). New addresses
+    are geocoded
+
+    Args:
+        addresses (list[str]):
+            Distinct addresses
+
+    Returns:
+        pd.DataFrame:
+            Dataframe with the address_id, address_info, latitude and
+            longitude of each located address
+    """
+    # Reading existing data with addresses
+    prepare_addresses_table()
+    if CONFIG["address_info"]["join_in_database"]:
+        df_a = read_addresses(addresses=addresses)
+    else:
+        df_a = read_table_from_database(
+            table_name=CONFIG["address_info"]["table_name"], is_source_db=True
+        )
+
+    # Checking if any new addresses exist in the data
+    new_addresses = select_new_addresses(addresses=addresses, df_a=df_a)
+    if len(new_addresses) == 0:
+        return df_a
+    df_a2 = geocode_new_addresses(
+        addresses=new_addresses,
+        next_address_id=(
+            next_address_id()
+            if CONFIG["address_info"]["join_in_database"]
+            else len(df_a) + 1
+        ),
+    )
+    df_a2 = df_a2.dropna(subset="latitude", axis=0)
+    return df_a if len(df_a2) == 0 else pd.concat([df_a, df_a2])
 
-        # Joining new addresses to the main dataframe
-        df.loc[
-            df["latitude"].isnull() & df["address_info"].notnull(),
-            ["address_id", "latitude", "longitude"],
-        ] = (
-            df.loc[
-                df["latitude"].isnull() & df["address_info"].notnull(), ["address_info"]
-            ]
-            .merge(df_a2, how="left", on="address_info")[
-                ["address_id", "latitude", "longitude"]
-            ]
-            .values
+
+@ensure_annotations()
+def geocode_cache() -> GeocodeCache:
+    """Geocode cache shared by the transforms of the process"""
+    global GEOCODE_CACHE
+    if GEOCODE_CACHE == None:
+        GEOCODE_CACHE = GeocodeCache(
+            config=CONFIG["address_info"]["cache"],
+            path=STORAGE_PATH / "geocode_cache",
+            key_func=address_key,
         )
+    return GEOCODE_CACHE
+
+
+@ensure_annotations()
+def locate_addresses_cached(addresses: list[str]) -> pd.DataFrame:
+    """
+    Locates the addresses using the geocode cache. Only the cache misses
+    are read from the addresses table, and only the addresses which are
+    not in the table are geocoded
+
+    Args:
+        addresses (list[str]):
+            Distinct addresses
+
+    Returns:
+        pd.DataFrame:
+            Dataframe with the address_id, address_info, latitude and
+            longitude of each located address
+    """
+    cache = geocode_cache()
+    rows, misses = [], []
+    for address in addresses:
+        entry = cache.get(address=address)
+        if entry == None:
+            misses.append(address)
+        elif entry["address_id"] != None:
+            rows.append(
+                [entry["address_id"], address, entry["latitude"], entry["longitude"]]
+            )
+    df_a = pd.DataFrame(
+        rows, columns=["address_id", "address_info", "latitude", "longitude"]
+    )
+
+    if len(misses) > 0:
+        # Reading only the missed addresses from the addresses table
+        df_a2 = read_addresses(addresses=misses)
+        for row in df_a2.itertuples():
+            cache.put(
+                address=row.address_info,
+                address_id=int(row.address_id),
+                latitude=row.latitude,
+                longitude=row.longitude,
+            )
+
+        # Geocoding the addresses which are not in the table
+        new_addresses = select_new_addresses(addresses=misses, df_a=df_a2)
+        if len(new_addresses) > 0:
+            df_a3 = geocode_new_addresses(
+                addresses=new_addresses, next_address_id=next_address_id()
+            )
+            for row in df_a3.itertuples():
+                if pd.isnull(row.latitude):
+                    cache.put(address=row.address_info, address_id=None)
+                else:
+                    cache.put(
+                        address=row.address_info,
+                        address_id=int(row.address_id),
+                        latitude=row.latitude,
+                        longitude=row.longitude,
+                    )
+            df_a3 = df_a3.dropna(subset="latitude", axis=0)
+            if len(df_a3) > 0:
+                df_a2 = df_a3 if len(df_a2) == 0 else pd.concat([df_a2, df_a3])
+        if len(df_a2) > 0:
+            df_a = df_a2 if len(df_a) == 0 else pd.concat([df_a, df_a2])
+
+    cache.commit()
+    cache.log_stats()
+    return df_a
+
+
+@ensure_annotations()
+def transform_address_info(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Transforms address_info field into the specified features (see
+    config)
+
+    Args:
+        df (pd.DataFrame):
+            Dataframe with the raw data for the address_info field
 
+    Returns:
+        pd.DataFrame:
+            Dataframe with the obtained features for the address_info
+            field
+    """
+    # Getting distinct addresses (sorted, so the address_ids of new
+    # addresses do not depend on the order in which the offers were crawled)
+    addresses = df["address_info"].dropna().drop_duplicates().sort_values().tolist()
+
+    if CONFIG["address_info"]["cache"]["enabled"]:
+        df_a = locate_addresses_cached(addresses=addresses)
+    else:
+        df_a = locate_addresses(addresses=addresses)
+
+    # Joining (spellings of an address share it's location)
+    df_a = share_by_key(addresses=addresses, df_a=df_a)
+    df = df.merge(df_a, how="left", on="address_info")
     df = df.drop("address_info", axis=1)
 
     return df
 
 
+def compile_extra_features(config: dict) -> dict[str, list[tuple[int, Any]]]:
+    """
+    Compiles the extra_features config into an inverted index
+
+    Args:
+        config (dict):
+            Dictionary with the features of the extra_features field
+
+    Returns:
+        dict[str, list[tuple[int, Any]]]:
+            Position of the feature and it's value for each raw phrase.
+            A phrase of several features (e.g. 'Балкон и лоджия') has
+            them in the order of the features
+    """
+    index = {}
+    for position, subconfig in enumerate(config.values()):
+        for phrase, value in subconfig["values"].items():
+            index.setdefault(phrase, []).append((position, value))
+    return index
+
+
+EXTRA_FEATURES_INDEX = compile_extra_features(CONFIG["extra_features"]["features"])
+EXTRA_FEATURES_TABLE = pd.DataFrame(
+    [
+        (phrase, position, value)
+        for phrase, match in EXTRA_FEATURES_INDEX.items()
+        for position, value in match
+    ],
+    columns=["phrase", "position", "value"],
+)
+EXTRA_FEATURES_DEFAULTS = [
+    v["default"] for v in CONFIG["extra_features"]["features"].values()
+]
+
+
 @ensure_annotations(False, [None] * len(CONFIG["extra_features"]["features"]))
 def transform_extra_features(
     raw_content: list[str],
 ) -> list[bool | int | float | str | None]:
     """
     Transforms a single record of the extra_features field into
-    the specified features (see config)
+    the specified features (see config). Each feature (in the order of
+    the features) takes the first unused phrase of the record (in the
+    order of the set of phrases) which is one of it's values. Phrases
+    are resolved with the inverted index of the config
 
     Args:
         raw_content (list[str]):
@@ -236,20 +937,154 @@ def transform_extra_features(
         list[bool | int | float | str | None]:
             List of obtained features
     """
-    content = dict(
-        [(k, v["default"]) for (k, v) in CONFIG["extra_features"]["features"].items()]
-    )
-    raw_content = set(raw_content)
-    for field, subconfig in CONFIG["extra_features"]["features"].items():
-        for item in raw_content:
-            if item in subconfig["values"]:
-                content[field] = subconfig["values"][item]
-                raw_content.remove(item)
+    content = list(EXTRA_FEATURES_DEFAULTS)
+    candidates = {}
+    for item in set(raw_content):
+        for position, value in EXTRA_FEATURES_INDEX.get(item, []):
+            candidates.setdefault(position, []).append((item, value))
+    used = set()
+    for position in sorted(candidates):
+        for item, value in candidates[position]:
+            if item not in used:
+                content[position] = value
+                used.add(item)
                 break
-    content = list(content.values())
     return content
 
 
+@ensure_annotations()
+def vectorized_transform_extra_features(series: pd.Series) -> pd.DataFrame:
+    """
+    Vectorized transform_extra_features: transforms all records of the
+    extra_features field at once. The phrases of each record are matched
+    against the inverted index and each feature takes it's first
+    matched phrase. A phrase of several features (e.g. 'Балкон и
+    лоджия') is taken by the first of them which matches it, so the
+    features of such phrases are resolved one by one in their order
+
+    Args:
+        series (pd.Series):
+            Records to be transformed
+
+    Returns:
+        pd.DataFrame:
+            Obtained features with the index of the records
+    """
+    records = series.reset_index(drop=True)
+    is_valid = is_valid_record(records)
+
+    # Exploding the sets of phrases, so that the phrases of each record
+    # are in the same order as in transform_extra_features
+    items = records[is_valid].map(lambda x: list(set(x))).explode().dropna()
+    matches = pd.DataFrame({"record": items.index, "phrase": items.values})
+    matches = matches.merge(EXTRA_FEATURES_TABLE, how="inner", on="phrase")
+
+    # Excluding the phrases which were taken by the previous features
+    codes, phrases = pd.factorize(matches["phrase"])
+    keys = pd.Series(matches["record"].values * len(phrases) + codes)
+    is_taken = pd.Series(False, index=matches.index)
+    shared = [x for x in EXTRA_FEATURES_INDEX.values() if len(x) > 1]
+    for position in sorted(set(x for match in shared for x, _ in match)):
+        is_current = matches["position"] == position
+        taken = keys[is_current & ~is_taken].groupby(matches["record"]).first()
+        is_taken |= keys.isin(taken.values) & ~is_current
+    matches = matches[~is_taken]
+    matches = matches.drop_duplicates(subset=["record", "position"], keep="first")
+
+    features = list(CONFIG["extra_features"]["features"].keys())
+    content = pd.DataFrame(
+        dict(
+            (feature, pd.Series(default, index=records.index, dtype=object))
+            for feature, default in zip(features, EXTRA_FEATURES_DEFAULTS)
+        )
+    )
+    for position, group in matches.groupby("position"):
+        content.iloc[group["record"].values, position] = group["value"].values
+    content[~is_valid] = None
+    return infer_features(content.set_axis(series.index))
+
+
+def feature_names(config: dict) -> list[str]:
+    """Names of the features obtained from a field (see config)"""
+    if type(config["features"]) == dict:
+        return list(config["features"].keys())
+    return config["features"]
+
+
+def transform_feature(
+    df: pd.DataFrame, feature: str, config: dict, vectorized: bool = False
+) -> pd.DataFrame:
+    """
+    Transforms a single field of the raw data into the specified
+    features (see config)
+
+    Args:
+        df (pd.DataFrame):
+            Raw data (modified in place unless the field is processed
+            as a whole)
+        feature (str):
+            Name of the field
+        config (dict):
+            Dictionary with the config of the field
+        vectorized (bool, default False):
+            Whether to use the vectorized transform of the field (if
+            it exists)
+
+    Returns:
+        pd.DataFrame:
+            Data with the field replaced by it's features
+    """
+    features = feature_names(config)
+
+    # Checking if the feature has a vectorized transform
+    if vectorized and "vectorized_transform_func" in config:
+        df[features] = getattr(
+            sys.modules[__name__], config["vectorized_transform_func"]
+        )(series=df[feature])
+        df.drop(feature, axis=1, inplace=True)
+
+    # Checking if the feature should be processed separately
+    elif config["process_per_observation"]:
+        df[features] = pd.DataFrame(
+            df[feature]
+            .apply(
+                lambda x: getattr(sys.modules[__name__], config["transform_func"])(
+                    raw_content=x
+                )
+            )
+            .tolist(),
+            index=df.index,
+        )
+        df.drop(feature, axis=1, inplace=True)
+
+    # Feature should be processed as a whole
+    else:
+        df = getattr(sys.modules[__name__], config["transform_func"])(df=df)
+    return df
+
+
+def transform_chunk(df: pd.DataFrame, configs: dict, vectorized: bool) -> pd.DataFrame:
+    """
+    Transforms the fields of a chunk of the raw data which are processed
+    per observation. Runs in a worker process of the parallel transform
+
+    Args:
+        df (pd.DataFrame):
+            Chunk of the raw data
+        configs (dict):
+            Dictionary with the config of each field to be transformed
+        vectorized (bool):
+            Whether to use the vectorized transforms
+
+    Returns:
+        pd.DataFrame:
+            Transformed chunk
+    """
+    for feature, config in configs.items():
+        df = transform_feature(df=df, feature=feature, config=config, vectorized=vectorized)
+    return df
+
+
 class RealtyYaTransformer:
     """
     Class with the implementation of the custom data transformer for the
@@ -288,39 +1123,31 @@ class RealtyYaTransformer:
 
         logger.info("STARTING TRANSFORMING STAGE")
 
-        # Transforming each column separately
-        for feature, config in self.config["features"].items():
+        # Transforming the data in chunks in parallel if required
+        if self.config["parallel"]["enabled"]:
+            df = self.transform_in_parallel(df=df)
 
-            try:
-                # Checking if the feature should be processed separately
-                if config["process_per_observation"]:
-                    if type(config["features"]) == dict:
-                        features = list(config["features"].keys())
-                    else:
-                        features = config["features"]
-                    df[features] = pd.DataFrame(
-                        df[feature]
-                        .apply(
-                            lambda x: getattr(
-                                sys.modules[__name__], config["transform_func"]
-                            )(raw_content=x)
-                        )
-                        .tolist(),
-                        index=df.index,
+        # Transforming each column separately
+        else:
+            for feature, config in self.config["features"].items():
+                try:
+                    df = transform_feature(
+                        df=df,
+                        feature=feature,
+                        config=config,
+                        vectorized=self.config["vectorized"],
                     )
-                    df.drop(feature, axis=1, inplace=True)
+                    logger.info(f"Feature {feature} has been transformed")
 
-                # Feature should be processed as a whole
-                else:
-                    df = getattr(sys.modules[__name__], config["transform_func"])(df=df)
-                logger.info(f"Feature {feature} has been transformed")
+                except Exception as e:
+                    logger.info(
+                        f"An exception occured while transforming feature "
+                        + f"{feature}. Error: {e}"
+                    )
+                    raise e
 
-            except Exception as e:
-                logger.info(
-                    f"An exception occured while transforming feature "
-                    + f"{feature}. Error: {e}"
-                )
-                raise e
+        # Ordering the columns as in the main table of the destination database
+        df = df[self.columns()]
 
         # Saving transformed data to the destination database
         if save_data:
@@ -337,3 +1164,81 @@ class RealtyYaTransformer:
         # Returning transformed data if required
         if return_data:
             return df
+
+    def columns(self) -> list[str]:
+        """
+        Columns of the transformed data in the order of the main table
+        of the destination database
+
+        Returns:
+            list[str]:
+                Leading columns followed by the features of each field
+        """
+        columns = list(self.config["leading_columns"])
+        for config in self.config["features"].values():
+            columns += [x for x in feature_names(config) if x not in columns]
+        return columns
+
+    def transform_in_parallel(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Transforms raw data in chunks of rows in a pool of processes. The
+        fields which are processed as a whole (e.g. address_info) are
+        transformed once on their unique values, which are then joined
+        back to the rows
+
+        Args:
+            df (pd.DataFrame):
+                Raw data
+
+        Returns:
+            pd.DataFrame:
+                Transformed data in the original order of the rows
+        """
+        cfg = self.config["parallel"]
+        configs = dict(
+            (k, v)
+            for k, v in self.config["features"].items()
+            if v["process_per_observation"]
+            or (self.config["vectorized"] and "vectorized_transform_func" in v)
+        )
+        chunks = [
+            df.iloc[i : i + cfg["chunk_size"]].copy()
+            for i in range(0, len(df), cfg["chunk_size"])
+        ]
+        logger.info(
+            f"Transforming {len(df)} rows in {len(chunks)} chunks with "
+            + f"{cfg['workers']} workers"
+        )
+        with ProcessPoolExecutor(max_workers=cfg["workers"]) as executor:
+            chunks = list(
+                executor.map(
+                    transform_chunk,
+                    chunks,
+                    [configs] * len(chunks),
+                    [self.config["vectorized"]] * len(chunks),
+                )
+            )
+        df = infer_features(pd.concat(chunks)) if len(chunks) > 0 else df
+        logger.info(f"Features {list(configs)} have been transformed")
+
+        # Transforming the fields which are processed as a whole once on
+        # their unique values
+        for feature, config in self.config["features"].items():
+            if feature in configs:
+                continue
+            values = df[[feature]].drop_duplicates(ignore_index=True)
+            features = transform_feature(
+                df=values.copy(), feature=feature, config=config
+            )
+            if len(features) != len(values):
+                raise ValueError(
+                    f"Transform of feature {feature} must keep the rows of the "
+                    + "unique values"
+                )
+            features[feature] = values[feature].values
+            df = df.merge(features, how="left", on=feature).drop(feature, axis=1)
+            logger.info(
+                f"Feature {feature} has been transformed for {len(values)} "
+                + "unique values"
+            )
+        return df
@@ -0,0 +1,226 @@
+import threading
+import requests
+from typing import Callable
+from requests.adapters import HTTPAdapter
+
+from etl import logger
+
+
+try:
+    import brotli
+
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+
+class CountingAdapter(HTTPAdapter):
+    """
+    HTTPAdapter which passes the connection pools discarded by it's pool
+    managers (evicted or cleared) to the specified function
+    """
+
+    def __init__(self, dispose_pool: Callable, **kwargs):
+        """
+        Initializes CountingAdapter
+
+        Args:
+            dispose_pool (Callable):
+                Function which is called with each discarded pool
+            **kwargs:
+                Arguments of HTTPAdapter
+        """
+        self.dispose_pool = dispose_pool
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pools.dispose_func = self.dispose_pool
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        is_new = proxy not in self.proxy_manager
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        if is_new:
+            manager.pools.dispose_func = self.dispose_pool
+        return manager
+
+
+class HttpTransport:
+    """
+    Long-lived HTTP transport with keep-alive connection pooling. A
+    separate session (and hence a separate connection pool) is kept for
+    each proxy, so connections are reused between requests through the
+    same proxy (until the proxy is evicted from the pool). Also collects the number of established connections
+    (handshakes) and the number of bytes received over the wire
+    """
+
+    def __init__(self, config: dict):
+        """
+        Initializes HttpTransport
+
+        Args:
+            config (dict):
+                Dictionary with the transport config
+
+        Parameters:
+            sessions (dict):
+                Sessions for each proxy (key None is used for direct
+                requests)
+            bytes_on_wire (int):
+                Number of bytes received over the wire (possibly
+                compressed)
+            bytes_decoded (int):
+                Number of bytes of the decoded content
+            n_requests (int):
+                Number of performed requests
+            n_closed_connections (int):
+                Number of connections established by the pools which
+                have been discarded
+        """
+        self.config = config
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.bytes_on_wire = 0
+        self.bytes_decoded = 0
+        self.n_requests = 0
+        self.n_closed_connections = 0
+
+        # Advertising brotli only if responses can be decoded
+        encodings = [x.strip() for x in self.config["accept_encoding"].split(",")]
+        if "br" in encodings and not BROTLI_AVAILABLE:
+            logger.warning(
+                "brotli package is not installed, 'br' is removed from "
+                + "the accepted encodings"
+            )
+            encodings.remove("br")
+        self.accept_encoding = ", ".join(encodings)
+
+    def session(self, proxy: str | None = None) -> requests.Session:
+        """
+        Returns the session for the specified proxy (creates it if
+        it does not exist yet)
+
+        Args:
+            proxy (str | None, default None):
+                Proxy address
+
+        Returns:
+            requests.Session:
+                Session with the pooled adapters
+        """
+        with self.lock:
+            if proxy not in self.sessions:
+                session = requests.Session()
+                adapter = CountingAdapter(
+                    dispose_pool=self.dispose_pool,
+                    pool_connections=self.config["pool_connections"],
+                    pool_maxsize=self.config["pool_maxsize"],
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers["accept-encoding"] = self.accept_encoding
+                if proxy != None:
+                    session.proxies = {"http": proxy, "https": proxy}
+                self.sessions[proxy] = session
+            return self.sessions[proxy]
+
+    def evict(self, proxy: str | None):
+        """
+        Closes the session of the proxy (if it exists), so the connections
+        of a proxy which is no longer used are not kept open. A new
+        session is created if the proxy is requested again
+
+        Args:
+            proxy (str | None):
+                Proxy address
+        """
+        with self.lock:
+            session = self.sessions.pop(proxy, None)
+        if session != None:
+            session.close()
+
+    def get(
+        self,
+        url: str,
+        timeout: float,
+        headers: dict | None = None,
+        proxy: str | None = None,
+    ) -> requests.models.Response:
+        """
+        Performs a GET request using a pooled connection
+
+        Args:
+            url (str):
+                Url to be requested
+            timeout (float):
+                Timeout of the request
+            headers (dict | None, default None):
+                Headers of the request
+            proxy (str | None, default None):
+                Proxy address
+
+        Returns:
+            requests.models.Response:
+                Response from the url
+        """
+        response = self.session(proxy=proxy).get(
+            url=url, timeout=timeout, headers=headers
+        )
+        with self.lock:
+            self.n_requests += 1
+            self.bytes_on_wire += response.raw.tell()
+            self.bytes_decoded += len(response.content)
+        return response
+
+    def dispose_pool(self, pool):
+        """Counts the connections of a discarded pool and closes it"""
+        with self.lock:
+            self.n_closed_connections += pool.num_connections
+        pool.close()
+
+    @property
+    def handshakes(self) -> int:
+        """Number of connections established by all pools"""
+        with self.lock:
+            n_connections = self.n_closed_connections
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            for adapter in set(session.adapters.values()):
+                managers = [adapter.poolmanager, *adapter.proxy_manager.values()]
+                for manager in managers:
+                    for key in manager.pools.keys():
+                        n_connections += manager.pools[key].num_connections
+        return n_connections
+
+    def stats(self) -> dict:
+        """
+        Returns statistics of the transport
+
+        Returns:
+            dict:
+                Number of requests, handshakes and received bytes
+        """
+        return {
+            "requests": self.n_requests,
+            "handshakes": self.handshakes,
+            "bytes_on_wire": self.bytes_on_wire,
+            "bytes_decoded": self.bytes_decoded,
+        }
+
+    def log_stats(self):
+        """Logs statistics of the transport"""
+        stats = self.stats()
+        logger.info(
+            f"Transport: {stats['requests']} requests, "
+            + f"{stats['handshakes']} handshakes, "
+            + f"{stats['bytes_on_wire']} bytes on the wire "
+            + f"({stats['bytes_decoded']} bytes decoded)"
+        )
+
+    def close(self):
+        """Closes all sessions and their connection pools"""
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions = {}
+        for session in sessions:
+            session.close()
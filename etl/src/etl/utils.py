@@ -463,6 +463,43 @@ def read_table_from_database(
     return df
 
 
+@ensure_annotations()
+def read_query_from_database(
+    query: str, is_source_db: bool = False, params: dict | None = None
+) -> pd.DataFrame:
+    """
+    Reads the result of a select query from either source or
+    destination database
+
+    Args:
+        query (str):
+            Select query to be executed
+        is_source_db (bool, default False):
+            Whether to query the source database
+        params (dict | None, default None):
+            Values of the bound parameters (e.g. :offer_ids) of the query
+
+    Returns:
+        pd.DataFrame:
+            Result of the query
+    """
+    # Creating a connection engine
+    engine = create_connection_engine(is_source_db=is_source_db)
+
+    # Reading data from a database
+    try:
+        df = pd.read_sql_query(sql=text(query), con=engine, params=params)
+    except Exception as e:
+        logger.info(
+            f"An exception occured while executing a select query on the "
+            + f'{"source" if is_source_db else "destination"} database. Error: {e}'
+        )
+        raise e
+
+    # Returning data as a Pandas DataFrame
+    return df
+
+
 @ensure_annotations()
 def save_data_to_database(
     df: pd.DataFrame,
@@ -0,0 +1,425 @@
+import os
+import time
+import socket
+from datetime import datetime
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+
+from etl import logger
+from etl.utils import create_connection_engine
+
+
+def insert_ignoring_duplicates(table, conn, keys: list[str], data_iter):
+    """
+    Insert method for pd.DataFrame.to_sql which skips rows violating the
+    primary key, so that an offer saved by two workers (e.g. after an
+    expired lease) is saved only once
+
+    Args:
+        table (pandas.io.sql.SQLTable):
+            Table to be inserted into
+        conn (sqlalchemy.engine.Connection):
+            Connection to the database
+        keys (list[str]):
+            Column names
+        data_iter (Iterable):
+            Rows to be inserted
+    """
+    rows = [dict(zip(keys, row)) for row in data_iter]
+    if len(rows) == 0:
+        return 0
+    query = insert(table.table).values(rows).on_conflict_do_nothing()
+    return conn.execute(query).rowcount
+
+
+class WorkQueue:
+    """
+    Work-queue of the distributed crawl stored in the crawl_tasks table
+    of the source database. Tasks are listing pages and offer urls of a
+    single date_parsed. Workers claim tasks with SELECT ... FOR UPDATE
+    SKIP LOCKED, so any number of worker processes or hosts claim
+    disjoint tasks without blocking each other. A claimed task is leased
+    for lease_duration seconds: tasks of a dead worker become claimable
+    again once their lease expires, unless they have reached
+    max_attempts, in which case they are marked as failed
+    """
+
+    def __init__(self, config: dict, date_parsed: str | None = None):
+        """
+        Initializes WorkQueue
+
+        Args:
+            config (dict):
+                Dictionary with the distributed config
+            date_parsed (str | None, default None):
+                Date of the crawl in the format %Y-%m-%d (the current
+                date if None)
+        """
+        self.config = config
+        self.table_name = config["table_name"]
+        self.date_parsed = date_parsed or datetime.now().date().strftime("%Y-%m-%d")
+        self.engine = create_connection_engine(is_source_db=True)
+        self.prepare_table()
+
+    def prepare_table(self):
+        """
+        Creates the table of the queue and the index used to claim tasks
+        if they are missing (the databases created before the table was
+        added to init.sql)
+        """
+        with self.engine.begin() as connection:
+            connection.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS {self.table_name} ("
+                    + "task_id BIGSERIAL PRIMARY KEY, date_parsed DATE, "
+                    + "kind VARCHAR(10), url VARCHAR(200), "
+                    + "status VARCHAR(10) DEFAULT 'pending', worker_id VARCHAR(100), "
+                    + "lease_expires_at TIMESTAMP WITH TIME ZONE, "
+                    + "attempts INTEGER DEFAULT 0, UNIQUE (date_parsed, kind, url))"
+                )
+            )
+            connection.execute(
+                text(
+                    f"CREATE INDEX IF NOT EXISTS {self.table_name}_claim_idx "
+                    + f"ON {self.table_name} (date_parsed, status)"
+                )
+            )
+
+    def seed(self, kind: str, urls: list[str]) -> int:
+        """
+        Adds tasks to the queue. Tasks which are already in the queue are
+        ignored
+
+        Args:
+            kind (str):
+                Kind of the tasks ('listing' or 'offer')
+            urls (list[str]):
+                Urls of the tasks
+
+        Returns:
+            int:
+                Number of added tasks
+        """
+        if len(urls) == 0:
+            return 0
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                text(
+                    f"INSERT INTO {self.table_name} (date_parsed, kind, url) "
+                    + "VALUES (:date_parsed, :kind, :url) "
+                    + "ON CONFLICT (date_parsed, kind, url) DO NOTHING"
+                ),
+                [
+                    {"date_parsed": self.date_parsed, "kind": kind, "url": url}
+                    for url in urls
+                ],
+            )
+        return result.rowcount
+
+    def claim(self, worker_id: str, limit: int) -> list[tuple[int, str, str]]:
+        """
+        Claims pending tasks and tasks with an expired lease. Listing
+        tasks are claimed first, so that offer tasks are discovered as
+        early as possible. Tasks whose lease has expired after their
+        last attempt are marked as failed
+
+        Args:
+            worker_id (str):
+                Id of the worker
+            limit (int):
+                Maximum number of tasks to be claimed
+
+        Returns:
+            list[tuple[int, str, str]]:
+                Id, kind and url of each claimed task
+        """
+        with self.engine.begin() as connection:
+            connection.execute(
+                text(
+                    f"UPDATE {self.table_name} SET status='failed', "
+                    + "lease_expires_at=NULL "
+                    + "WHERE date_parsed=:date_parsed AND status='leased' "
+                    + "AND lease_expires_at < NOW() AND attempts >= :max_attempts"
+                ),
+                {
+                    "date_parsed": self.date_parsed,
+                    "max_attempts": self.config["max_attempts"],
+                },
+            )
+            rows = connection.execute(
+                text(
+                    f"UPDATE {self.table_name} SET status='leased', "
+                    + "worker_id=:worker_id, attempts=attempts+1, "
+                    + "lease_expires_at=NOW() + make_interval(secs => :lease) "
+                    + "WHERE task_id IN ("
+                    + f"SELECT task_id FROM {self.table_name} "
+                    + "WHERE date_parsed=:date_parsed AND attempts < :max_attempts "
+                    + "AND (status='pending' OR "
+                    + "(status='leased' AND lease_expires_at < NOW())) "
+                    + "ORDER BY kind='offer', task_id LIMIT :limit "
+                    + "FOR UPDATE SKIP LOCKED) "
+                    + "RETURNING task_id, kind, url"
+                ),
+                {
+                    "worker_id": worker_id,
+                    "lease": self.config["lease_duration"],
+                    "date_parsed": self.date_parsed,
+                    "max_attempts": self.config["max_attempts"],
+                    "limit": limit,
+                },
+            ).fetchall()
+        return sorted((row[0], row[1], row[2]) for row in rows)
+
+    def resolve(self, task_id: int, worker_id: str, success: bool):
+        """
+        Completes a task or returns it to the queue. A task whose lease
+        was taken over by another worker is left untouched
+
+        Args:
+            task_id (int):
+                Id of the task
+            worker_id (str):
+                Id of the worker which claimed the task
+            success (bool):
+                Whether the task was completed
+        """
+        status = "'done'"
+        if not success:
+            status = "CASE WHEN attempts < :max_attempts THEN 'pending' ELSE 'failed' END"
+        with self.engine.begin() as connection:
+            connection.execute(
+                text(
+                    f"UPDATE {self.table_name} SET status={status}, "
+                    + "lease_expires_at=NULL "
+                    + "WHERE task_id=:task_id AND worker_id=:worker_id "
+                    + "AND status='leased'"
+                ),
+                {
+                    "task_id": task_id,
+                    "worker_id": worker_id,
+                    "max_attempts": self.config["max_attempts"],
+                },
+            )
+
+    def active_workers(self, worker_id: str) -> int:
+        """
+        Number of workers which hold unexpired leases. The worker itself
+        is always counted, so that it's share is not overestimated before
+        it has claimed any tasks
+
+        Args:
+            worker_id (str):
+                Id of the worker
+
+        Returns:
+            int:
+                Number of active workers
+        """
+        with self.engine.connect() as connection:
+            n_workers = connection.execute(
+                text(
+                    f"SELECT COUNT(DISTINCT worker_id) FROM {self.table_name} "
+                    + "WHERE date_parsed=:date_parsed AND status='leased' "
+                    + "AND lease_expires_at > NOW() AND worker_id <> :worker_id"
+                ),
+                {"date_parsed": self.date_parsed, "worker_id": worker_id},
+            ).scalar()
+        return n_workers + 1
+
+    def stats(self) -> dict:
+        """Number of tasks of the current date by kind and status"""
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                text(
+                    f"SELECT kind, status, COUNT(*) FROM {self.table_name} "
+                    + "WHERE date_parsed=:date_parsed GROUP BY kind, status"
+                ),
+                {"date_parsed": self.date_parsed},
+            ).fetchall()
+        return dict((f"{kind}_{status}", n) for kind, status, n in rows)
+
+    def is_drained(self) -> bool:
+        """Whether there are no claimable or actively leased tasks left"""
+        with self.engine.connect() as connection:
+            n_tasks = connection.execute(
+                text(
+                    f"SELECT COUNT(*) FROM {self.table_name} "
+                    + "WHERE date_parsed=:date_parsed AND ("
+                    + "(status='pending' AND attempts < :max_attempts) OR "
+                    + "(status='leased' AND (lease_expires_at > NOW() "
+                    + "OR attempts < :max_attempts)))"
+                ),
+                {
+                    "date_parsed": self.date_parsed,
+                    "max_attempts": self.config["max_attempts"],
+                },
+            ).scalar()
+        return n_tasks == 0
+
+
+class CrawlCoordinator:
+    """
+    Coordinator of the distributed crawl. The coordinator requests the
+    first listing page, discovers the number of pages and seeds the
+    queue with a listing task per page. Offer tasks are seeded by the
+    workers from the listing pages they process
+    """
+
+    def __init__(self, parser, queue: WorkQueue):
+        """
+        Initializes CrawlCoordinator
+
+        Args:
+            parser (RealtyYaParser):
+                Parser which performs requests
+            queue (WorkQueue):
+                Work-queue of the crawl
+        """
+        self.parser = parser
+        self.queue = queue
+
+    def seed(self) -> int:
+        """
+        Seeds the queue with the listing pages
+
+        Returns:
+            int:
+                Number of added listing tasks
+        """
+        cfg = self.parser.config["pagination"]
+        n_pages = self.parser.config["number_of_pages"]
+        if cfg["extend_beyond_limit"]:
+            n_pages = cfg["hard_cap"]
+        if cfg["discover"]:
+            response = self.parser.get(url=f"{self.parser.config['url']}?page=0")
+            n_discovered = self.parser.discover_number_of_pages(response=response)
+            if n_discovered != None:
+                n_pages = min(n_discovered, n_pages)
+                logger.info(f"Number of discovered pages: {n_discovered}")
+        n_added = self.queue.seed(
+            kind="listing",
+            urls=[f"{self.parser.config['url']}?page={page}" for page in range(n_pages)],
+        )
+        logger.info(f"Work-queue has been seeded with {n_added} listing tasks")
+        return n_added
+
+
+class CrawlWorker:
+    """
+    Worker of the distributed crawl. The worker claims batches of tasks
+    from the queue: listing tasks add offer tasks to the queue, while
+    offer tasks are parsed and saved to the main table of the source
+    database. The site-wide rate ceiling is shared among the active
+    workers, so the total request rate stays bounded regardless of the
+    number of workers
+    """
+
+    def __init__(self, parser, queue: WorkQueue, worker_id: str | None = None):
+        """
+        Initializes CrawlWorker
+
+        Args:
+            parser (RealtyYaParser):
+                Parser which performs requests and parses responses
+            queue (WorkQueue):
+                Work-queue of the crawl
+            worker_id (str | None, default None):
+                Id of the worker (hostname and pid if None)
+
+        Parameters:
+            counters (dict):
+                Number of completed and failed tasks by kind
+        """
+        self.parser = parser
+        self.queue = queue
+        self.config = queue.config
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.counters = {"listing": 0, "offer": 0, "failed": 0}
+
+    def share_rate_ceiling(self):
+        """Limits the worker's request rate by it's share of the ceiling"""
+        n_workers = self.queue.active_workers(worker_id=self.worker_id)
+        max_rate = self.config["site_rate_ceiling"] / n_workers
+        limiter = self.parser.rate_limiter
+        with limiter.lock:
+            limiter.config["max_rate"] = max_rate
+            for bucket in limiter.buckets.values():
+                bucket.rate = min(bucket.rate, max_rate)
+
+    def process_listing(self, url: str) -> bool:
+        """Requests a listing page and adds it's offers to the queue"""
+        response = self.parser.get(url=url)
+        if response == None:
+            return False
+        self.parser.seen_offers = set()
+        offers = self.parser.get_offers_to_fetch(response=response) or []
+        self.queue.seed(
+            kind="offer",
+            urls=[f"{self.parser.config['offers_url']}{offer}" for offer in offers],
+        )
+        return True
+
+    def process_offers(self, urls: list[str]) -> list[bool]:
+        """Requests and parses the offers and saves their content"""
+        content, success = [], []
+        for url in urls:
+            content_ = self.parser.parse(response=self.parser.get(url=url))
+            success.append(content_ != None)
+            if content_ == None:
+                logger.info(f"URL = {url} : unable to parse content")
+            else:
+                content.append(content_ + [url.split("/")[-2]])
+        if len(content) > 0:
+            df = self.parser.to_frame(content=content)
+            df["date_parsed"] = self.queue.date_parsed
+            df.to_sql(
+                name=self.parser.config["main_table_name"],
+                con=self.queue.engine,
+                if_exists="append",
+                index=False,
+                method=insert_ignoring_duplicates,
+            )
+        return success
+
+    def run(self):
+        """
+        Processes tasks until the queue is drained. The worker waits for
+        new tasks while other workers still hold leases, since their
+        listing tasks may add offer tasks or be returned to the queue
+        """
+        logger.info(f"Crawl worker {self.worker_id} has been started")
+        while True:
+            self.share_rate_ceiling()
+            tasks = self.queue.claim(
+                worker_id=self.worker_id, limit=self.config["claim_size"]
+            )
+            if len(tasks) == 0:
+                if self.queue.is_drained():
+                    break
+                time.sleep(self.config["poll_interval"])
+                continue
+
+            # Processing listing tasks one by one and offer tasks as a batch
+            offers = [(task_id, url) for task_id, kind, url in tasks if kind == "offer"]
+            results = [
+                (task_id, "listing", self.process_listing(url=url))
+                for task_id, kind, url in tasks
+                if kind == "listing"
+            ]
+            if len(offers) > 0:
+                success = self.process_offers(urls=[url for _, url in offers])
+                results += [
+                    (task_id, "offer", x) for (task_id, _), x in zip(offers, success)
+                ]
+            for task_id, kind, success in results:
+                self.queue.resolve(
+                    task_id=task_id, worker_id=self.worker_id, success=success
+                )
+                self.counters[kind if success else "failed"] += 1
+        logger.info(
+            f"Crawl worker {self.worker_id} has finished: {self.counters}, "
+            + f"queue: {self.queue.stats()}"
+        )
+        self.parser.transport.log_stats()
+        self.parser.close()
+        self.parser.rate_limiter.log_rates()
@@ -0,0 +1,1025 @@
+import time
+import unittest
+import tempfile
+import requests
+import threading
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from bs4 import BeautifulSoup
+from pathlib import Path
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from etl.parser import RealtyYaParser, scrape_proxies
+from etl.proxy_pool import ProxyPool
+from etl.rate_limiter import AdaptiveRateLimiter
+from etl.work_queue import WorkQueue, CrawlWorker
+from etl.cache import ResponseCache
+from etl.archive import HtmlArchive
+from etl.extractors import get_extractor, BaseExtractor
+from etl.transport import HttpTransport
+from etl.incremental import OfferIndex, offer_fingerprint
+from etl.utils import (
+    create_connection_engine,
+    execute_sql_query,
+    read_query_from_database,
+    read_table_from_database,
+)
+from etl.transformer import transform_main_info, transform_fee_info
+
+
+def make_response(url: str, html: str) -> requests.models.Response:
+    """Builds a response with the specified html content"""
+    response = requests.models.Response()
+    response.status_code = 200
+    response.url = url
+    response.encoding = "utf-8"
+    response._content = html.encode("utf-8")
+    return response
+
+
+def listing_html(page: int, n_offers: int) -> str:
+    """Builds a listing page with links to the offers"""
+    link = (
+        '<a class="Link Link_js_inited Link_size_m Link_theme_islands '
+        + 'SerpItemLink OffersSerpItem__link OffersSerpItem__titleLink" '
+        + 'href="/offer/{}/">offer</a>'
+    )
+    return "".join(link.format(page * 100 + i) for i in range(n_offers))
+
+
+def listing_cards_html(page: int, n_offers: int) -> str:
+    """Builds a listing page with cards of the offers"""
+    card = (
+        '<li class="OffersSerpItem">'
+        + '<a class="Link Link_js_inited Link_size_m Link_theme_islands '
+        + 'SerpItemLink OffersSerpItem__link OffersSerpItem__titleLink" '
+        + 'href="/offer/{0}/">45,5 м², 2-комнатная квартира</a>'
+        + '<div class="OffersSerpItem__building">3 этаж из 9</div>'
+        + '<div class="OffersSerpItem__address">Невский проспект, 1</div>'
+        + '<span class="OffersSerpItem__price">{0} ₽ в месяц</span></li>'
+    )
+    return "".join(card.format(page * 100 + i) for i in range(n_offers))
+
+
+def offer_html(offer_id: int) -> str:
+    """Builds an offer page with all parsing fields"""
+    return (
+        f'<h1 class="OfferCardSummaryInfo__description--3-iC7">'
+        + f"{offer_id % 3 + 1}-комнатная квартира</h1>"
+        + '<div class="OfferCardHighlight__container--2gZn2">45 м²общая</div>'
+        + '<div class="OfferCardHighlight__container--2gZn2">3 этаж из 9</div>'
+        + '<span class="OfferCardCheck__rowValue--bcPJA">есть</span>'
+        + '<span class="OfferCardCheck__rowValue--bcPJA">нет</span>'
+        + '<span class="OfferCardCheck__rowValue--bcPJA">включены</span>'
+        + f'<span class="OfferCardCheck__rowValue--bcPJA">{offer_id} ₽</span>'
+        + '<div class="AddressWithGeoLinks__addressContainer--4jzfZ '
+        + 'GeoLinks__addressGeoLinks--3UPum">Санкт-Петербург, Невский проспект, 1'
+        + "</div>"
+        + '<div class="OfferCardFeature__text--_Hmzv">Балкон</div>'
+        + '<div class="OfferCardFeature__text--_Hmzv">Лифт</div>'
+    )
+
+
+def read_fixture(name: str) -> str:
+    """Reads a saved page from the fixtures directory"""
+    with open(Path(__file__).parent / "fixtures" / name, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def fake_get(self, url: str) -> requests.models.Response:
+    """Serves listing and offer pages without any network requests"""
+    if "?page=" in url:
+        page = int(url.split("?page=")[-1])
+        return make_response(url, listing_html(page, n_offers=3 if page < 2 else 0))
+    return make_response(url, offer_html(int(url.split("/")[-2])))
+
+
+def source_db_available() -> bool:
+    """Whether the source database can be connected to"""
+    try:
+        with create_connection_engine(is_source_db=True).connect():
+            return True
+    except Exception:
+        return False
+
+
+class LocalHandler(BaseHTTPRequestHandler):
+    """Serves a small page over keep-alive connections"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"<html></html>"
+        self.send_response(200)
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHttpTransport(unittest.TestCase):
+
+    def test_handshakes_of_evicted_pools_are_counted(self):
+        """Test that the connections of discarded pools stay in the count"""
+        server = ThreadingHTTPServer(("127.0.0.1", 0), LocalHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        port = server.server_address[1]
+        transport = HttpTransport(
+            config={"pool_connections": 1, "pool_maxsize": 1, "accept_encoding": "gzip"}
+        )
+        try:
+            for host in ["127.0.0.1", "localhost", "127.0.0.1", "127.0.0.1"]:
+                transport.get(url=f"http://{host}:{port}/", timeout=5.0)
+            self.assertEqual(transport.handshakes, 3)
+            transport.close()
+            self.assertEqual(transport.sessions, {})
+            self.assertEqual(transport.stats()["handshakes"], 3)
+            self.assertEqual(transport.stats()["requests"], 4)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = RealtyYaParser()
+        self.parser.config["hedging"]["enabled"] = False
+        self.parser.rate_limiter.config["initial_rate"] = 1000.0
+        self.parser.rate_limiter.config["min_rate"] = 1000.0
+
+    def test_store_revalidate_and_expire(self):
+        """Test that fresh entries are reused and stale ones are revalidated"""
+        clock = {"now": 1000.0}
+        server = {"etag": '"v1"', "body": "<html>v1</html>"}
+        sent_headers = []
+
+        def fake_transport_get(url, timeout, headers=None, proxy=None):
+            sent_headers.append(headers)
+            if headers.get("if-none-match") == server["etag"]:
+                response = make_response(url, "")
+                response.status_code = 304
+            else:
+                response = make_response(url, server["body"])
+            response.headers["etag"] = server["etag"]
+            return response
+
+        url = f"{self.parser.config['offers_url']}/offer/1/"
+        ttl = self.parser.config["cache"]["ttl"]["offer"]
+        with (
+            tempfile.TemporaryDirectory() as path,
+            patch("etl.cache.time.time", lambda: clock["now"]),
+            patch.object(self.parser.transport, "get", fake_transport_get),
+        ):
+            self.parser.cache = ResponseCache(
+                config=self.parser.config["cache"], path=Path(path)
+            )
+
+            # Storing the response and reusing it while it is fresh
+            self.assertEqual(self.parser.get(url=url).text, "<html>v1</html>")
+            clock["now"] += ttl - 1
+            response = self.parser.get(url=url)
+            self.assertEqual(response.text, "<html>v1</html>")
+            self.assertTrue(response.from_cache)
+            self.assertEqual(len(sent_headers), 1)
+            self.assertNotIn("if-none-match", sent_headers[0])
+
+            # Revalidating the expired entry: 304 reuses the stored body
+            # and refreshes the entry
+            clock["now"] += 2
+            response = self.parser.get(url=url)
+            self.assertEqual(response.text, "<html>v1</html>")
+            self.assertEqual(sent_headers[-1]["if-none-match"], '"v1"')
+            clock["now"] += ttl - 1
+            self.parser.get(url=url)
+            self.assertEqual(len(sent_headers), 2)
+
+            # Replacing the expired entry when the page has changed
+            server.update({"etag": '"v2"', "body": "<html>v2</html>"})
+            clock["now"] += ttl + 1
+            self.assertEqual(self.parser.get(url=url).text, "<html>v2</html>")
+            self.assertEqual(sent_headers[-1]["if-none-match"], '"v1"')
+            self.assertEqual(self.parser.get(url=url).text, "<html>v2</html>")
+            self.assertEqual(len(sent_headers), 3)
+            self.assertEqual(
+                self.parser.cache.stats, {"hits": 3, "revalidated": 1, "misses": 2}
+            )
+
+
+def proxy_list_html(proxies: list[str]) -> str:
+    """Builds a page of the free proxy list with the proxies"""
+    rows = []
+    for proxy in proxies:
+        host, port = proxy.split(":")
+        cells = [host, port, "RU", "Russia", "anonymous", "no", "yes", "1 min ago"]
+        rows.append("<tr>" + "".join(f"<td>{x}</td>" for x in cells) + "</tr>")
+    return "<table>" + "".join(rows) + "</table>"
+
+
+class TestProxyPool(unittest.TestCase):
+
+    def setUp(self):
+        self.config = {
+            "validation_url": "https://realty.ya.ru/",
+            "validation_timeout": 5.0,
+            "validation_workers": 4,
+            "initial_success": 0.5,
+            "ewma_alpha": 0.2,
+            "max_consecutive_failures": 3,
+            "quarantine_cooldown": 600,
+        }
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name) / "proxy_scores.json"
+        self.transport = HttpTransport(
+            config={"pool_connections": 1, "pool_maxsize": 1, "accept_encoding": "gzip"}
+        )
+        self.working = set()
+
+    def tearDown(self):
+        self.transport.close()
+        self.directory.cleanup()
+
+    def fake_transport_get(self, url, timeout, headers=None, proxy=None):
+        """Serves the proxy list and the validation requests"""
+        if proxy == None:
+            return make_response(url, proxy_list_html(["1.1.1.1:80", "2.2.2.2:80"]))
+        if proxy not in self.working:
+            raise requests.exceptions.ProxyError(proxy)
+        return make_response(url, "<html></html>")
+
+    def test_scores_and_quarantine(self):
+        """Test that the health scores follow the EWMA and quarantine rules"""
+        pool = ProxyPool(
+            config=self.config,
+            proxies=["a:1", "b:2", "a:1", ""],
+            transport=self.transport,
+            path=self.path,
+        )
+        self.assertEqual(pool.proxies, ["a:1", "b:2"])
+        pool.report(proxy="a:1", success=True, latency=1.0)
+        self.assertAlmostEqual(pool.scores["a:1"]["success"], 0.6)
+        self.assertAlmostEqual(pool.scores["a:1"]["latency"], 4.2)
+        self.assertGreater(pool.weight("a:1"), pool.weight("b:2"))
+
+        # Consecutive failures quarantine the proxy, a success resets them
+        with patch("etl.proxy_pool.time.time", lambda: 1000.0):
+            for success in [False, False, True, False, False]:
+                pool.report(proxy="b:2", success=success, latency=5.0)
+            self.assertEqual(pool.scores["b:2"]["failures"], 2)
+            self.assertEqual(pool.scores["b:2"]["quarantined_until"], 0.0)
+            pool.report(proxy="b:2", success=False, latency=5.0)
+            self.assertEqual(pool.scores["b:2"]["failures"], 0)
+            self.assertEqual(pool.scores["b:2"]["quarantined_until"], 1600.0)
+            self.assertEqual(set(pool.choose() for _ in range(50)), {"a:1"})
+
+        # The proxy released first is used if all are quarantined
+        with patch("etl.proxy_pool.time.time", lambda: 1100.0):
+            for _ in range(3):
+                pool.report(proxy="a:1", success=False, latency=5.0)
+            self.assertEqual(pool.choose(), "b:2")
+        with patch("etl.proxy_pool.time.time", lambda: 1700.0):
+            self.assertEqual(set(pool.choose() for _ in range(50)), {"a:1", "b:2"})
+
+        # Scores are persisted between runs
+        pool.save()
+        pool = ProxyPool(
+            config=self.config, proxies=["c:3"], transport=self.transport, path=self.path
+        )
+        self.assertEqual(pool.scores["b:2"]["quarantined_until"], 1600.0)
+        self.assertEqual(pool.scores["c:3"]["success"], 0.5)
+
+        # Scores of the proxies which are no longer in the pool are dropped
+        pool.save()
+        pool = ProxyPool(
+            config=self.config, proxies=[], transport=self.transport, path=self.path
+        )
+        self.assertEqual(list(pool.scores), ["c:3"])
+
+    def test_dropped_proxies_are_evicted_from_transport(self):
+        """Test that the sessions of dropped and quarantined proxies are closed"""
+        pool = ProxyPool(
+            config=self.config,
+            proxies=["1.1.1.1:80", "2.2.2.2:80"],
+            transport=self.transport,
+            path=self.path,
+        )
+        for proxy in pool.proxies:
+            self.transport.session(proxy=proxy)
+        self.working.add("2.2.2.2:80")
+        with patch.object(self.transport, "get", self.fake_transport_get):
+            pool.validate()
+        self.assertEqual(list(self.transport.sessions), ["2.2.2.2:80"])
+        for _ in range(self.config["max_consecutive_failures"]):
+            pool.report(proxy="2.2.2.2:80", success=False, latency=5.0)
+        self.assertEqual(self.transport.sessions, {})
+
+    def test_validate_evicts_failed_proxies(self):
+        """Test that only the working proxies are kept after validation"""
+        pool = ProxyPool(
+            config=self.config,
+            proxies=["1.1.1.1:80", "2.2.2.2:80"],
+            transport=self.transport,
+            path=self.path,
+        )
+        with patch.object(self.transport, "get", self.fake_transport_get):
+            self.assertEqual(pool.validate(), [])
+            self.assertEqual(pool.proxies, ["1.1.1.1:80", "2.2.2.2:80"])
+            self.working.add("2.2.2.2:80")
+            self.assertEqual(pool.validate(), ["2.2.2.2:80"])
+            self.assertEqual(pool.proxies, ["2.2.2.2:80"])
+        self.assertLess(
+            pool.scores["1.1.1.1:80"]["success"], pool.scores["2.2.2.2:80"]["success"]
+        )
+
+    def test_scrape_proxies_keeps_saved_proxies(self):
+        """Test that the saved proxies are not erased if none is valid"""
+        proxies_path = Path(self.directory.name) / "proxies.txt"
+        with (
+            patch("etl.parser.PROXIES_PATH", proxies_path),
+            patch("etl.parser.STORAGE_PATH", Path(self.directory.name)),
+            patch.object(self.transport, "get", self.fake_transport_get),
+        ):
+            # All candidates are saved if there are no saved proxies
+            scrape_proxies(transport=self.transport)
+            self.assertEqual(proxies_path.read_text(), "1.1.1.1:80\n2.2.2.2:80")
+
+            proxies_path.write_text("3.3.3.3:80")
+            scrape_proxies(transport=self.transport)
+            self.assertEqual(proxies_path.read_text(), "3.3.3.3:80")
+
+            self.working.add("1.1.1.1:80")
+            scrape_proxies(transport=self.transport)
+            self.assertEqual(proxies_path.read_text(), "1.1.1.1:80")
+
+
+class TestAdaptiveRateLimiter(unittest.TestCase):
+
+    def test_rate_increases_once_per_interval(self):
+        """Test that the rate grows per time window rather than per response"""
+        config = RealtyYaParser().config["rate_limiter"]
+        url = "https://realty.ya.ru/"
+        now = [0.0]
+        with patch("etl.rate_limiter.time.monotonic", lambda: now[0]):
+            limiter = AdaptiveRateLimiter(config=config)
+            limiter.reserve(url=url)
+            for _ in range(30):
+                limiter.feedback(url=url, status_code=200)
+            self.assertEqual(limiter.buckets["realty.ya.ru"].rate, 5.0)
+            for _ in range(40):
+                now[0] += config["increase_interval"] / 4
+                limiter.feedback(url=url, status_code=200)
+            self.assertEqual(limiter.buckets["realty.ya.ru"].rate, 10.0)
+
+            # A decrease restarts the window of the increase
+            limiter.feedback(url=url, status_code=429)
+            limiter.feedback(url=url, status_code=200)
+            self.assertEqual(limiter.buckets["realty.ya.ru"].rate, 5.0)
+
+
+class TestHedging(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = RealtyYaParser()
+        self.parser.cache = None
+        self.parser.config["hedging"].update({"enabled": True, "min_samples": 1})
+        for _ in range(5):
+            self.parser.attempt_latencies.add(0.05)
+        self.calls = []
+
+    def tearDown(self):
+        self.parser.close()
+
+    def fake_transport_get(self, url, timeout, headers=None, proxy=None):
+        """The first request is slow, the following ones are fast"""
+        self.calls.append(time.monotonic())
+        if len(self.calls) == 1:
+            time.sleep(0.5)
+            return make_response(url, "<html>first</html>")
+        return make_response(url, "<html>hedge</html>")
+
+    def test_hedge_wins_over_slow_attempt(self):
+        """Test that a slow attempt is hedged when a token is available"""
+        url = f"{self.parser.config['offers_url']}/offer/1/"
+        with patch.object(self.parser.transport, "get", self.fake_transport_get):
+            response = self.parser.get(url=url)
+        self.assertEqual(response.text, "<html>hedge</html>")
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(self.parser.retry_stats["hedged"], 1)
+        self.assertEqual(self.parser.retry_stats["hedge_wins"], 1)
+
+    def test_throttled_attempt_is_not_hedged(self):
+        """Test that hedging does not wait for the tokens of the limiter"""
+        self.parser.rate_limiter.config.update({"initial_rate": 0.5, "burst": 1.0})
+        url = f"{self.parser.config['offers_url']}/offer/1/"
+        with patch.object(self.parser.transport, "get", self.fake_transport_get):
+            response = self.parser.get(url=url)
+        self.assertEqual(response.text, "<html>first</html>")
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.parser.retry_stats["hedged"], 0)
+        self.assertFalse(self.parser.rate_limiter.try_acquire(url=url))
+
+    def test_close_shuts_down_executor(self):
+        """Test that the hedging threads do not outlive the parser"""
+        url = f"{self.parser.config['offers_url']}/offer/1/"
+        with self.parser as parser:
+            with patch.object(parser.transport, "get", self.fake_transport_get):
+                parser.get(url=url)
+            executor = parser.hedging_executor
+            self.assertNotEqual(executor, None)
+        self.assertEqual(self.parser.hedging_executor, None)
+        self.assertTrue(all(not x.is_alive() for x in executor._threads))
+        self.assertEqual(self.parser.transport.sessions, {})
+
+
+@unittest.skipUnless(source_db_available(), "source database is not available")
+class TestOfferIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.config = {"table_name": "test_offer_index", "refresh_age_days": 7}
+        today = datetime.now().date()
+        execute_sql_query(
+            query="DROP TABLE IF EXISTS test_realty, test_offer_index; "
+            + "CREATE TABLE test_realty (LIKE realty INCLUDING ALL); "
+            + "INSERT INTO test_realty (offer_id, date_parsed, flat_type, fee_info) "
+            + "VALUES "
+            + ", ".join(
+                f"({offer_id}, '{date}', '2-комнатная квартира', "
+                + f"ARRAY['есть', 'нет', 'включены', '{price} ₽'])"
+                for offer_id, date, price in [
+                    (1, today - timedelta(days=30), "40 000"),
+                    (1, today - timedelta(days=2), "45 000"),
+                    (2, today - timedelta(days=2), "50 000"),
+                    (3, today - timedelta(days=30), "60 000"),
+                ]
+            ),
+            is_source_db=True,
+        )
+
+    def tearDown(self):
+        execute_sql_query(
+            query="DROP TABLE IF EXISTS test_realty, test_offer_index",
+            is_source_db=True,
+        )
+
+    def read_index(self) -> pd.DataFrame:
+        """Reads the stored index with offer_id as the index"""
+        return read_table_from_database(
+            table_name="test_offer_index", is_source_db=True
+        ).set_index("offer_id")
+
+    def test_seeded_offers_are_carried_forward(self):
+        """Test that the cards of seeded offers match their fingerprints"""
+        title = "45,5 м², 2-комнатная квартира"
+        index = OfferIndex(config=self.config, main_table_name="test_realty")
+        self.assertEqual(len(self.read_index()), 3)
+        self.assertEqual(index.classify(1, "45 000 ₽ в месяц", title), "unchanged")
+        self.assertEqual(index.classify(2, "55 000 ₽ в месяц", title), "changed")
+        self.assertEqual(index.classify(3, "60 000 ₽ в месяц", title), "refresh")
+        self.assertEqual(index.classify(4, "70 000 ₽ в месяц", title), "new")
+        carried = index.carry_forward(columns=["offer_id", "fee_info"])
+        self.assertEqual(carried["offer_id"].tolist(), [1])
+        self.assertEqual(carried["fee_info"][0][3], "45 000 ₽")
+
+        # Offer 2 has failed to be fetched and keeps it's seeded entry
+        index.update(fetched_offer_ids=[3, 4])
+        df = self.read_index()
+        self.assertEqual(sorted(df.index), [1, 2, 3, 4])
+        self.assertEqual(
+            df.at[1, "fingerprint"], offer_fingerprint("45 000 ₽ в месяц", title)
+        )
+        self.assertEqual(df.at[2, "fingerprint"], index.index.at[2, "fingerprint"])
+        self.assertEqual(df.at[3, "date_fetched"], datetime.now().date())
+        self.assertEqual(
+            df.at[4, "fingerprint"], offer_fingerprint("70 000 ₽ в месяц", title)
+        )
+
+        # The stored card fingerprints are compared during the next crawl
+        index = OfferIndex(config=self.config, main_table_name="test_realty")
+        self.assertEqual(index.classify(1, "45 000 ₽ в месяц", title), "unchanged")
+        self.assertEqual(index.classify(2, "55 000 ₽ в месяц", title), "changed")
+        self.assertEqual(index.classify(4, "70 000 ₽ в месяц", title), "unchanged")
+        self.assertEqual(
+            index.classify(4, "70 000 ₽ в месяц", "45,5 м², 2-комнатная студия"),
+            "changed",
+        )
+
+    def test_missing_table_is_created(self):
+        """Test that the index table is created like the one of init.sql"""
+        OfferIndex(config=self.config, main_table_name="test_realty")
+        OfferIndex(config=self.config, main_table_name="test_realty")
+        columns = [
+            read_query_from_database(
+                query="SELECT column_name, data_type FROM information_schema.columns "
+                + "WHERE table_name = :table_name ORDER BY ordinal_position",
+                is_source_db=True,
+                params={"table_name": x},
+            ).values.tolist()
+            for x in ["offer_index", "test_offer_index"]
+        ]
+        self.assertEqual(columns[0], columns[1])
+
+    def test_failed_update_keeps_index(self):
+        """Test that the index is updated in a single transaction"""
+        index = OfferIndex(config=self.config, main_table_name="test_realty")
+        index.classify(1, "45 000 ₽ в месяц", "2-комнатная квартира")
+        index.classify(4, "70 000 ₽ в месяц", "2-комнатная квартира")
+        with patch.object(pd.DataFrame, "to_sql", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                index.update(fetched_offer_ids=[4])
+        self.assertEqual(sorted(self.read_index().index), [1, 2, 3])
+
+
+@unittest.skipUnless(source_db_available(), "source database is not available")
+class TestWorkQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.config = {
+            "table_name": "test_crawl_tasks",
+            "lease_duration": 300,
+            "max_attempts": 2,
+            "claim_size": 4,
+            "poll_interval": 0.1,
+            "site_rate_ceiling": 20.0,
+        }
+        execute_sql_query(
+            query="DROP TABLE IF EXISTS test_crawl_tasks", is_source_db=True
+        )
+        self.queue = WorkQueue(config=self.config, date_parsed="2024-01-01")
+        self.queue.seed(kind="listing", urls=[f"?page={i}" for i in range(2)])
+        self.queue.seed(kind="offer", urls=[f"/offer/{i}/" for i in range(20)])
+
+    def tearDown(self):
+        self.queue.engine.dispose()
+        execute_sql_query(query="DROP TABLE IF EXISTS test_crawl_tasks", is_source_db=True)
+
+    def expire_leases(self):
+        """Moves the expiration of all leases into the past"""
+        execute_sql_query(
+            query="UPDATE test_crawl_tasks SET lease_expires_at=NOW() - "
+            + "INTERVAL '1 second' WHERE status='leased'",
+            is_source_db=True,
+        )
+
+    def test_missing_table_is_created(self):
+        """Test that the queue table is created like the one of init.sql"""
+        WorkQueue(config=self.config, date_parsed="2024-01-01").engine.dispose()
+        columns, indexes = [], []
+        for table_name in ["crawl_tasks", "test_crawl_tasks"]:
+            columns.append(
+                read_query_from_database(
+                    query="SELECT column_name, data_type, column_default "
+                    + "FROM information_schema.columns WHERE table_name = :table_name "
+                    + "ORDER BY ordinal_position",
+                    is_source_db=True,
+                    params={"table_name": table_name},
+                )
+                .replace({table_name: "table"}, regex=True)
+                .values.tolist()
+            )
+            indexes.append(
+                read_query_from_database(
+                    query="SELECT indexdef FROM pg_indexes "
+                    + "WHERE tablename = :table_name ORDER BY indexname",
+                    is_source_db=True,
+                    params={"table_name": table_name},
+                )["indexdef"]
+                .str.replace(table_name, "table")
+                .tolist()
+            )
+        self.assertEqual(columns[0], columns[1])
+        self.assertEqual(indexes[0], indexes[1])
+
+    def test_workers_claim_disjoint_tasks(self):
+        """Test that concurrent workers never claim the same task"""
+        self.assertEqual(self.queue.seed(kind="offer", urls=["/offer/0/"]), 0)
+        claimed = {"a": [], "b": []}
+        barrier = threading.Barrier(2)
+
+        def work(worker_id: str):
+            queue = WorkQueue(config=self.config, date_parsed="2024-01-01")
+            barrier.wait()
+            while True:
+                tasks = queue.claim(worker_id=worker_id, limit=3)
+                if len(tasks) == 0:
+                    break
+                claimed[worker_id].extend(tasks)
+            queue.engine.dispose()
+
+        threads = [threading.Thread(target=work, args=(x,)) for x in claimed]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=30)
+        tasks = claimed["a"] + claimed["b"]
+        self.assertEqual(len(tasks), 22)
+        self.assertEqual(len(set(tasks)), 22)
+        self.assertEqual(self.queue.stats(), {"listing_leased": 2, "offer_leased": 20})
+
+    def test_locked_tasks_are_skipped(self):
+        """Test that the rows locked by another claim are skipped"""
+        first = self.queue.claim(worker_id="a", limit=3)
+        self.assertEqual([kind for _, kind, _ in first], ["listing", "listing", "offer"])
+        self.expire_leases()
+        engine = create_connection_engine(is_source_db=True)
+        with engine.begin() as connection:
+            connection.exec_driver_sql(
+                "SELECT task_id FROM test_crawl_tasks WHERE task_id IN "
+                + f"({first[0][0]}, {first[1][0]}) FOR UPDATE"
+            )
+            connection.exec_driver_sql("SET LOCAL lock_timeout = '5s'")
+            second = self.queue.claim(worker_id="b", limit=2)
+        engine.dispose()
+        self.assertEqual([x[0] for x in second], [first[2][0], first[2][0] + 1])
+
+    def test_expired_lease_is_claimed_again_and_fails(self):
+        """Test that an expired lease is re-claimed until max_attempts"""
+        tasks = self.queue.claim(worker_id="a", limit=1)
+        task_id = tasks[0][0]
+        self.assertEqual(self.queue.claim(worker_id="b", limit=22)[0][0], task_id + 1)
+
+        # The task of the dead worker is taken over once it's lease expires
+        self.expire_leases()
+        self.assertFalse(self.queue.is_drained())
+        tasks = self.queue.claim(worker_id="b", limit=1)
+        self.assertEqual(tasks[0][0], task_id)
+        self.queue.resolve(task_id=task_id, worker_id="a", success=True)
+        self.assertEqual(self.queue.stats()["listing_leased"], 2)
+
+        # The lease expires after the last attempt: the task fails
+        self.expire_leases()
+        tasks = self.queue.claim(worker_id="c", limit=22)
+        self.assertEqual(len(tasks), 21)
+        self.assertNotIn(task_id, [x[0] for x in tasks])
+        self.assertEqual(self.queue.stats()["listing_failed"], 1)
+        self.assertFalse(self.queue.is_drained())
+        self.expire_leases()
+        self.assertEqual(self.queue.claim(worker_id="c", limit=22), [])
+        self.assertEqual(self.queue.stats(), {"listing_failed": 2, "offer_failed": 20})
+        self.assertTrue(self.queue.is_drained())
+
+    def test_failed_task_is_retried(self):
+        """Test that a failed task returns to the queue until max_attempts"""
+        for attempt in range(2):
+            task_id = self.queue.claim(worker_id="a", limit=1)[0][0]
+            self.queue.resolve(task_id=task_id, worker_id="a", success=False)
+        self.assertEqual(self.queue.stats()["listing_failed"], 1)
+        task_id = self.queue.claim(worker_id="a", limit=1)[0][0]
+        self.queue.resolve(task_id=task_id, worker_id="a", success=True)
+        self.assertEqual(self.queue.stats()["listing_done"], 1)
+
+    def test_rate_ceiling_is_shared(self):
+        """Test that the worker counts itself when sharing the ceiling"""
+        parser = RealtyYaParser()
+        worker = CrawlWorker(parser=parser, queue=self.queue, worker_id="a")
+        worker.share_rate_ceiling()
+        self.assertEqual(parser.rate_limiter.config["max_rate"], 20.0)
+        self.queue.claim(worker_id="b", limit=1)
+        worker.share_rate_ceiling()
+        self.assertEqual(parser.rate_limiter.config["max_rate"], 10.0)
+        self.queue.claim(worker_id="a", limit=1)
+        worker.share_rate_ceiling()
+        self.assertEqual(parser.rate_limiter.config["max_rate"], 10.0)
+        parser.transport.close()
+
+
+class TestRealtyYaParser(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = RealtyYaParser()
+        self.parser.config["number_of_pages"] = 10
+        self.parser.config["checkpoint"]["enabled"] = False
+
+    @patch.object(RealtyYaParser, "get", fake_get)
+    def test_concurrent_crawls_match_serial_crawl(self):
+        """Test that the concurrent crawl modes produce the same data"""
+        self.parser.config["crawl_mode"] = "serial"
+        df_serial = self.parser.retrieve(return_data=True)
+        self.assertEqual(len(df_serial), 6)
+        for mode in ["async", "pipeline"]:
+            self.parser.config["crawl_mode"] = mode
+            df = self.parser.retrieve(return_data=True)
+            self.assertTrue(df_serial.equals(df), mode)
+            self.assertEqual(self.parser.n_viewed_pages, 3, mode)
+
+    def test_async_crawl_requests_listing_pages_concurrently(self):
+        """Test that the listing pages following the first one overlap"""
+        lock = threading.Lock()
+        in_flight = {"current": 0, "max": 0, "pages": []}
+
+        def slow_get(parser, url: str) -> requests.models.Response:
+            if "?page=" not in url:
+                return fake_get(parser, url)
+            page = int(url.split("?page=")[-1])
+            with lock:
+                in_flight["current"] += 1
+                in_flight["max"] = max(in_flight["max"], in_flight["current"])
+                in_flight["pages"].append(page)
+            time.sleep(0.05)
+            with lock:
+                in_flight["current"] -= 1
+            html = listing_html(page, n_offers=3 if page < 4 else 0)
+            return make_response(url, html + '<a href="?page=5">6</a>')
+
+        with patch.object(RealtyYaParser, "get", slow_get):
+            self.parser.config["crawl_mode"] = "serial"
+            df_serial = self.parser.retrieve(return_data=True)
+            self.assertEqual(in_flight["max"], 1)
+            in_flight.update({"max": 0, "pages": []})
+            self.parser.config["crawl_mode"] = "async"
+            df = self.parser.retrieve(return_data=True)
+        self.assertEqual(len(df_serial), 12)
+        self.assertTrue(df_serial.equals(df))
+        self.assertEqual(in_flight["pages"][0], 0)
+        self.assertEqual(sorted(in_flight["pages"]), list(range(6)))
+        self.assertGreater(in_flight["max"], 1)
+        self.assertEqual(self.parser.n_viewed_pages, 5)
+
+    @patch.object(RealtyYaParser, "get", fake_get)
+    def test_async_crawl_parses_off_event_loop(self):
+        """Test that the async crawl parses the offers in the pool of threads"""
+        self.parser.config["crawl_mode"] = "async"
+        threads = []
+        parse = self.parser.parse
+
+        def recording_parse(response: requests.models.Response) -> list:
+            threads.append(threading.current_thread().name)
+            return parse(response=response)
+
+        with patch.object(self.parser, "parse", recording_parse):
+            df = self.parser.retrieve(return_data=True)
+        self.assertEqual(len(df), 6)
+        self.assertEqual(len(threads), 6)
+        self.assertTrue(all(x.startswith("ThreadPoolExecutor") for x in threads))
+
+    @patch.object(RealtyYaParser, "get", fake_get)
+    def test_pipeline_crawl_counts_extraction_sources(self):
+        """Test that the pages parsed by the workers are counted"""
+        self.parser.config["crawl_mode"] = "pipeline"
+        self.parser.config["embedded_state"]["enabled"] = True
+        self.parser.extractor = get_extractor(
+            name=self.parser.config["bs_parser"],
+            fields=self.parser.config["parsing_fields"]["sub_fields"],
+            state_config=self.parser.config["embedded_state"],
+        )
+        df = self.parser.retrieve(return_data=True)
+        self.assertEqual(len(df), 6)
+        self.assertEqual(self.parser.extractor.stats["state"], 0)
+        self.assertEqual(self.parser.extractor.stats["dom"], 6)
+
+    @patch.object(RealtyYaParser, "get", fake_get)
+    def test_streaming_retrieve_matches_retrieve(self):
+        """Test that the streamed batches add up to the retrieved data"""
+        self.parser.config["streaming"]["batch_size"] = 4
+        df = self.parser.retrieve(return_data=True)
+        batches = list(self.parser.retrieve_batches(save_data=False))
+        self.assertEqual([len(x) for x in batches], [4, 2])
+        self.assertTrue(df.equals(pd.concat(batches, ignore_index=True)))
+
+    def test_resumed_crawl_matches_full_crawl(self):
+        """Test that an interrupted crawl is resumed without repeated requests"""
+        requested = []
+
+        def flaky_get(parser, url):
+            requested.append(url)
+            if "/offer/101/" in url:
+                return None
+            return fake_get(parser, url)
+
+        def counting_get(parser, url):
+            requested.append(url)
+            return fake_get(parser, url)
+
+        with patch.object(RealtyYaParser, "get", fake_get):
+            df_full = self.parser.retrieve(return_data=True)
+        self.parser.config["checkpoint"]["enabled"] = True
+        with tempfile.TemporaryDirectory() as path:
+            with patch("etl.parser.STORAGE_PATH", Path(path)):
+                with patch.object(RealtyYaParser, "get", flaky_get):
+                    df = self.parser.retrieve(return_data=True, fresh_crawl=True)
+                self.assertEqual(len(df), 5)
+                requested.clear()
+                with patch.object(RealtyYaParser, "get", counting_get):
+                    df = self.parser.retrieve(return_data=True)
+                url = f"{self.parser.config['offers_url']}/offer/101/"
+                self.assertEqual(requested, [url])
+        df = df.sort_values("offer_id", ignore_index=True)
+        self.assertTrue(df_full.sort_values("offer_id", ignore_index=True).equals(df))
+
+    def test_time_budget_defers_low_priority_offers(self):
+        """Test that a budgeted crawl fetches offers by priority until the deadline"""
+        clock = {"now": 0.0}
+
+        def slow_get(parser, url):
+            if "?page=" not in url:
+                clock["now"] += 1.0
+            return fake_get(parser, url)
+
+        self.parser.config["time_budget"]["initial_latency"] = 1.0
+        with (
+            patch("etl.parser.time.monotonic", lambda: clock["now"]),
+            patch.object(RealtyYaParser, "get", slow_get),
+            patch.object(
+                RealtyYaParser,
+                "offer_priority",
+                lambda parser, offer: -int(offer.split("/")[-2]),
+            ),
+        ):
+            df = self.parser.retrieve(return_data=True, time_budget=3.5 / 60)
+        self.assertEqual(df["offer_id"].tolist(), [102, 101, 100])
+        self.assertEqual(
+            self.parser.deferred_offers, ["/offer/2/", "/offer/1/", "/offer/0/"]
+        )
+
+    def test_shallow_crawl_builds_content_from_cards(self):
+        """Test that a shallow crawl requests the listing pages only"""
+        requested = []
+
+        def cards_get(parser, url):
+            requested.append(url)
+            page = int(url.split("?page=")[-1])
+            return make_response(url, listing_cards_html(page, 3 if page < 2 else 0))
+
+        self.parser.config["shallow"]["enabled"] = True
+        with patch.object(RealtyYaParser, "get", cards_get):
+            df = self.parser.retrieve(return_data=True)
+        self.assertEqual(len(requested), 3)
+        self.assertEqual(df["offer_id"].tolist(), [0, 1, 2, 100, 101, 102])
+        row = df.iloc[4]
+        self.assertEqual(row["flat_type"], "45,5 м², 2-комнатная квартира")
+        self.assertEqual(row["address_info"], "Невский проспект, 1")
+        self.assertEqual(row["extra_features"], None)
+        self.assertEqual(
+            transform_main_info(raw_content=row["main_info"]), [45.5, 3, 9, None, None]
+        )
+        self.assertEqual(
+            transform_fee_info(raw_content=row["fee_info"]),
+            [None, None, None, None, 101],
+        )
+
+    def test_embedded_state_matches_dom(self):
+        """Test that the embedded state gives the same content as the DOM"""
+        fields = self.parser.config["parsing_fields"]["sub_fields"]
+        self.parser.config["embedded_state"]["enabled"] = True
+        dom_extractor = get_extractor(name="html.parser", fields=fields)
+        extractor = get_extractor(
+            name="html.parser",
+            fields=fields,
+            state_config=self.parser.config["embedded_state"],
+        )
+        for name in ["offer_with_state.html", "offer_without_state.html"]:
+            html = read_fixture(name)
+            self.assertEqual(extractor.parse(html=html), dom_extractor.parse(html=html))
+        self.assertEqual(extractor.stats, {"state": 1, "dom": 1, "incomplete": 0})
+
+    def test_state_first_extractor_counts_concurrent_pages(self):
+        """Test that the extractor follows the interface and counts every page"""
+        self.parser.config["embedded_state"]["enabled"] = True
+        extractor = get_extractor(
+            name="html.parser",
+            fields=self.parser.config["parsing_fields"]["sub_fields"],
+            state_config=self.parser.config["embedded_state"],
+        )
+        self.assertIsInstance(extractor, BaseExtractor)
+        html = read_fixture("offer_with_state.html")
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda _: extractor.parse(html=html), range(200)))
+        self.assertEqual(extractor.stats, {"state": 200, "dom": 0, "incomplete": 0})
+
+    def test_incomplete_embedded_state_falls_back_to_dom(self):
+        """Test that the DOM is used when the state does not match the mapping"""
+        fields = self.parser.config["parsing_fields"]["sub_fields"]
+        self.parser.config["embedded_state"]["enabled"] = True
+        dom_extractor = get_extractor(name="html.parser", fields=fields)
+        extractor = get_extractor(
+            name="html.parser",
+            fields=fields,
+            state_config=self.parser.config["embedded_state"],
+        )
+        html = read_fixture("offer_with_state.html")
+        expected = dom_extractor.parse(html=html)
+
+        # The root is found but the keys of the state have been renamed
+        renamed = html.replace('"roomsTotal"', '"rooms"').replace(
+            '"location"', '"geo"'
+        )
+        self.assertEqual(extractor.parse(html=renamed), expected)
+        self.assertEqual(extractor.stats, {"state": 0, "dom": 1, "incomplete": 1})
+
+        # A missing deposit keeps the other fee_info items in place
+        no_deposit = html.replace('"rentDeposit": 40000, ', "")
+        content = extractor.parse(html=no_deposit)
+        self.assertEqual(extractor.stats["state"], 1)
+        self.assertEqual(content[2], [None, "50 %", "не включены", "45000 ₽"])
+        self.assertEqual(transform_fee_info(content[2])[2:], [50, "не включены", 45000])
+
+    def test_reextracted_archive_matches_parsed_content(self):
+        """Test that the archived offer pages are re-extracted in parallel"""
+        with tempfile.TemporaryDirectory() as path:
+            archive = HtmlArchive(config=self.parser.config["archive"], path=Path(path))
+            date = "2024-07-01"
+            for offer_id in range(10):
+                archive.store(offer_id=offer_id, html=offer_html(offer_id), date_parsed=date)
+            archive.store(offer_id=3, html="", date_parsed=date)
+            self.assertEqual(archive.read(date, 3), offer_html(3))
+            self.parser.archive = archive
+            df = self.parser.reextract(date_parsed=date)
+        self.assertEqual(df["offer_id"].tolist(), list(range(10)))
+        url = self.parser.config["offers_url"]
+        expected = self.parser.parse(response=make_response(url, offer_html(7)))
+        self.assertEqual(df.iloc[7, : len(expected)].tolist(), expected)
+
+    def test_retry_policy(self):
+        """Test that server errors are retried and client errors are not"""
+        self.parser.cache = None
+        self.parser.config["retry_policy"]["base_delay"] = 0.01
+        self.parser.config["hedging"]["enabled"] = False
+        self.parser.rate_limiter.config["initial_rate"] = 1000.0
+        self.parser.rate_limiter.config["min_rate"] = 1000.0
+        responses = []
+
+        def fake_transport_get(url, timeout, headers=None, proxy=None):
+            status_code = responses.pop(0)
+            if status_code == None:
+                raise requests.exceptions.ReadTimeout()
+            response = make_response(url, "<html></html>")
+            response.status_code = status_code
+            return response
+
+        url = f"{self.parser.config['offers_url']}/offer/1/"
+        with patch.object(self.parser.transport, "get", fake_transport_get):
+            responses.extend([503, None, 429, 200])
+            self.assertEqual(self.parser.get(url=url).status_code, 200)
+            responses.extend([404, 200])
+            self.assertEqual(self.parser.get(url=url), None)
+            self.assertEqual(responses, [200])
+            responses[:] = [None] * self.parser.config["number_of_tries"]
+            self.assertEqual(self.parser.get(url=url), None)
+        stats = self.parser.retry_stats
+        self.assertEqual([stats[k] for k in ["server", "throttled", "client"]], [1, 1, 1])
+        self.assertEqual(stats["timeout"], 1 + self.parser.config["number_of_tries"])
+
+    def test_discover_number_of_pages(self):
+        """Test that the number of pages is discovered from pagination links"""
+        html = "".join(f'<a href="/snyat/kvartira/?page={i}">{i}</a>' for i in [1, 2, 41])
+        response = make_response(self.parser.config["url"], html)
+        self.assertEqual(self.parser.discover_number_of_pages(response=response), 42)
+        self.assertEqual(self.parser.discover_number_of_pages(response=None), None)
+
+    def test_extractor_backends_match(self):
+        """Test that all extractor backends parse the same content"""
+        fields = self.parser.config["parsing_fields"]["sub_fields"]
+        html = "<html><body>" + offer_html(12345) + "</body></html>"
+        expected = get_extractor(name="html.parser", fields=fields).parse(html=html)
+        self.assertEqual(expected[0], "1-комнатная квартира")
+        for name in ["lxml", "lxml.html", "selectolax"]:
+            extractor = get_extractor(name=name, fields=fields)
+            self.assertEqual(extractor.parse(html=html), expected)
+
+    def test_single_pass_matches_find_all(self):
+        """Test that the single pass extraction matches per-field find_all"""
+        fields = self.parser.config["parsing_fields"]["sub_fields"]
+        html = (
+            "<html><body>"
+            + offer_html(12345)
+            + '<h1 class="OfferCardSummaryInfo__description--3-iC7">студия</h1>'
+            + '<div class="OfferCardFeature__text--_Hmzv">Мебель'
+            + '<div class="OfferCardFeature__text--_Hmzv">Кухня</div></div>'
+            + '<div class="x  OfferCardHighlight__container--2gZn2 '
+            + 'OfferCardFeature__text--_Hmzv">Вид на воду</div>'
+            + '<span class="OfferCardCheck__rowValue--bcPJA">30 000 ₽'
+            + '<span class="OfferCardCheck__rowValue--bcPJA"> залог</span></span>'
+            + '<div class="AddressWithGeoLinks__addressContainer--4jzfZ   '
+            + 'GeoLinks__addressGeoLinks--3UPum">Москва</div>'
+            + "</body></html>"
+        )
+        bs = BeautifulSoup(html, "html.parser")
+        expected = []
+        for cfg in fields.values():
+            texts = [x.text for x in bs.find_all(name=cfg["tag"], class_=cfg["classes"])]
+            if len(texts) == 0:
+                texts = None
+            elif cfg["return_first_parsed"]:
+                texts = texts[0]
+            expected.append(texts)
+        self.assertEqual(expected[2][-2:], ["30 000 ₽ залог", " залог"])
+        for name in ["html.parser", "lxml", "lxml.html", "selectolax"]:
+            extractor = get_extractor(name=name, fields=fields)
+            self.assertEqual(extractor.parse(html=html), expected, name)
+
+    def test_empty_document(self):
+        """Test that all extractor backends accept an empty document"""
+        fields = self.parser.config["parsing_fields"]["sub_fields"]
+        for name in ["html.parser", "lxml", "lxml.html", "selectolax"]:
+            extractor = get_extractor(name=name, fields=fields)
+            for html in ["", "  ", "<!-- empty -->"]:
+                self.assertEqual(extractor.parse(html=html), [None] * len(fields))
+                self.assertEqual(extractor.links(html=html, tag="a", classes=["x"]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,496 @@
+import time
+import random
+import unittest
+import tempfile
+import threading
+import pandas as pd
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from etl import transformer
+from etl.transformer import (
+    CONFIG,
+    RealtyYaTransformer,
+    transform_flat_type,
+    transform_main_info,
+    transform_fee_info,
+    transform_extra_features,
+    vectorized_transform_flat_type,
+    vectorized_transform_main_info,
+    vectorized_transform_fee_info,
+    vectorized_transform_extra_features,
+)
+from etl.geocoding import GeocodingExecutor, GeocodeCache
+from etl.utils import (
+    create_connection_engine,
+    execute_sql_query,
+    read_query_from_database,
+    read_table_from_database,
+)
+
+
+def scan_extra_features(raw_content: list[str]) -> list:
+    """Transforms extra_features by scanning the config for each feature"""
+    content = dict(
+        [(k, v["default"]) for (k, v) in CONFIG["extra_features"]["features"].items()]
+    )
+    raw_content = set(raw_content)
+    for field, subconfig in CONFIG["extra_features"]["features"].items():
+        for item in raw_content:
+            if item in subconfig["values"]:
+                content[field] = subconfig["values"][item]
+                raw_content.remove(item)
+                break
+    return list(content.values())
+
+
+def locate_addresses(df: pd.DataFrame) -> pd.DataFrame:
+    """Joins known addresses to the data without any database"""
+    df_a = pd.DataFrame(
+        {
+            "address_id": [1, 2],
+            "address_info": ["Невский проспект, 1", "Литейный проспект, 5"],
+            "latitude": [59.93, 59.94],
+            "longitude": [30.31, 30.35],
+        }
+    )
+    return df.merge(df_a, how="left", on="address_info").drop("address_info", axis=1)
+
+
+def raw_data(n_rows: int) -> pd.DataFrame:
+    """Builds raw data as it is stored in the source database"""
+    return pd.DataFrame(
+        {
+            "offer_id": list(range(n_rows)),
+            "date_parsed": ["2024-05-01"] * n_rows,
+            "flat_type": [f"{x % 3 + 1}-комнатная квартира" for x in range(n_rows)],
+            "main_info": [
+                ["45 м²общая", f"{x % 9 + 1} этаж из 9"] for x in range(n_rows)
+            ],
+            "fee_info": [
+                ["есть", "50 %", "включены", f"{x} ₽"] if x % 2 else None
+                for x in range(n_rows)
+            ],
+            "address_info": [
+                ["Невский проспект, 1", "Литейный проспект, 5", "Нигде", None][x % 4]
+                for x in range(n_rows)
+            ],
+            "extra_features": [["Балкон", "Лифт"][: x % 3] for x in range(n_rows)],
+        }
+    )
+
+
+def source_db_available() -> bool:
+    """Whether the source database can be connected to"""
+    try:
+        with create_connection_engine(is_source_db=True).connect():
+            return True
+    except Exception:
+        return False
+
+
+class StubGeocoder:
+    """Local geocoder which answers after a random delay"""
+
+    locations = {
+        "Невский проспект, 1": (59.93, 30.31, 0),
+        "Санкт-Петербург, Парголово, Заречная улица, 3": (60.08, 30.26, 0),
+        "Санкт-Петербург, Шушары, Пушкинская улица, 7": (59.8, 30.38, 0),
+    }
+    queries = []
+    lock = threading.Lock()
+
+    def geocode(self, query: str):
+        with self.lock:
+            self.queries.append(query)
+        time.sleep(random.uniform(0, 0.01))
+        if "Шушары" in query and not query.startswith("Санкт-Петербург"):
+            raise ConnectionError("Stub geocoder is unavailable")
+        if query in self.locations:
+            return SimpleNamespace(point=self.locations[query])
+        return None
+
+
+class TestGeocodingExecutor(unittest.TestCase):
+
+    def test_locate_is_deterministic(self):
+        """Test that the locations follow the addresses, whatever the timing"""
+        addresses = [
+            "Парголово, Заречная улица, 3",
+            "Нигде",
+            "Невский проспект, 1",
+            "Шушары, Пушкинская улица, 7",
+        ] * 5
+        expected = [[60.08, 30.26], [None, None], [59.93, 30.31], [59.8, 30.38]] * 5
+        config = {"workers": 4, "rate_limit": 1000.0, "burst": 10}
+        for speculative in [True, False]:
+            for _ in range(3):
+                executor = GeocodingExecutor(
+                    config=dict(config, speculative=speculative),
+                    address_adjustment=CONFIG["address_info"]["address_adjustment"],
+                    geocoder_factory=StubGeocoder,
+                )
+                self.assertEqual(executor.locate(addresses=addresses), expected)
+                self.assertEqual(executor.stats["failed"], 5)
+        self.assertIn(
+            "Санкт-Петербург, Парголово, Заречная улица, 3", StubGeocoder.queries
+        )
+
+
+class StubAddressesTable:
+    """addresses table of the source database kept in memory"""
+
+    def __init__(self):
+        self.df = pd.DataFrame(
+            {
+                "address_id": [1],
+                "address_info": ["Литейный проспект, 5"],
+                "latitude": [59.94],
+                "longitude": [30.35],
+            }
+        )
+        self.queries = []
+
+    def read_query(
+        self, query: str, is_source_db: bool = False, params: dict | None = None
+    ) -> pd.DataFrame:
+        self.queries.append(query)
+        if "MAX" in query:
+            return pd.DataFrame({"address_id": [self.df["address_id"].max() + 1]})
+        values = self.df["address_info"].map(
+            lambda x: transformer.lookup_values(addresses=[x])[1][0]
+        )
+        return self.df[values.isin(params["values"])]
+
+    def save(self, df: pd.DataFrame, **kwargs):
+        self.df = pd.concat([self.df, df], ignore_index=True)
+
+
+class TestGeocodeCache(unittest.TestCase):
+
+    def test_cached_addresses_are_not_read_or_geocoded_again(self):
+        """Test that the second transform is served by the geocode cache"""
+        table = StubAddressesTable()
+        df = pd.DataFrame(
+            {
+                "offer_id": [1, 2, 3, 4, 5],
+                "address_info": [
+                    "Невский проспект, 1",
+                    "Литейный проспект, 5",
+                    "Нигде",
+                    None,
+                    "Санкт-Петербург, Невский просп., д. 1",
+                ],
+            }
+        )
+        with tempfile.TemporaryDirectory() as path, patch.multiple(
+            transformer,
+            read_query_from_database=table.read_query,
+            save_data_to_database=table.save,
+            IS_ADDRESSES_TABLE_PREPARED=True,
+            GEOCODE_CACHE=GeocodeCache(
+                config={"lru_size": 1, "negative_ttl": 3600},
+                path=Path(path),
+                key_func=transformer.address_key,
+            ),
+        ), patch.dict(
+            CONFIG["address_info"]["canonicalization"], enabled=True
+        ), patch(
+            "etl.geocoding.ArcGIS", StubGeocoder
+        ):
+            StubGeocoder.queries.clear()
+            expected = transformer.transform_address_info(df=df)
+            self.assertEqual(expected["address_id"][[0, 1, 4]].tolist(), [2, 1, 2])
+            self.assertEqual(StubGeocoder.queries, ["Невский проспект, 1", "Нигде"])
+            self.assertEqual(len(table.df), 2)
+
+            n_queries = len(table.queries)
+            output = transformer.transform_address_info(df=df)
+            self.assertTrue(expected.equals(output), f"\n{expected}\n{output}")
+            self.assertEqual(len(table.queries), n_queries)
+            self.assertEqual(len(StubGeocoder.queries), 2)
+            self.assertEqual(
+                transformer.GEOCODE_CACHE.stats,
+                {"memory_hits": 0, "store_hits": 3, "negative_hits": 1, "misses": 4},
+            )
+
+
+@unittest.skipUnless(source_db_available(), "source database is not available")
+class TestAddressesTable(unittest.TestCase):
+
+    addresses = ["Невский проспект, 1", "Литейный проспект, 5", "Лиговский пр., 'А'"]
+
+    def setUp(self):
+        execute_sql_query(
+            query="DROP TABLE IF EXISTS test_addresses; "
+            + "CREATE TABLE test_addresses (address_id INTEGER PRIMARY KEY, "
+            + "address_info VARCHAR(100), latitude FLOAT, longitude FLOAT); "
+            + "INSERT INTO test_addresses VALUES "
+            + "(1, 'Невский проспект, 1', 59.93, 30.31), "
+            + "(2, 'Лиговский пр., ''А''', 59.92, 30.36)",
+            is_source_db=True,
+        )
+        self.patches = [
+            patch.dict(CONFIG["address_info"], table_name="test_addresses"),
+            patch.object(transformer, "IS_ADDRESSES_TABLE_PREPARED", False),
+        ]
+        for patch_ in self.patches:
+            patch_.start()
+
+    def tearDown(self):
+        for patch_ in self.patches:
+            patch_.stop()
+        execute_sql_query(
+            query="DROP TABLE IF EXISTS test_addresses", is_source_db=True
+        )
+
+    def enable_canonicalization(self):
+        """Enables canonicalization till the end of the test"""
+        patch_ = patch.dict(CONFIG["address_info"]["canonicalization"], enabled=True)
+        patch_.start()
+        self.addCleanup(patch_.stop)
+
+    def read_indexes(self) -> list[str]:
+        """Definitions of the address_info indexes of the scratch table"""
+        return read_query_from_database(
+            query="SELECT indexdef FROM pg_indexes WHERE tablename = 'test_addresses' "
+            + "AND indexname LIKE '%address_info%'",
+            is_source_db=True,
+        )["indexdef"].tolist()
+
+    def test_lookups_match_and_create_index(self):
+        """Test that both lookups match the same rows and create the index"""
+        for join_in_database in [False, True]:
+            with patch.dict(CONFIG["address_info"], join_in_database=join_in_database):
+                df_a = transformer.read_addresses(addresses=self.addresses)
+                self.assertEqual(sorted(df_a["address_id"].tolist()), [1, 2])
+                df_a = transformer.read_addresses(addresses=[])
+                self.assertEqual(len(df_a), 0)
+                self.assertIn("address_info", df_a.columns)
+        indexes = self.read_indexes()
+        self.assertEqual(len(indexes), 1)
+        self.assertIn("UNIQUE", indexes[0])
+
+    def test_duplicated_addresses_get_non_unique_index(self):
+        """Test that a table with duplicated addresses is still indexed"""
+        execute_sql_query(
+            query="INSERT INTO test_addresses VALUES "
+            + "(3, 'Невский проспект, 1', 59.93, 30.31)",
+            is_source_db=True,
+        )
+        df_a = transformer.read_addresses(addresses=self.addresses)
+        self.assertEqual(sorted(df_a["address_id"].tolist()), [1, 2, 3])
+        indexes = self.read_indexes()
+        self.assertEqual(len(indexes), 1)
+        self.assertNotIn("UNIQUE", indexes[0])
+
+    def test_spellings_of_stored_addresses_are_not_geocoded(self):
+        """Test that another spelling of a stored address shares it's address_id"""
+        df = pd.DataFrame(
+            {
+                "offer_id": [1, 2],
+                "address_info": [
+                    "Санкт-Петербург, Невский просп., д. 1",
+                    "лиговский  пр., 'а'",
+                ],
+            }
+        )
+        self.enable_canonicalization()
+        paths = [(True, False), (False, False), (False, True)]
+        for is_cached, join_in_database in paths:
+            with tempfile.TemporaryDirectory() as path, patch.dict(
+                CONFIG["address_info"], join_in_database=join_in_database
+            ), patch.dict(CONFIG["address_info"]["cache"], enabled=is_cached), patch(
+                "etl.geocoding.ArcGIS", StubGeocoder
+            ), patch.object(
+                transformer,
+                "GEOCODE_CACHE",
+                GeocodeCache(
+                    config=CONFIG["address_info"]["cache"],
+                    path=Path(path),
+                    key_func=transformer.address_key,
+                ),
+            ):
+                StubGeocoder.queries.clear()
+                output = transformer.transform_address_info(df=df)
+                self.assertEqual(output["address_id"].tolist(), [1, 2])
+                self.assertEqual(StubGeocoder.queries, [])
+        df_a = read_table_from_database(table_name="test_addresses", is_source_db=True)
+        self.assertEqual(len(df_a), 2)
+        self.assertEqual(
+            df_a["address_key"].tolist(),
+            [transformer.address_key(x) for x in df_a["address_info"]],
+        )
+
+
+    def test_stale_address_keys_are_rebuilt(self):
+        """Test that the keys follow a change of the canonicalization"""
+        self.enable_canonicalization()
+        # Stale keys and a unique index of address_key (the stale keys are
+        # duplicated, so the index is partial)
+        execute_sql_query(
+            query="ALTER TABLE test_addresses ADD COLUMN address_key VARCHAR(100), "
+            + "ADD COLUMN address_key_version VARCHAR(32); "
+            + "UPDATE test_addresses SET address_key = 'stale', "
+            + "address_key_version = 'stale'; "
+            + "CREATE UNIQUE INDEX test_addresses_address_key_idx "
+            + "ON test_addresses (address_key) WHERE address_id > 1",
+            is_source_db=True,
+        )
+        df_a = transformer.read_addresses(addresses=self.addresses)
+        self.assertEqual(sorted(df_a["address_id"].tolist()), [1, 2])
+        version = transformer.address_key_version()
+        self.assertEqual(df_a["address_key_version"].tolist(), [version] * 2)
+
+        # A change of the code changes the version and rebuilds the keys
+        execute_sql_query(
+            query="UPDATE test_addresses SET address_key = 'stale'", is_source_db=True
+        )
+        with patch.multiple(
+            transformer, CANONICALIZATION_VERSION=0, IS_ADDRESSES_TABLE_PREPARED=False
+        ):
+            self.assertNotEqual(transformer.address_key_version(), version)
+            df_a = transformer.read_addresses(addresses=self.addresses)
+        self.assertEqual(sorted(df_a["address_id"].tolist()), [1, 2])
+        indexes = read_query_from_database(
+            query="SELECT indexdef FROM pg_indexes WHERE tablename = 'test_addresses' "
+            + "AND indexname LIKE '%address_key%'",
+            is_source_db=True,
+        )["indexdef"].tolist()
+        self.assertEqual(len(indexes), 1)
+        self.assertNotIn("UNIQUE", indexes[0])
+
+
+class TestAddressCanonicalizer(unittest.TestCase):
+
+    def test_spellings_share_canonical_key(self):
+        """Test that the spellings of an address are mapped to a single key"""
+        spellings = [
+            [
+                "Санкт-Петербург, Пулковское шоссе, 42к6",
+                "Пулковское ш., д. 42, корпус 6",
+                "пулковское  шоссе , дом 42 к. 6",
+            ],
+            [
+                "Санкт-Петербург, Парголово, улица Фёдора Абрамова, 8А",
+                "Парголово, Федора Абрамова ул., д. 8, лит. А",
+            ],
+            [
+                "Ленинградская область, Всеволожский район, Кудрово, "
+                + "Европейский проспект, 14",
+                "Кудрово, Европейский просп., 14",
+            ],
+        ]
+        keys = [
+            set([transformer.ADDRESS_CANONICALIZER.canonicalize(x) for x in y])
+            for y in spellings
+        ]
+        self.assertEqual([len(x) for x in keys], [1, 1, 1])
+        self.assertEqual(len(set.union(*keys)), 3)
+
+    def test_ambiguous_abbreviations_are_kept(self):
+        """Test that 'пр' and 'пос' are not taken for a street type"""
+        canonicalize = transformer.ADDRESS_CANONICALIZER.canonicalize
+        self.assertNotEqual(
+            canonicalize("Лиговский пр., 10"), canonicalize("Лиговский проспект, 10")
+        )
+        self.assertNotEqual(
+            canonicalize("Лиговский пр., 10"), canonicalize("Лиговский проезд, 10")
+        )
+        self.assertEqual(canonicalize("пос. Шушары, 7"), "пос шушары, 7")
+
+
+class TestRealtyYaTransformer(unittest.TestCase):
+
+    @patch("etl.transformer.transform_address_info", locate_addresses)
+    def test_parallel_transform_matches_transform(self):
+        """Test that the parallel transform gives the same data in the same order"""
+        transformer = RealtyYaTransformer()
+        transformer.config["parallel"]["enabled"] = False
+        expected = transformer.transform(df=raw_data(n_rows=50), return_data=True)
+        transformer.config["parallel"]["enabled"] = True
+        transformer.config["parallel"]["chunk_size"] = 16
+        transformer.config["parallel"]["workers"] = 2
+        df = transformer.transform(df=raw_data(n_rows=50), return_data=True)
+        self.assertTrue(expected.equals(df), f"\n{expected}\n{df}")
+        self.assertEqual(
+            df.columns[:4].tolist(), ["offer_id", "date_parsed", "address_id", "n_rooms"]
+        )
+        self.assertEqual(df["offer_id"].tolist(), list(range(50)))
+
+
+class TestVectorizedTransforms(unittest.TestCase):
+
+    def assert_same_features(self, func, vectorized_func, records: list):
+        """Asserts that both transforms give the same features"""
+        series = pd.Series(records, index=[x * 3 + 1 for x in range(len(records))])
+        expected = pd.DataFrame(
+            series.apply(lambda x: func(raw_content=x)).tolist(), index=series.index
+        )
+        output = vectorized_func(series=series)
+        expected.columns = output.columns
+        self.assertTrue(expected.equals(output), f"\n{expected}\n{output}")
+
+    def test_vectorized_flat_type(self):
+        """Test that the vectorized flat_type transform gives the same features"""
+        records = ["2-комнатная квартира", "квартира-студия", "1-комн и 2-комн"]
+        self.assert_same_features(
+            transform_flat_type, vectorized_transform_flat_type, records[:1] * 2
+        )
+        self.assert_same_features(
+            transform_flat_type,
+            vectorized_transform_flat_type,
+            records + ["квартира", None, 5],
+        )
+
+    def test_vectorized_main_info(self):
+        """Test that the vectorized main_info transform gives the same features"""
+        records = [
+            ["45 м²общая", "3 этаж из 9", "потолки 2,7 м", "1975 год постройки"],
+            ["32,5 м²общая", "12 этаж из 25", "2 этаж", "общая 30 м², 5 этаж"],
+        ]
+        self.assert_same_features(
+            transform_main_info, vectorized_transform_main_info, records[:1]
+        )
+        self.assert_same_features(
+            transform_main_info,
+            vectorized_transform_main_info,
+            records + [[], None, ["45 м²общая", None], ["кухня 10 м²"]],
+        )
+
+    def test_vectorized_fee_info(self):
+        """Test that the vectorized fee_info transform gives the same features"""
+        records = [
+            ["есть", "100 %", "включены", "45 000 ₽"],
+            ["30 000 ₽", "50 %", "не включены", "30 000 ₽"],
+            ["0 ₽", "0 %", "включены", "120 000 ₽"],
+        ]
+        self.assert_same_features(
+            transform_fee_info, vectorized_transform_fee_info, records[1:]
+        )
+        self.assert_same_features(
+            transform_fee_info,
+            vectorized_transform_fee_info,
+            records + [[None, None, None, "45 000 ₽"], None, [1, "2", "3", "4"]],
+        )
+
+    def test_extra_features_index(self):
+        """Test that the inverted index gives the same features as the config scan"""
+        records = [
+            ["Балкон и лоджия", "Лифт", "Мебель"],
+            ["Балкон", "Балкон и лоджия", "Лоджия", "Две лоджии"],
+            ["Лифт", "Лифта нет", "Интернет", "Окна пластиковые"],
+            ["Два балкона", "Балкон и лоджия", "Индивидуальный проект"],
+            [],
+        ]
+        for record in records:
+            self.assertEqual(
+                transform_extra_features(raw_content=record),
+                scan_extra_features(raw_content=record),
+            )
+        self.assert_same_features(
+            transform_extra_features,
+            vectorized_transform_extra_features,
+            records + [None, ["Лифт", None]],
+        )
@@ -2,9 +2,14 @@ CREATE TABLE addresses (
     address_id SERIAL PRIMARY KEY,
     address_info VARCHAR(100),
     latitude DECIMAL(8, 5),
-    longitude DECIMAL(8, 5)
+    longitude DECIMAL(8, 5),
+    address_key VARCHAR(100),
+    address_key_version VARCHAR(32)
 );
 
+CREATE UNIQUE INDEX addresses_address_info_idx ON addresses (address_info);
+CREATE INDEX addresses_address_key_idx ON addresses (address_key);
+
 CREATE TABLE realty (
     offer_id BIGINT,
     date_parsed DATE,
@@ -14,4 +19,25 @@ CREATE TABLE realty (
     address_info VARCHAR(100),
     extra_features VARCHAR(100) ARRAY[35],
     PRIMARY KEY (offer_id, date_parsed)
-);
\ No newline at end of file
+);
+
+CREATE TABLE offer_index (
+    offer_id BIGINT PRIMARY KEY,
+    fingerprint VARCHAR(32),
+    date_fetched DATE,
+    date_seen DATE
+);
+
+CREATE TABLE crawl_tasks (
+    task_id BIGSERIAL PRIMARY KEY,
+    date_parsed DATE,
+    kind VARCHAR(10),
+    url VARCHAR(200),
+    status VARCHAR(10) DEFAULT 'pending',
+    worker_id VARCHAR(100),
+    lease_expires_at TIMESTAMP WITH TIME ZONE,
+    attempts INTEGER DEFAULT 0,
+    UNIQUE (date_parsed, kind, url)
+);
+
+CREATE INDEX crawl_tasks_claim_idx ON crawl_tasks (date_parsed, status);